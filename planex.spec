@@ -36,11 +36,15 @@ and caching.
 %doc CHANGES
 %{_bindir}/planex-build
 %{_bindir}/planex-cache
+%{_bindir}/planex-cache-daemon
+%{_bindir}/planex-cache-server
+%{_bindir}/planex-cache-gc
 %{_bindir}/planex-clone
 %{_bindir}/planex-configure
 %{_bindir}/planex-downloader
 %{_bindir}/planex-makedeb
 %{_bindir}/planex-depend
+%{_bindir}/planex-repodata
 %{python_sitelib}/planex-*.egg-info
 %{python_sitelib}/planex
 
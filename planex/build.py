@@ -7,19 +7,31 @@ import sys
 import os
 import glob
 import shutil
-import rpm
 import hashlib
 import time
+import threading
+import Queue
 
 from planex.globals import (BUILD_ROOT_DIR, SRPMS_DIR, RPMS_DIR, BUILD_DIR,
-                            MOCK_DIR, SPECS_GLOB)
-
-from planex.util import (bcolours, print_col, run)
+                            MOCK_DIR)
+from planex.srpm import get_srpm_infos
+from planex import repodata
+from planex import cachegc
+from planex import cacheentry
+from planex import failcache
+from planex.exceptions import BuildFailed
+from planex.digestcache import file_digests
+
+from planex.util import (bcolours, print_col, run, link_or_copy,
+                         make_read_only)
 
 TMP_RPM_PATH = "/tmp/RPMS"
 RPM_TOP_DIR = os.path.join(os.getcwd(), BUILD_ROOT_DIR)
 CACHE_DIR = "rpmcache"
+SRPM_INDEX = os.path.join(RPM_TOP_DIR, "srpm-index.json")
 DEFAULT_ARCH = "x86_64"
+RETRY_FAILED = False
+FAILURE_TTL = failcache.DEFAULT_TTL
 
 
 def doexec(args, inputtext=None, check=True):
@@ -29,25 +41,6 @@ def doexec(args, inputtext=None, check=True):
     return run(args, check=check, env=myenv, inputtext=inputtext)
 
 
-def get_srpm_info(srpm):
-    for spec_path in glob.glob(SPECS_GLOB):
-        os.unlink(spec_path)
-    myenv = os.environ.copy()
-    myenv['HOME'] = RPM_TOP_DIR
-    run(["rpm", "-i", srpm], check=True, env=myenv)
-    myspecfile = glob.glob(SPECS_GLOB)[0]
-    spec = rpm.ts().parseSpec(myspecfile)
-    info = {}
-    info['deps'] = spec.sourceHeader["requires"]
-    info['arch'] = DEFAULT_ARCH
-    info['packages'] = [{'name': p.header['name']} for p in spec.packages]
-    info['srcrpm'] = srpm
-    content_file = open(myspecfile, 'r')
-    info['spec'] = content_file.read()
-    content_file.close()
-    return info
-
-
 def extract_target(srpm_infos, srpm_filename):
     """
     Given a list of srpm_info and an srpm filename, return the target arch
@@ -111,59 +104,48 @@ def write_rpmmacros():
     rpmmacros.close()
 
 
-def find_pkg(srpm_infos, srpm):
-    for srpm_info in srpm_infos:
-        if srpm_info["srcrpm"] == srpm:
-            return srpm_info
-
-
-def get_pkg_ddeps(deps, srpm):
-    if srpm in deps:
-        ddeps = []
-        for dep in deps[srpm]:
-            ddeps.append(dep)
-            for ddep in get_pkg_ddeps(deps, dep):
-                ddeps.append(ddep)
-        return ddeps
-    else:
-        return []
-
-
-def get_srpm_hash(srpm_infos, external, deps, srpm):
-    allpkgs = get_pkg_ddeps(deps, srpm)
-    allpkgs.append(srpm)
-    allpkgs.sort()
-    srpm_hash = hashlib.md5()
-    for mypkg in allpkgs:
-        srpm_info = find_pkg(srpm_infos, mypkg)
-        srpm_hash.update(srpm_info['spec'])
-    srpm_hash.update(external)
-    return srpm_hash.hexdigest()
+def get_cache_keys(srpm_infos, external, deps, order):
+    """
+    Return a table mapping each SRPM to its cache key.   The key of an
+    SRPM is a hash of its spec, the keys of the SRPMs it depends on and
+    the external dependencies, so a change anywhere in its dependency tree
+    changes the key.   SRPMs are visited in dependency order, so each key
+    is computed exactly once.
+    """
+    spec_digests = dict((srpm_info['srcrpm'], srpm_info['spec_digest'])
+                        for srpm_info in srpm_infos)
+    keys = {}
+    for batch in order:
+        for srpm in sorted(batch):
+            srpm_hash = hashlib.md5()
+            srpm_hash.update(spec_digests[srpm])
+            for dep in sorted(deps.get(srpm, [])):
+                srpm_hash.update(keys[dep])
+            srpm_hash.update(external)
+            keys[srpm] = srpm_hash.hexdigest()
+    return keys
 
 
 def get_external_hash(external_deps):
     external_deps.sort()
+    digests = file_digests(external_deps)
     external_hash = hashlib.md5()
     for dep in external_deps:
-        with open(dep, "rb") as dep_file:
-            for block in iter(lambda: dep_file.read(1024), ""):
-                external_hash.update(block)
+        external_hash.update(digests[dep])
     return external_hash.hexdigest()
 
 
-def get_cache_dir(srpm_infos, external, deps, srpm):
+def get_cache_dir(cache_key):
     if not os.path.exists(CACHE_DIR):
         return None
-    myhash = get_srpm_hash(srpm_infos, external, deps, srpm)
-    dst_dir = os.path.join(CACHE_DIR, myhash)
+    dst_dir = os.path.join(CACHE_DIR, cache_key)
     return dst_dir
 
 
-def need_to_build(srpm_infos, external, deps, srpm):
-    dst_dir = get_cache_dir(srpm_infos, external, deps, srpm)
-    if not dst_dir:
+def need_to_build(cache_dir):
+    if not cache_dir:
         return True
-    return not os.path.exists(dst_dir)
+    return not cacheentry.is_complete(cache_dir)
 
 
 def get_new_number(srpm, cache_dir):
@@ -190,69 +172,99 @@ def get_new_number(srpm, cache_dir):
 
 
 def createrepo():
-    run(["createrepo", "--update", RPMS_DIR])
+    """Make packages added since the last call visible to yum"""
+    repodata.refresh(RPMS_DIR)
 
 
-def do_build(srpm, target, build_number, use_mock, xs_build_sys):
+def do_build(srpm, target, build_number, use_mock, xs_build_sys,
+             resultdir=TMP_RPM_PATH, uniqueext=None):
     if xs_build_sys:
         mock = ["/usr/bin/mock"]
     else:
         mock = ["planex-cache", "--debug"]
     if use_mock:
         cmd = mock + ["--configdir=%s" % MOCK_DIR,
-                      "--resultdir=%s" % TMP_RPM_PATH, "--rebuild",
+                      "--resultdir=%s" % resultdir, "--rebuild",
                       "--target", target,
                       # "--enable-plugin=tmpfs",
                       "--define", "extrarelease .%d" % build_number,
                       "-v"]
         if not xs_build_sys:
-            cmd = cmd + ["--disable-plugin=package_state"]
+            cmd = cmd + ["--disable-plugin=package_state",
+                         "--failure-ttl=%d" % FAILURE_TTL]
+            if RETRY_FAILED:
+                cmd = cmd + ["--retry-failed"]
+        # Concurrent mock builds must not share a chroot
+        if uniqueext:
+            cmd = cmd + ["--uniqueext=%s" % uniqueext]
     else:
         cmd = ["rpmbuild", "--rebuild", "-v",
                "--target", target, "--define",
-               "_build_name_fmt %%{NAME}-%%{VERSION}-%%{RELEASE}.%%{ARCH}.rpm"]
+               "_build_name_fmt %%{NAME}-%%{VERSION}-%%{RELEASE}.%%{ARCH}.rpm",
+               "--define", "_rpmdir %s" % resultdir]
 
-    res = run(cmd + [srpm])
+    res = run(cmd + [srpm], check=False)
+    if res['rc'] != 0:
+        raise BuildFailed(failcache.build_log_tail(
+            resultdir, res['stdout'] + res['stderr']))
 
     print "stdout: %s" % res['stdout']
-    srpms = glob.glob(os.path.join(TMP_RPM_PATH, "*.src.rpm"))
+    srpms = glob.glob(os.path.join(resultdir, "*.src.rpm"))
     for srpm in srpms:
         print_col(bcolours.WARNING, "Removing SRPM %s" % srpm)
         os.unlink(srpm)
 
-    return glob.glob(os.path.join(TMP_RPM_PATH, "*.rpm"))
+    return glob.glob(os.path.join(resultdir, "*.rpm"))
 
 
-def build_srpm(srpm, srpm_infos, external, deps, use_mock, xs_build_sys):
-    cache_dir = get_cache_dir(srpm_infos, external, deps, srpm)
+def build_srpm(srpm, srpm_infos, cache_keys, use_mock, xs_build_sys,
+               resultdir=TMP_RPM_PATH, uniqueext=None):
+    cache_dir = get_cache_dir(cache_keys[srpm])
+
+    if need_to_build(cache_dir):
+        failure = None
+        if cache_dir and not RETRY_FAILED:
+            failure = failcache.lookup([CACHE_DIR], cache_keys[srpm],
+                                       FAILURE_TTL)
+        if failure is not None:
+            print_col(bcolours.FAIL, "CACHED FAILURE: Not building %s" % srpm)
+            raise BuildFailed(failcache.describe(cache_keys[srpm], failure))
 
-    if need_to_build(srpm_infos, external, deps, srpm):
         target = extract_target(srpm_infos, srpm)
         build_number = get_new_number(srpm, cache_dir)
         print_col(bcolours.OKGREEN,
                   "CACHE MISS: Building %s (%d)" % (srpm, build_number))
         createrepo()
 
-        pkgs = do_build(srpm, target, build_number, use_mock, xs_build_sys)
+        start = time.time()
+        try:
+            pkgs = do_build(srpm, target, build_number, use_mock,
+                            xs_build_sys, resultdir, uniqueext)
+        except BuildFailed as exn:
+            if cache_dir:
+                failcache.record(CACHE_DIR, cache_keys[srpm], str(exn))
+            raise
+        build_time = time.time() - start
         if cache_dir:
             try:
-                os.makedirs(cache_dir + ".tmp")
+                tmp_dir = cacheentry.staging_dir(CACHE_DIR, cache_keys[srpm])
                 print "Archiving result in cache"
                 for pkg in pkgs:
-                    shutil.copy(pkg, cache_dir + ".tmp")
-                os.rename(cache_dir + ".tmp", cache_dir)
+                    link_or_copy(pkg, tmp_dir)
+                make_read_only(tmp_dir)
+                cachegc.record_build_time(tmp_dir, build_time)
+                cacheentry.publish(tmp_dir, cache_dir)
             except (OSError, IOError):
                 print bcolours.WARNING + \
                     "FAILED TO PUT BUILD RESULTS INTO CACHE"
 
     else:
         print_col(bcolours.OKGREEN, "CACHE HIT: Not building %s" % srpm)
-        pkgs = glob.glob(os.path.join(cache_dir, "*.rpm"))
-        for pkg in pkgs:
-            shutil.copy(pkg, TMP_RPM_PATH)
-        mytime = time.time()
-        os.utime(cache_dir, (mytime, mytime))
-        pkgs = glob.glob(os.path.join(TMP_RPM_PATH, "*.rpm"))
+        cachegc.touch(cache_dir)
+        # Link cached packages straight into RPMS rather than copying
+        # them through the temporary result directory
+        pkgs = [link_or_copy(pkg, RPMS_DIR) for pkg
+                in glob.glob(os.path.join(cache_dir, "*.rpm"))]
 
     if not use_mock:
         result = run(["rpm", "-U", "--force", "--nodeps"] + pkgs, check=False)
@@ -260,8 +272,72 @@ def build_srpm(srpm, srpm_infos, external, deps, use_mock, xs_build_sys):
             print "Ignoring failure installing rpm batch: %s" % pkgs
             print result['stderr']
 
-    for pkg in pkgs:
-        shutil.move(pkg, RPMS_DIR)
+    rpms = [os.path.join(RPMS_DIR, os.path.basename(pkg)) for pkg in pkgs]
+    for (pkg, rpm_path) in zip(pkgs, rpms):
+        if pkg != rpm_path:
+            shutil.move(pkg, RPMS_DIR)
+    repodata.add(RPMS_DIR, rpms)
+
+
+def build_parallel(deps, jobs, build_fn):
+    """
+    Call build_fn on every SRPM in deps, using up to jobs worker threads.
+    Each SRPM is started as soon as all of the SRPMs it depends on have
+    been built, rather than waiting for the rest of its batch to finish.
+    If a build fails, no further builds are started and the exception is
+    re-raised once the running builds have finished.
+    """
+    waiting = dict((srpm, set(srpm_deps)) for (srpm, srpm_deps)
+                   in deps.iteritems())
+    dependents = dict((srpm, []) for srpm in waiting)
+    for (srpm, srpm_deps) in waiting.iteritems():
+        for dep in srpm_deps:
+            dependents[dep].append(srpm)
+
+    ready = sorted(srpm for (srpm, srpm_deps) in waiting.iteritems()
+                   if not srpm_deps)
+    for srpm in ready:
+        del waiting[srpm]
+
+    finished = Queue.Queue()
+
+    def worker(srpm):
+        """Build one SRPM and report the outcome to the scheduler"""
+        try:
+            build_fn(srpm)
+            finished.put((srpm, None))
+        except Exception:  # pylint: disable=broad-except
+            finished.put((srpm, sys.exc_info()))
+
+    running = 0
+    failure = None
+    while ready or running:
+        while ready and running < jobs and not failure:
+            thread = threading.Thread(target=worker, args=(ready.pop(0),))
+            thread.daemon = True
+            thread.start()
+            running += 1
+
+        if not running:
+            break
+
+        # Queue.get() without a timeout cannot be interrupted by ^C
+        srpm, exc_info = finished.get(True, 1e9)
+        running -= 1
+
+        if exc_info:
+            print_col(bcolours.FAIL, "FAILED: %s" % srpm)
+            failure = failure or exc_info
+            continue
+
+        for dependent in dependents[srpm]:
+            waiting[dependent].discard(srpm)
+            if not waiting[dependent]:
+                del waiting[dependent]
+                ready.append(dependent)
+
+    if failure:
+        raise failure[0], failure[1], failure[2]
 
 
 def parse_cmdline(argv=None):
@@ -285,12 +361,30 @@ def parse_cmdline(argv=None):
         '--cache-dir',
         help='Root directory of the RPM cache',
         metavar="directory", default=None)
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1, metavar="N",
+        help='Number of SRPMs to build concurrently')
+    parser.add_argument(
+        '--retry-failed', action='store_true',
+        help='Build packages even if the same build failed recently')
+    parser.add_argument(
+        '--failure-ttl', type=failcache.parse_duration,
+        default=failcache.DEFAULT_TTL, metavar="DURATION",
+        help='Fail fast with the cached log for builds which failed less '
+             'than DURATION ago (e.g. 12h, default: 1d)')
+    parser.add_argument(
+        '--cache-max-size', type=cachegc.parse_size, default=None,
+        metavar="SIZE",
+        help='After building, evict cache entries until the RPM cache '
+             'uses no more than SIZE (e.g. 20G)')
     return parser.parse_args(argv)
 
 
 def main():
     global DEFAULT_ARCH
     global CACHE_DIR
+    global RETRY_FAILED
+    global FAILURE_TTL
 
     args = parse_cmdline()
     use_mock = not args.no_mock
@@ -299,6 +393,8 @@ def main():
         DEFAULT_ARCH = "i686"
     if args.cache_dir:
         CACHE_DIR = args.cache_dir
+    RETRY_FAILED = args.retry_failed
+    FAILURE_TTL = args.failure_ttl
 
     if not os.path.isdir(SRPMS_DIR) or not os.listdir(SRPMS_DIR):
         print ("Error: No srpms found in %s; First run configure.py." %
@@ -307,10 +403,12 @@ def main():
 
     packages = glob.glob(os.path.join(SRPMS_DIR, '*.src.rpm'))
     write_rpmmacros()
-    srpm_infos = [get_srpm_info(pkg) for pkg in packages]
+    srpm_infos = get_srpm_infos(packages, SRPM_INDEX, RPM_TOP_DIR,
+                                DEFAULT_ARCH)
     deps = get_deps(srpm_infos)
     order = toposort2(deps)
     external = get_external_hash(args.external_dependencies)
+    cache_keys = get_cache_keys(srpm_infos, external, deps, order)
 
     for path in (TMP_RPM_PATH, BUILD_DIR, RPMS_DIR):
         if os.path.exists(path):
@@ -321,12 +419,36 @@ def main():
 
     createrepo()
 
-    for batch in order:
-        for srpm in batch:
-            build_srpm(srpm, srpm_infos, external, deps, use_mock,
-                       xs_build_sys)
+    def build_one(srpm):
+        """
+        Build srpm in its own result directory, so that the logs saved
+        if it fails are not those of an earlier build, and when running
+        builds concurrently, in its own mock chroot
+        """
+        name = os.path.basename(srpm)[:-len(".src.rpm")]
+        resultdir = os.path.join(TMP_RPM_PATH, name)
+        os.makedirs(resultdir)
+        uniqueext = name if args.jobs > 1 else None
+        build_srpm(srpm, srpm_infos, cache_keys, use_mock,
+                   xs_build_sys, resultdir=resultdir, uniqueext=uniqueext)
+        shutil.rmtree(resultdir)
+
+    try:
+        if args.jobs > 1:
+            build_parallel(deps, args.jobs, build_one)
+        else:
+            for batch in order:
+                for srpm in batch:
+                    build_one(srpm)
+    except BuildFailed as exn:
+        print_col(bcolours.FAIL, "ERROR: build failed")
+        print str(exn)
+        sys.exit(1)
 
     createrepo()
 
+    if args.cache_max_size is not None:
+        cachegc.collect(CACHE_DIR, args.cache_max_size)
+
 if __name__ == '__main__':
     main()
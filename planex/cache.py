@@ -5,19 +5,30 @@ planex-cache: A caching wrapper around mock for building RPMs
 """
 
 import argparse
+import contextlib
 import hashlib
 import os
 import rpm
 import shutil
 import sys
 import tempfile
-import yum
 from planex import util
 import itertools
 import logging
+import time
+from planex import cachegc
+from planex import reqindex
+from planex import httpcache
+from planex import cacheentry
+from planex import cachemanifest
+from planex import chrootpool
+from planex import exceptions
+from planex import failcache
+from planex import mockconfig
+from planex import pkgcache
 from planex.globals import PLANEX_REPO_NAME
 
-PLANEX_CACHE_SALT = "planex-cache-1"
+PLANEX_CACHE_SALT = "planex-cache-3"
 
 
 def parse_args_or_exit(argv=None):
@@ -30,7 +41,64 @@ def parse_args_or_exit(argv=None):
         help='Print debugging information')
     parser.add_argument(
         '--cachedirs', default='~/.planex-cache:/misc/cache/planex-cache',
-        help='colon-separated cache search path')
+        help='colon-separated cache search path.   Entries may be local '
+             'directories or http:// URLs of remote caches; local '
+             'directories are searched first and the first one receives '
+             'new entries')
+    parser.add_argument(
+        '--no-push', action='store_true', default=False,
+        help='Do not upload new builds to remote caches')
+    parser.add_argument(
+        '--remote-jobs', type=int, default=httpcache.DEFAULT_JOBS,
+        metavar="N",
+        help='Number of files to transfer in parallel from remote caches')
+    parser.add_argument(
+        '--explain', action='store_true', default=False,
+        help='Do not build; instead report whether the package is in the '
+             'cache and, if not, which inputs to its hash differ from those '
+             'of the nearest cached build of the same package')
+    parser.add_argument(
+        '--retry-failed', action='store_true', default=False,
+        help='Build the package even if the same build failed recently')
+    parser.add_argument(
+        '--failure-ttl', type=failcache.parse_duration,
+        default=failcache.DEFAULT_TTL, metavar="DURATION",
+        help='Fail fast with the cached log for builds which failed less '
+             'than DURATION ago (e.g. 12h, default: 1d)')
+    parser.add_argument(
+        '--chroot-slots', type=int, default=0, metavar="N",
+        help='Build in one of a pool of N warm mock chroots, reusing a '
+             'chroot which already has most of the build requirements '
+             'installed (default: build in a clean chroot)')
+    parser.add_argument(
+        '--chroot-reuse-threshold', type=float,
+        default=chrootpool.DEFAULT_REUSE_THRESHOLD, metavar="FRACTION",
+        help='Reuse a pooled chroot if everything installed in it is '
+             'needed by the build and it already has at least FRACTION of '
+             'the build requirements installed (default: %(default)s)')
+    parser.add_argument(
+        '--package-cache', default=None, metavar="DIR",
+        help='Share downloaded build requirements between mock roots '
+             'through a content-addressed package cache in DIR')
+    parser.add_argument(
+        '--package-cache-size', type=cachegc.parse_size,
+        default=pkgcache.DEFAULT_MAX_SIZE, metavar="SIZE",
+        help='After building, evict packages until the package cache uses '
+             'no more than SIZE (e.g. 5G, default: 10G)')
+    parser.add_argument(
+        '--config-keys', type=mockconfig.parse_keys, default=None,
+        metavar="KEYS",
+        help='Comma-separated mock config_opts which affect the cache key '
+             '(default: %s)' % ",".join(mockconfig.DEFAULT_KEYS))
+    parser.add_argument(
+        '--ignore-config-keys', type=mockconfig.parse_keys, default=[],
+        metavar="KEYS",
+        help='Comma-separated mock config_opts to leave out of the cache key')
+    parser.add_argument(
+        '--max-cache-size', type=cachegc.parse_size, default=None,
+        metavar="SIZE",
+        help='After adding to the cache, evict entries until the first '
+             'cache directory uses no more than SIZE (e.g. 20G)')
 
     # Overridden mock arguments.  Help text taken directly from mock.
     parser.add_argument(
@@ -90,57 +158,72 @@ def in_cache(cachedirs, pkg_hash):
     """
     Return true if build products with the given hash are in the cache
     """
-    return any(os.path.isdir(x) for x in cache_locations(cachedirs, pkg_hash))
+    return any(cacheentry.is_complete(x)
+               for x in cache_locations(cachedirs, pkg_hash))
 
 
-def add_to_cache(cachedirs, pkg_hash, build_dir):
+def add_to_cache(cachedirs, pkg_hash, build_dir, build_time,
+                 manifest=None):
     """
-    Add the build products in build_dir to the cache
+    Add the build products in build_dir to the cache, recording how
+    long they took to build for the cache garbage collector and the
+    manifest of the inputs to pkg_hash.   The entry is assembled out of
+    sight and published atomically.
     """
     cache_dir = cache_locations(cachedirs, pkg_hash)[0]
-    assert not os.path.isdir(cache_dir)
-
-    if not os.path.isdir(cachedirs[0]):
-        os.makedirs(cachedirs[0])
+    tmp_dir = cacheentry.staging_dir(cachedirs[0], pkg_hash)
+    if manifest is not None:
+        cachemanifest.write(tmp_dir, manifest)
 
-    cache_output_dir = os.path.join(cache_dir, "output")
+    cache_output_dir = os.path.join(tmp_dir, "output")
     shutil.move(build_dir, cache_output_dir)
-    logging.debug("moved to %s", cache_output_dir)
+    util.make_read_only(cache_output_dir)
+    cachegc.record_build_time(tmp_dir, build_time)
+    cacheentry.publish(tmp_dir, cache_dir)
+    logging.debug("published %s", cache_dir)
 
 
 def get_from_specified_cache(cache_dir, resultdir):
     """
-    Copy the build products in the specific location to resultdir
+    Make the build products in the specific location available in
+    resultdir, hardlinking them if possible
     """
     build_output = os.path.join(cache_dir, "output")
+    cachegc.touch(cache_dir)
 
     if not os.path.isdir(resultdir):
         os.makedirs(resultdir)
 
     for cached_file in os.listdir(build_output):
-        shutil.copy(os.path.join(build_output, cached_file), resultdir)
+        util.link_or_copy(os.path.join(build_output, cached_file), resultdir)
 
 
 def get_from_cache(cachedirs, pkg_hash, resultdir):
     """
-    Copy the build products specified by the hash to resultdir
+    Copy the build products specified by the hash to resultdir.
+    Raises NoSuchFile if there is no complete entry for the hash.
     """
     possibilities = cache_locations(cachedirs, pkg_hash)
     print "possibilities: %s" + ",".join(possibilities)
-    cache_dir = next(itertools.ifilter(os.path.isdir, possibilities), None)
-    if cache_dir:
-        get_from_specified_cache(cache_dir, resultdir)
+    cache_dir = next(itertools.ifilter(cacheentry.is_complete, possibilities),
+                     None)
+    if cache_dir is None:
+        raise exceptions.NoSuchFile("No complete cache entry for %s in %s\n" %
+                                    (pkg_hash, ":".join(cachedirs)))
+    get_from_specified_cache(cache_dir, resultdir)
 
 
-def get_srpm_hash(srpm, yumbase, mock_config):
+def get_srpm_manifest(srpm, index, mock_config):
     """
-    Calculate the cache hash of srpm, including the hashes of its build
+    Return the manifest of the inputs to the cache hash of srpm: the
+    digests of its contents and of the packages satisfying its build
     dependencies.  Only the first layer of dependencies are hashed -
     as OCaml libraries are statically linked this should be sufficient.
+    Build dependencies are looked up in index, a RequirementIndex.
+    mock_config is the normalised mock configuration.
     """
-    pkg_hash = hashlib.md5()
-    pkg_hash.update(PLANEX_CACHE_SALT)
-    pkg_hash.update(mock_config)
+    manifest = {"name": srpm.name, "salt": PLANEX_CACHE_SALT,
+                "mock_config": mock_config, "sources": [], "requires": {}}
 
     if srpm.filedigestalgo:
         logging.debug("Hashes of SRPM contents (%s):",
@@ -148,36 +231,109 @@ def get_srpm_hash(srpm, yumbase, mock_config):
 
     for name, digest in zip(srpm.filenames, srpm.filedigests):
         logging.debug("  %s: %s", name, digest)
-        pkg_hash.update(digest)
+        manifest["sources"].append([name, digest])
 
     logging.debug("Build-time requirements:")
     for req in sorted(srpm.requires):
+        pkgs = index.lookup(req)
+        if not pkgs:
+            logging.debug("  %s: not in the planex repository", req)
+        manifest["requires"][req] = []
+        for pkg in pkgs:
+            logging.debug("  %s: %s (%s: %s)", req, pkg["pkg"], pkg["algo"],
+                          pkg["checksum"])
+            logging.debug("  File hashes (%s):",
+                          RFC4880_HASHES[pkg["digestalgo"]])
+            files_hash = hashlib.md5()
+            for name, digest in pkg["files"]:
+                logging.debug("    %s: %s", name, digest)
+                files_hash.update(digest)
+            manifest["requires"][req].append(
+                {"pkg": pkg["pkg"], "checksum": pkg["checksum"],
+                 "files": files_hash.hexdigest()})
+
+    return manifest
+
+
+def strip_uniqueext(passthrough_args):
+    """Remove any --uniqueext option from mock arguments"""
+    args = []
+    skip = False
+    for arg in passthrough_args:
+        if skip:
+            skip = False
+        elif arg == "--uniqueext":
+            skip = True
+        elif not arg.startswith("--uniqueext="):
+            args.append(arg)
+    return args
+
+
+def chroot_repos(mock_config):
+    """Return the names of the repositories enabled in the mock chroot"""
+    repos = mockconfig.normalise_yum_conf(mock_config.yum_config['yum.conf'])
+    if not isinstance(repos, dict):
+        return []
+    return sorted(repo for (repo, options) in repos.items()
+                  if repo != "main" and
+                  options.get("enabled", "1") not in ["0", "no", "false"])
+
+
+def base_repo_revisions(mock_config):
+    """
+    Return the metadata revisions of the repositories other than the
+    planex repository which the mock chroot installs packages from, or
+    None if they cannot all be read.   Packages from these repositories
+    are not identified in the cache manifest.
+    """
+    revisions = {}
+    for repo_id in chroot_repos(mock_config):
+        if repo_id == PLANEX_REPO_NAME:
+            continue
         try:
-            pkgs = yumbase.pkgSack.returnNewestByNameArch(patterns=[req])
-            for pkg in pkgs:
-                algo, checksum, _ = pkg.returnChecksums()[0]
-                logging.debug("  %s: %s (%s: %s)", req, pkg, algo, checksum)
-                pkg_hash.update(checksum)
-
-                yumbase.downloadHeader(pkg)
-                hdr = pkg.returnLocalHeader()
-                logging.debug("  File hashes (%s):",
-                              RFC4880_HASHES[hdr.filedigestalgo])
-                for name, digest in zip(hdr.filenames, hdr.filedigests):
-                    logging.debug("    %s: %s", name, digest)
-                    pkg_hash.update(digest)
-
-        except yum.Errors.PackageSackError as pse:
-            logging.debug("  %s", pse)
+            repo_xml = mock_config.yumbase.repos.getRepo(repo_id).repoXML
+        except Exception as exn:  # pylint: disable=broad-except
+            logging.debug("Cannot read metadata of %s: %s", repo_id, exn)
+            return None
+        revisions[repo_id] = "%s:%s" % (repo_xml.revision,
+                                        repo_xml.timestamp)
+    return revisions
 
-    logging.debug("Package hash: %s", pkg_hash.hexdigest())
-    return pkg_hash.hexdigest()
 
-
-def build_package(configdir, root, passthrough_args):
+def build_in_pool(intercepted_args, passthrough_args, mock_config, cachedirs,
+                  manifest, cwd=None):
+    """
+    Build the package in a chroot from the pool, returning the mock
+    output directory.   A chroot is only reused if the base repositories
+    have not changed since it was last used.
+    """
+    pool = chrootpool.ChrootPool(
+        os.path.join(cachedirs[0], chrootpool.POOL_DIR),
+        intercepted_args.root, intercepted_args.chroot_slots,
+        intercepted_args.chroot_reuse_threshold)
+    base_repos = base_repo_revisions(mock_config)
+    config = None
+    if base_repos is not None:
+        config = cachemanifest.manifest_hash(
+            {"mock_config": manifest.get("mock_config", {}),
+             "base_repos": base_repos})
+    wanted = chrootpool.installed_requirements(manifest)
+
+    with pool.slot(config, wanted) as (slot, reuse):
+        mock_args = ["--uniqueext=%s" % slot.uniqueext, "--no-cleanup-after"]
+        if reuse:
+            mock_args.append("--no-clean")
+        return build_package(intercepted_args.configdir,
+                             intercepted_args.root,
+                             mock_args + strip_uniqueext(passthrough_args),
+                             cwd)
+
+
+def build_package(configdir, root, passthrough_args, cwd=None):
     """
     Spawn a mock process to build the package.   Some arguments
-    are intercepted and rewritten, for instance --resultdir.
+    are intercepted and rewritten, for instance --resultdir.   Raises
+    BuildFailed, with the tail of the build logs, if mock fails.
     """
     working_directory = tempfile.mkdtemp(prefix="planex-cache")
     logging.debug("Mock working directory: %s", working_directory)
@@ -186,46 +342,278 @@ def build_package(configdir, root, passthrough_args):
            "--root=%s" % root,
            "--resultdir=%s" % working_directory] + passthrough_args
 
-    util.run(cmd)
+    result = util.run(cmd, check=False, cwd=cwd)
+    if result["rc"] != 0:
+        log = failcache.build_log_tail(working_directory,
+                                       result["stdout"] + result["stderr"])
+        shutil.rmtree(working_directory, ignore_errors=True)
+        raise exceptions.BuildFailed(log)
     return working_directory
 
 
-def main(argv):
+def planex_repo_dir(yumbase):
     """
-    Main function.  Parse spec file and iterate over its sources, downloading
-    them as appropriate.
+    Return the local directory holding the planex repository, or None
+    if the repository is not local
     """
-    intercepted_args, passthrough_args = parse_args_or_exit(argv)
-    config = os.path.join(intercepted_args.configdir,
-                          intercepted_args.root + ".cfg")
+    for url in yumbase.repos.getRepo(PLANEX_REPO_NAME).baseurl:
+        if url.startswith("file://"):
+            return url[len("file://"):]
+    return None
+
+
+def refresh_repo(yumbase):
+    """
+    Make YUM reread the metadata of the planex repository the next time
+    the package sack is used
+    """
+    yumbase.repos.getRepo(PLANEX_REPO_NAME).metadata_expire = 0
+    del yumbase.pkgSack
+
+
+def repo_revision(yumbase):
+    """
+    Return a value which changes whenever the metadata of the local
+    planex repository is updated
+    """
+    repodir = planex_repo_dir(yumbase)
+    if repodir is None:
+        return None
+    return reqindex.repo_revision(repodir)
+
 
+class MockConfig(object):
+    """
+    A mock configuration file, together with the YUM database it
+    describes.   Loading these is the expensive part of planex-cache,
+    so the cache daemon keeps them for as long as they are up to date.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.yum_config = util.load_mock_config(path)
+        self.yumbase = util.get_yumbase(self.yum_config)
+        setup_yumbase(self.yumbase)
+        self.revision = repo_revision(self.yumbase)
+        self.index = reqindex.RequirementIndex(planex_repo_dir(self.yumbase))
+
+    def is_stale(self):
+        """
+        Return True if the configuration file has changed since the
+        configuration was loaded
+        """
+        return os.path.getmtime(self.path) != self.mtime
+
+    def refresh(self):
+        """
+        Reload the planex repository metadata if the repository has been
+        updated since it was loaded.   The rest of the YUM state is kept.
+        """
+        revision = repo_revision(self.yumbase)
+        if revision != self.revision:
+            logging.debug("Reloading %s metadata", PLANEX_REPO_NAME)
+            refresh_repo(self.yumbase)
+            self.revision = revision
+
+    def resultdir(self):
+        """Expand default resultdir as done in mock.backend.Root"""
+        return self.yum_config['resultdir'] % self.yum_config
+
+
+def config_path(intercepted_args):
+    """Return the path of the mock configuration file to use"""
+    return os.path.join(intercepted_args.configdir,
+                        intercepted_args.root + ".cfg")
+
+
+def get_cachedirs(intercepted_args):
+    """
+    Return the list of local cache directories to search, and the list
+    of remote caches to search if the package is not found locally
+    """
+    locations = httpcache.split_cachedirs(intercepted_args.cachedirs)
+    cachedirs = [os.path.expanduser(x) for x in locations
+                 if not httpcache.is_remote(x)]
+    remotes = [httpcache.HttpCache(x, intercepted_args.remote_jobs)
+               for x in locations if httpcache.is_remote(x)]
+    return (cachedirs, remotes)
+
+
+def fetch_from_remote(cachedirs, remotes, pkg_hash):
+    """
+    Look for pkg_hash in the remote caches.   If it is found, download
+    it into the first local cache directory and return True.
+    """
+    for remote in remotes:
+        try:
+            if remote.exists(pkg_hash):
+                logging.debug("Remote cache hit in %s", remote.url)
+                tmp_dir = cacheentry.staging_dir(cachedirs[0], pkg_hash)
+                try:
+                    remote.fetch(pkg_hash, tmp_dir)
+                    util.make_read_only(tmp_dir)
+                    cacheentry.publish(
+                        tmp_dir, cache_locations(cachedirs, pkg_hash)[0])
+                except:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    raise
+                return True
+        except (IOError, OSError) as exn:
+            logging.warning("Failed to fetch %s from %s: %s",
+                            pkg_hash, remote.url, exn)
+    return False
+
+
+def push_to_remotes(cachedirs, remotes, pkg_hash):
+    """Upload a newly-built entry to the remote caches"""
+    entry_dir = cache_locations(cachedirs, pkg_hash)[0]
+    for remote in remotes:
+        try:
+            remote.upload(pkg_hash, entry_dir)
+        except (IOError, OSError) as exn:
+            logging.warning("Failed to upload %s to %s: %s",
+                            pkg_hash, remote.url, exn)
+
+
+def hash_srpm_file(srpm_path, mock_config, config_keys=None,
+                   ignored_config_keys=None):
+    """
+    Return the cache hash of the SRPM at srpm_path, and the manifest of
+    the inputs to the hash.   Only the mock configuration options listed
+    in config_keys, less those in ignored_config_keys, are hashed.
+    """
+    srpm = load_srpm_from_file(srpm_path)
+    mock_config.refresh()
+    mock_config.index.update(mock_config.yumbase)
+    normalised = mockconfig.normalise(mock_config.yum_config, config_keys,
+                                      ignored_config_keys)
+    manifest = get_srpm_manifest(srpm, mock_config.index, normalised)
+    pkg_hash = cachemanifest.manifest_hash(manifest)
+    logging.debug("Package hash: %s", pkg_hash)
+    return (pkg_hash, manifest)
+
+
+@contextlib.contextmanager
+def shared_package_cache(intercepted_args, mock_config):
+    """
+    Prepare the shared package cache, if one was requested, for a build
+    with mock_config.   Yields the extra mock arguments needed to use it
+    and collects the packages downloaded by the build afterwards.
+    """
+    if not intercepted_args.package_cache:
+        yield []
+        return
+
+    pkgs = pkgcache.PackageCache(
+        os.path.expanduser(intercepted_args.package_cache))
+    root = mock_config.yum_config['root']
+    yum_cache_dir = pkgs.seed(root, chroot_repos(mock_config))
+    try:
+        yield ["--plugin-option=yum_cache:dir=%s" % yum_cache_dir]
+    finally:
+        pkgs.harvest(root)
+        pkgs.evict(intercepted_args.package_cache_size)
+
+
+def build_or_fail_fast(intercepted_args, passthrough_args, mock_config,
+                       cachedirs, pkg_hash, manifest, cwd=None):
+    """
+    Build the package, unless the same build failed recently, and
+    return the mock output directory and the build time.   Failures
+    are recorded in the negative cache.
+    """
+    if not intercepted_args.retry_failed:
+        failure = failcache.lookup(cachedirs, pkg_hash,
+                                   intercepted_args.failure_ttl)
+        if failure is not None:
+            raise exceptions.BuildFailed(failcache.describe(pkg_hash,
+                                                            failure))
+
+    start = time.time()
+    try:
+        with shared_package_cache(intercepted_args, mock_config) as mock_args:
+            if intercepted_args.chroot_slots > 0:
+                build_output = build_in_pool(
+                    intercepted_args, mock_args + passthrough_args,
+                    mock_config, cachedirs, manifest or {}, cwd)
+            else:
+                build_output = build_package(
+                    intercepted_args.configdir, intercepted_args.root,
+                    mock_args + passthrough_args, cwd)
+    except exceptions.BuildFailed as exn:
+        failcache.record(cachedirs[0], pkg_hash, str(exn))
+        raise
+    failcache.clear(cachedirs, pkg_hash)
+    return (build_output, time.time() - start)
+
+
+def fetch_or_build(intercepted_args, passthrough_args, mock_config,
+                   pkg_hash, cwd=None, manifest=None):
+    """
+    Copy the build products with the given hash to the result directory,
+    building them and adding them to the cache first if necessary.
+    manifest describes the inputs to pkg_hash and is stored with new
+    cache entries.
+    """
+    (cachedirs, remotes) = get_cachedirs(intercepted_args)
+    built = False
+
+    # Only one process builds a given hash at a time.   Others wait for
+    # the lock, then find the entry it published.
+    if not in_cache(cachedirs, pkg_hash):
+        with cacheentry.lock(cachedirs[0], pkg_hash):
+            if not in_cache(cachedirs, pkg_hash) and \
+                    not fetch_from_remote(cachedirs, remotes, pkg_hash):
+                logging.debug("Cache miss - rebuilding")
+                build_output = build_or_fail_fast(
+                    intercepted_args, passthrough_args, mock_config,
+                    cachedirs, pkg_hash, manifest, cwd)
+                add_to_cache(cachedirs, pkg_hash, build_output[0],
+                             build_output[1], manifest)
+                built = True
+                if not intercepted_args.no_push:
+                    push_to_remotes(cachedirs, remotes, pkg_hash)
+
+    resultdir = intercepted_args.resultdir or mock_config.resultdir()
+    get_from_cache(cachedirs, pkg_hash, resultdir)
+
+    # Only collect once the products are safely in resultdir, and only
+    # when the cache has grown
+    if built and intercepted_args.max_cache_size is not None:
+        cachegc.collect(cachedirs[0], intercepted_args.max_cache_size)
+
+
+def setup_logging(intercepted_args):
+    """Configure logging according to the command line"""
     loglevel = logging.INFO
     if intercepted_args.debug:
         loglevel = logging.DEBUG
     logging.basicConfig(format='%(message)s', level=loglevel)
 
-    yum_config = util.load_mock_config(config)
-    yumbase = util.get_yumbase(yum_config)
-    setup_yumbase(yumbase)
-    srpm = load_srpm_from_file(passthrough_args[-1])
-    with open(config) as cfg:
-        mock_config = cfg.read()
-    pkg_hash = get_srpm_hash(srpm, yumbase, mock_config)
-
-    cachedirs = [os.path.expanduser(x) for x
-                 in intercepted_args.cachedirs.split(':')]
 
-    # Rebuild if not available in the cache
-    if not in_cache(cachedirs, pkg_hash):
-        logging.debug("Cache miss - rebuilding")
-        build_output = build_package(intercepted_args.configdir,
-                                     intercepted_args.root, passthrough_args)
-        add_to_cache(cachedirs, pkg_hash, build_output)
-
-    # Expand default resultdir as done in mock.backend.Root
-    resultdir = intercepted_args.resultdir or \
-        yum_config['resultdir'] % yum_config
-    get_from_cache(cachedirs, pkg_hash, resultdir)
+def main(argv):
+    """
+    Main function.  Look up the package in the cache, building it with
+    mock if it is not there, or explain why it is not there.
+    """
+    intercepted_args, passthrough_args = parse_args_or_exit(argv)
+    setup_logging(intercepted_args)
+
+    mock_config = MockConfig(config_path(intercepted_args))
+    (pkg_hash, manifest) = hash_srpm_file(
+        passthrough_args[-1], mock_config, intercepted_args.config_keys,
+        intercepted_args.ignore_config_keys)
+    if intercepted_args.explain:
+        (cachedirs, _) = get_cachedirs(intercepted_args)
+        sys.stdout.write(cachemanifest.explain(cachedirs, pkg_hash, manifest))
+        return
+    try:
+        fetch_or_build(intercepted_args, passthrough_args, mock_config,
+                       pkg_hash, manifest=manifest)
+    except (exceptions.BuildFailed, exceptions.NoSuchFile) as exn:
+        sys.stderr.write(str(exn))
+        sys.exit(1)
 
 
 def _main():
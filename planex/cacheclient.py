@@ -0,0 +1,75 @@
+"""
+planex-cache client: Pass requests to a running planex-cache-daemon,
+falling back to running planex-cache in-process if there is no daemon.
+
+This module is deliberately lightweight: it does not import yum or rpm,
+so that the client starts quickly when a daemon is available.
+"""
+
+import errno
+import json
+import os
+import socket
+import sys
+
+SOCKET_ENV = "PLANEX_CACHE_SOCKET"
+DEFAULT_SOCKET = "~/.planex-cache/daemon.sock"
+
+
+def socket_path():
+    """Return the path of the daemon's socket"""
+    return os.path.expanduser(os.environ.get(SOCKET_ENV, DEFAULT_SOCKET))
+
+
+def send_request(request, path=None):
+    """
+    Send request to the daemon listening on path and return its
+    response, or None if no daemon is running
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path or socket_path())
+        except socket.error as err:
+            if err.errno in [errno.ENOENT, errno.ECONNREFUSED]:
+                return None
+            raise
+        sock.sendall(json.dumps(request) + "\n")
+        response = sock.makefile().readline()
+    finally:
+        sock.close()
+    if not response:
+        return None
+    return json.loads(response)
+
+
+def main(argv):
+    """
+    Ask the daemon to look up or build the package, or do it ourselves
+    if there is no daemon
+    """
+    response = send_request({"op": "build", "argv": argv,
+                             "cwd": os.getcwd()})
+    if response is None:
+        from planex import cache
+        cache.main(argv)
+        return
+
+    if response.get("output"):
+        sys.stdout.write(response["output"])
+    if response.get("log"):
+        sys.stderr.write(response["log"])
+    if response.get("error"):
+        sys.stderr.write(response["error"])
+    sys.exit(response["rc"])
+
+
+def _main():
+    """
+    Entry point for setuptools CLI wrapper
+    """
+    main(sys.argv[1:])
+
+# Entry point when run directly
+if __name__ == "__main__":
+    _main()
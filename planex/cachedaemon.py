@@ -0,0 +1,259 @@
+"""
+planex-cache-daemon: Long-running planex-cache server
+
+Loading the mock configuration and the YUM package sack dominates the
+run time of planex-cache when the package is already in the cache.
+The daemon keeps them loaded and serves requests from planex-cache
+clients over a unix socket.   Configurations are reloaded when the
+configuration file changes; when the planex repository is updated only
+its metadata is reread.
+
+Requests and responses are single lines of JSON:
+
+  {"op": "hash", "config": CFG, "srpm": SRPM}        -> {"hash": HASH}
+  {"op": "lookup", "cachedirs": [DIR...], "hash": HASH} -> {"path": PATH}
+  {"op": "build", "argv": [ARG...], "cwd": DIR}       -> {"rc": RC}
+
+Build responses also contain the "output" and "log" which planex-cache
+would have written to stdout and stderr, including the explanation if
+the build arguments include --explain.
+
+Failed requests return {"rc": 1, "error": TRACEBACK}.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import SocketServer
+import StringIO
+import sys
+import threading
+import traceback
+
+from planex import cache
+from planex import cacheentry
+from planex import cachemanifest
+from planex import exceptions
+from planex import httpcache
+from planex import util
+from planex.cacheclient import (SOCKET_ENV, DEFAULT_SOCKET, socket_path,
+                                send_request)
+
+
+def absolutize(path, cwd):
+    """Interpret path relative to the client's working directory"""
+    if path is None:
+        return None
+    return os.path.join(cwd, os.path.expanduser(path))
+
+
+class ThreadLogHandler(logging.StreamHandler):
+    """Log the records of the thread which created the handler to stream"""
+
+    def __init__(self, stream):
+        logging.StreamHandler.__init__(self, stream)
+        self.thread = threading.current_thread().ident
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            logging.StreamHandler.emit(self, record)
+
+
+@contextlib.contextmanager
+def captured_output(debug):
+    """
+    Collect the log messages and standard output of the current thread.
+    Yields a dictionary which is filled in with the "output" and "log".
+    """
+    log = StringIO.StringIO()
+    handler = ThreadLogHandler(log)
+    handler.setLevel(logging.DEBUG if debug else logging.INFO)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.getLogger().addHandler(handler)
+    grouped = sys.stdout if isinstance(sys.stdout, util.GroupedOutput) \
+        else None
+    if grouped:
+        grouped.begin()
+    captured = {}
+    try:
+        yield captured
+    finally:
+        logging.getLogger().removeHandler(handler)
+        captured["output"] = grouped.end(passthrough=False) if grouped \
+            else ""
+        captured["log"] = log.getvalue()
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Handle a single JSON request from a planex-cache client"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            response = self.server.dispatch(json.loads(line))
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Request failed: %s", line.strip())
+            response = {"rc": 1, "error": traceback.format_exc()}
+        self.wfile.write(json.dumps(response) + "\n")
+
+
+class CacheDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    planex-cache server.   Requests are handled concurrently, so that
+    a cache hit is not held up by another client's mock build, but YUM
+    is not thread-safe so all access to the loaded configurations is
+    serialised.
+    """
+    daemon_threads = True
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            if send_request({"op": "ping"}, path) is not None:
+                raise RuntimeError("A daemon is already listening on %s" %
+                                   path)
+            os.unlink(path)
+        elif not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.configs = {}
+        self.yum_lock = threading.Lock()
+
+    def get_config(self, path):
+        """
+        Return the loaded mock configuration at path, reloading it if
+        it has changed.   Must be called with yum_lock held.
+        """
+        path = os.path.abspath(path)
+        config = self.configs.get(path)
+        if config is None or config.is_stale():
+            logging.debug("Loading mock configuration %s", path)
+            config = cache.MockConfig(path)
+            self.configs[path] = config
+        return config
+
+    def hash(self, config_path, srpm, config_keys=None,
+             ignored_config_keys=None):
+        """
+        Return the cache hash of srpm, the manifest of its inputs and
+        the configuration used
+        """
+        with self.yum_lock:
+            config = self.get_config(config_path)
+            (pkg_hash, manifest) = cache.hash_srpm_file(
+                srpm, config, config_keys, ignored_config_keys)
+            return (pkg_hash, manifest, config)
+
+    def build(self, argv, cwd):
+        """
+        Do everything an in-process planex-cache would do, returning
+        the output and log messages it would have printed
+        """
+        args, passthrough_args = cache.parse_args_or_exit(argv)
+        with captured_output(args.debug) as captured:
+            try:
+                response = self.build_args(args, passthrough_args, cwd)
+            except (exceptions.BuildFailed, exceptions.NoSuchFile) as exn:
+                response = {"rc": 1, "error": str(exn)}
+        response["output"] = captured["output"] + response.get("output", "")
+        response["log"] = captured["log"]
+        return response
+
+    def build_args(self, args, passthrough_args, cwd):
+        """Build with parsed planex-cache arguments"""
+        args.configdir = absolutize(args.configdir, cwd)
+        args.resultdir = absolutize(args.resultdir, cwd)
+        args.cachedirs = ":".join(
+            cachedir if httpcache.is_remote(cachedir)
+            else absolutize(cachedir, cwd)
+            for cachedir in httpcache.split_cachedirs(args.cachedirs))
+        passthrough_args[-1] = absolutize(passthrough_args[-1], cwd)
+
+        (pkg_hash, manifest, config) = self.hash(
+            cache.config_path(args), passthrough_args[-1], args.config_keys,
+            args.ignore_config_keys)
+        if args.explain:
+            (cachedirs, _) = cache.get_cachedirs(args)
+            return {"rc": 0, "hash": pkg_hash,
+                    "output": cachemanifest.explain(cachedirs, pkg_hash,
+                                                    manifest)}
+        cache.fetch_or_build(args, passthrough_args, config, pkg_hash, cwd,
+                             manifest)
+        return {"rc": 0, "hash": pkg_hash}
+
+    def dispatch(self, request):
+        """Handle a decoded request, returning the response"""
+        operation = request.get("op")
+        logging.debug("Request: %s", request)
+        if operation == "ping":
+            return {"rc": 0}
+        if operation == "hash":
+            (pkg_hash, _, _) = self.hash(request["config"], request["srpm"])
+            return {"rc": 0, "hash": pkg_hash}
+        if operation == "lookup":
+            locations = cache.cache_locations(request["cachedirs"],
+                                              request["hash"])
+            found = [path for path in locations
+                     if cacheentry.is_complete(path)]
+            return {"rc": 0, "path": found[0] if found else None}
+        if operation == "build":
+            return self.build(request["argv"], request["cwd"])
+        return {"rc": 1, "error": "Unknown request: %s\n" % operation}
+
+
+def parse_args_or_exit(argv=None):
+    """
+    Parse command line options
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve planex-cache requests from a long-running process")
+    parser.add_argument(
+        '--debug', action='store_true', default=False,
+        help='Print debugging information')
+    parser.add_argument(
+        '--socket', default=None,
+        help='Path of the unix socket to listen on (default: $%s or %s)' %
+        (SOCKET_ENV, DEFAULT_SOCKET))
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """
+    Main function
+    """
+    args = parse_args_or_exit(argv)
+
+    loglevel = logging.INFO
+    if args.debug:
+        loglevel = logging.DEBUG
+    logging.basicConfig(format='%(message)s', level=loglevel)
+    # Clients may ask for debug messages even if we do not print them
+    logging.getLogger().handlers[0].setLevel(loglevel)
+    logging.getLogger().setLevel(logging.DEBUG)
+    # Collect the output of each build for its client
+    sys.stdout = util.GroupedOutput(sys.stdout)
+
+    path = args.socket or socket_path()
+    server = CacheDaemon(path)
+    logging.info("Listening on %s", path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def _main():
+    """
+    Entry point for setuptools CLI wrapper
+    """
+    main(sys.argv[1:])
+
+# Entry point when run directly
+if __name__ == "__main__":
+    _main()
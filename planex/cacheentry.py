@@ -0,0 +1,71 @@
+"""
+Publishing and locking of build cache entries.
+
+An entry is assembled in a temporary directory next to its final
+location, marked complete and then renamed into place, so readers never
+see a partially written entry.   Lookups ignore directories without the
+completion marker, which may be left behind by older versions of planex
+or by copies to a shared cache which were interrupted.
+
+Builders hold a per-hash lock while they check the cache and build, so
+that concurrent requests for the same hash result in a single build:
+the others wait for the lock and then find the published entry.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from planex import cachegc
+from planex.util import locked
+
+COMPLETE_MARKER = "complete"
+
+
+def is_complete(entry_dir):
+    """Return True if entry_dir is a completely published cache entry"""
+    return os.path.isfile(os.path.join(entry_dir, COMPLETE_MARKER))
+
+
+def lock(cache_dir, pkg_hash):
+    """
+    Return a context manager holding the build lock for pkg_hash in
+    cache_dir
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return locked(os.path.join(cache_dir, ".%s.lock" % pkg_hash))
+
+
+def staging_dir(cache_dir, pkg_hash):
+    """
+    Create and return a temporary directory in which to assemble the
+    entry for pkg_hash.   It is on the same filesystem as the cache, so
+    it can be renamed into place atomically.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return tempfile.mkdtemp(prefix=".%s." % pkg_hash, suffix=".tmp",
+                            dir=cache_dir)
+
+
+def publish(tmp_dir, entry_dir):
+    """
+    Mark the entry assembled in tmp_dir complete and atomically rename
+    it to entry_dir.   If a complete entry is already there, tmp_dir is
+    discarded; an incomplete one is replaced.
+    """
+    with open(os.path.join(tmp_dir, COMPLETE_MARKER), "w"):
+        pass
+    os.chmod(tmp_dir, 0755)
+
+    if os.path.isdir(entry_dir):
+        if is_complete(entry_dir):
+            logging.debug("%s was published by another builder", entry_dir)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        logging.debug("Replacing incomplete entry %s", entry_dir)
+        cachegc.remove(entry_dir)
+
+    os.rename(tmp_dir, entry_dir)
@@ -0,0 +1,224 @@
+"""
+planex-cache-gc: Keep planex build caches within a size budget
+
+Cache entries are directories named after the hash of their inputs.
+When a cache is over budget, the entries which are least valuable to
+keep are evicted first.   An entry's value is the time it took to build
+divided by the space it takes up, discounted by the time since it was
+last used, so an old, large entry which was quick to build goes before
+a recently-used one which took an hour to build.
+
+Collection is safe to run while builds are using the cache: entries
+used within the last --min-age seconds and entries still being written
+are never touched, and evicted entries are renamed out of the way
+atomically before they are deleted.
+"""
+
+import argparse
+import fcntl
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+
+BUILD_TIME_FILE = "build-time"
+DEFAULT_BUILD_TIME = 60.0
+DEFAULT_MIN_AGE = 3600
+STALE_TMP_AGE = 24 * 3600
+ENTRY_RE = re.compile(r"^[0-9a-f]{32,}$")
+SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3,
+                 "T": 1024 ** 4}
+
+
+def parse_size(size):
+    """Parse a size such as '500M' or '20G' into a number of bytes"""
+    match = re.match(r"^(\d+(?:\.\d+)?)([KMGT]?)B?$", size.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError("invalid size: '%s'" % size)
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+def record_build_time(entry_dir, seconds):
+    """Record how long it took to build the contents of a cache entry"""
+    with open(os.path.join(entry_dir, BUILD_TIME_FILE), "w") as time_file:
+        time_file.write("%f\n" % seconds)
+
+
+def read_build_time(entry_dir):
+    """Return the recorded build time of a cache entry"""
+    try:
+        with open(os.path.join(entry_dir, BUILD_TIME_FILE)) as time_file:
+            return float(time_file.read().strip())
+    except (IOError, ValueError):
+        return DEFAULT_BUILD_TIME
+
+
+def touch(entry_dir):
+    """Record that a cache entry has just been used"""
+    now = time.time()
+    try:
+        os.utime(entry_dir, (now, now))
+    except OSError:
+        pass
+
+
+def disk_usage(path):
+    """Return the number of bytes used by the files under path"""
+    total = 0
+    for (dirpath, _, filenames) in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class CacheEntry(object):
+    """A single cache entry, with the information needed to value it"""
+
+    def __init__(self, path, now):
+        self.path = path
+        self.size = disk_usage(path)
+        self.last_used = os.stat(path).st_mtime
+        self.build_time = read_build_time(path)
+        self.idle = max(now - self.last_used, 0)
+
+    def value(self):
+        """
+        Return the value of keeping this entry: seconds of build time
+        saved per megabyte, halved for every day since it was last used
+        """
+        megabytes = max(self.size / float(1024 ** 2), 0.001)
+        return self.build_time / megabytes / 2 ** (self.idle / 86400.0)
+
+
+def remove(path):
+    """
+    Delete a cache entry.   It is renamed first so that concurrent
+    lookups see it disappear atomically rather than half-deleted.
+    """
+    parent, name = os.path.split(path)
+    doomed = os.path.join(parent, ".%s.deleting-%d" % (name, os.getpid()))
+    try:
+        os.rename(path, doomed)
+    except OSError:
+        return False
+    shutil.rmtree(doomed, ignore_errors=True)
+    return True
+
+
+def remove_lock(path):
+    """Remove a build lock file, unless a builder is holding it"""
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return
+        os.unlink(path)
+
+
+def scan(cache_dir, now):
+    """
+    Return the cache entries in cache_dir, removing leftovers of
+    interrupted builds and deletions, and old build locks, along the way
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if ENTRY_RE.match(name) and os.path.isdir(path):
+            entries.append(CacheEntry(path, now))
+        elif name.startswith(".") and ".deleting-" in name:
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.endswith(".tmp") and os.path.isdir(path) and \
+                now - os.stat(path).st_mtime > STALE_TMP_AGE:
+            logging.debug("Removing stale temporary directory %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.startswith(".") and name.endswith(".lock") and \
+                now - os.stat(path).st_mtime > STALE_TMP_AGE:
+            remove_lock(path)
+    return entries
+
+
+def collect(cache_dir, max_size, min_age=DEFAULT_MIN_AGE, dry_run=False):
+    """
+    Evict entries from cache_dir until it uses no more than max_size
+    bytes.   Returns the list of evicted entry paths.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+
+    now = time.time()
+    entries = scan(cache_dir, now)
+    total = sum(entry.size for entry in entries)
+    logging.debug("%s: %d entries, %d bytes, budget %d bytes",
+                  cache_dir, len(entries), total, max_size)
+
+    evicted = []
+    candidates = [entry for entry in entries if entry.idle >= min_age]
+    for entry in sorted(candidates, key=lambda entry: entry.value()):
+        if total <= max_size:
+            break
+        logging.info("Evicting %s (%d bytes, built in %.0fs, idle %.0fs)",
+                     entry.path, entry.size, entry.build_time, entry.idle)
+        if dry_run or remove(entry.path):
+            total -= entry.size
+            evicted.append(entry.path)
+
+    if total > max_size:
+        logging.warning("%s is still over budget: %d bytes in use",
+                        cache_dir, total)
+    return evicted
+
+
+def parse_args_or_exit(argv=None):
+    """
+    Parse command line options
+    """
+    parser = argparse.ArgumentParser(
+        description="Evict entries from planex caches to meet a size budget")
+    parser.add_argument(
+        '--debug', action='store_true', default=False,
+        help='Print debugging information')
+    parser.add_argument(
+        '--max-size', type=parse_size, required=True,
+        help='Size budget for each cache directory, e.g. 500M or 20G')
+    parser.add_argument(
+        '--min-age', type=int, default=DEFAULT_MIN_AGE, metavar="SECONDS",
+        help='Never evict entries used more recently than this')
+    parser.add_argument(
+        '--dry-run', action='store_true', default=False,
+        help='Report what would be evicted without deleting anything')
+    parser.add_argument(
+        'cachedirs', metavar="DIR", nargs="*", default=["~/.planex-cache"],
+        help='Cache directories to collect (default: ~/.planex-cache)')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """
+    Main function
+    """
+    args = parse_args_or_exit(argv)
+
+    loglevel = logging.INFO
+    if args.debug:
+        loglevel = logging.DEBUG
+    logging.basicConfig(format='%(message)s', level=loglevel)
+
+    for cache_dir in args.cachedirs:
+        collect(os.path.expanduser(cache_dir), args.max_size, args.min_age,
+                args.dry_run)
+
+
+def _main():
+    """
+    Entry point for setuptools CLI wrapper
+    """
+    main(sys.argv[1:])
+
+# Entry point when run directly
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,155 @@
+"""
+Manifests of the inputs to planex-cache hashes.
+
+Each cache entry records the inputs which were hashed to name it: the
+cache salt, the normalised mock configuration, the digests of the
+files in the SRPM and the packages which satisfied its build
+requirements.   When a package unexpectedly misses the cache, its
+manifest can be compared with that of the nearest cached build of the
+same package to find out which inputs changed.
+"""
+
+import hashlib
+import json
+import os
+
+from planex import cacheentry
+
+MANIFEST_FILE = "manifest.json"
+
+
+def manifest_hash(manifest):
+    """Return the cache hash of the inputs described by manifest"""
+    return hashlib.md5(json.dumps(manifest, sort_keys=True)).hexdigest()
+
+
+def write(entry_dir, manifest):
+    """Record manifest in the cache entry being assembled in entry_dir"""
+    with open(os.path.join(entry_dir, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+
+def load(entry_dir):
+    """Return the manifest of the cache entry in entry_dir, or None"""
+    try:
+        with open(os.path.join(entry_dir, MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+
+
+def diff(old, new):
+    """
+    Return a list of lines describing how the inputs in manifest new
+    differ from those in manifest old
+    """
+    lines = []
+    if old.get("salt") != new.get("salt"):
+        lines.append("salt: %s -> %s" % (old.get("salt"), new.get("salt")))
+    lines.extend(config_changes(["mock_config"], old.get("mock_config"),
+                                new.get("mock_config")))
+
+    old_sources = dict(old.get("sources", []))
+    new_sources = dict(new.get("sources", []))
+    for name in sorted(set(old_sources) | set(new_sources)):
+        if name not in new_sources:
+            lines.append("source %s: removed" % name)
+        elif name not in old_sources:
+            lines.append("source %s: added" % name)
+        elif old_sources[name] != new_sources[name]:
+            lines.append("source %s: %s -> %s" %
+                         (name, old_sources[name], new_sources[name]))
+
+    old_reqs = old.get("requires", {})
+    new_reqs = new.get("requires", {})
+    for req in sorted(set(old_reqs) | set(new_reqs)):
+        if req not in new_reqs:
+            lines.append("requirement %s: removed" % req)
+        elif req not in old_reqs:
+            lines.append("requirement %s: added" % req)
+        elif old_reqs[req] != new_reqs[req]:
+            lines.append("requirement %s: %s -> %s" %
+                         (req, describe_packages(old_reqs[req]),
+                          describe_packages(new_reqs[req])))
+    return lines
+
+
+def config_changes(path, old, new):
+    """
+    Return a list of lines naming the settings which differ between
+    the normalised configurations old and new
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        lines = []
+        for key in sorted(set(old) | set(new)):
+            if key not in new:
+                lines.append("%s: removed" % " ".join(path + [key]))
+            elif key not in old:
+                lines.append("%s: added" % " ".join(path + [key]))
+            else:
+                lines.extend(config_changes(path + [key], old[key], new[key]))
+        return lines
+    if old != new:
+        return ["%s: %s -> %s" % (" ".join(path), json.dumps(old),
+                                  json.dumps(new))]
+    return []
+
+
+def describe_packages(pkgs):
+    """Return a short description of the packages satisfying a requirement"""
+    if not pkgs:
+        return "(not in the planex repository)"
+    return ", ".join("%s (%s)" % (pkg["pkg"], pkg["checksum"][:12])
+                     for pkg in pkgs)
+
+
+def cached_manifests(cachedirs, name):
+    """
+    Yield (entry_dir, manifest) for every complete cache entry in
+    cachedirs which is a build of the package called name
+    """
+    for cachedir in cachedirs:
+        if not os.path.isdir(cachedir):
+            continue
+        for entry in os.listdir(cachedir):
+            entry_dir = os.path.join(cachedir, entry)
+            if not cacheentry.is_complete(entry_dir):
+                continue
+            manifest = load(entry_dir)
+            if manifest is not None and manifest.get("name") == name:
+                yield (entry_dir, manifest)
+
+
+def nearest(cachedirs, manifest):
+    """
+    Return (entry_dir, differences) for the cached build of the same
+    package whose inputs differ least from manifest, preferring the
+    most recently used.   Returns (None, None) if there is none.
+    """
+    best = (None, None)
+    best_key = None
+    for (entry_dir, cached) in cached_manifests(cachedirs,
+                                                manifest.get("name")):
+        differences = diff(cached, manifest)
+        key = (len(differences), -os.path.getmtime(entry_dir))
+        if best_key is None or key < best_key:
+            best = (entry_dir, differences)
+            best_key = key
+    return best
+
+
+def explain(cachedirs, pkg_hash, manifest):
+    """Return a report on why pkg_hash is or is not in cachedirs"""
+    for cachedir in cachedirs:
+        if cacheentry.is_complete(os.path.join(cachedir, pkg_hash)):
+            return "%s: cache hit in %s\n" % (pkg_hash, cachedir)
+
+    (entry_dir, differences) = nearest(cachedirs, manifest)
+    if entry_dir is None:
+        return "%s: cache miss; no cached builds of %s\n" % \
+            (pkg_hash, manifest.get("name"))
+
+    report = ["%s: cache miss; nearest entry is %s (%d inputs differ)" %
+              (pkg_hash, entry_dir, len(differences))]
+    report.extend("  " + line for line in differences)
+    return "\n".join(report) + "\n"
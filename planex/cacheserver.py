@@ -0,0 +1,256 @@
+"""
+planex-cache-server: Serve a planex cache directory over HTTP
+
+This is a small reference implementation of the protocol described in
+planex.httpcache, suitable for sharing a cache between build hosts or
+for testing.   Each upload is staged in its own hidden directory, which
+is renamed into place when the entry is published if its files match
+the sizes and digests in the published file list.   The list is saved
+beside the entry and served to clients, so they can detect files which
+have been damaged since.
+"""
+
+import argparse
+import BaseHTTPServer
+import errno
+import json
+import logging
+import os
+import re
+import shutil
+import SocketServer
+import sys
+import urllib2
+import urlparse
+
+from planex.httpcache import READ_SIZE, entry_files, entry_manifest
+
+HASH_RE = re.compile(r"^[0-9a-f]+$")
+
+
+class CacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handle requests for entries in the server's cache directory"""
+
+    def parse_entry_path(self):
+        """
+        Split the request path into an entry hash and a relative file
+        path, or return (None, None) if it is malformed
+        """
+        parts = urllib2.unquote(self.path.split("?")[0]).lstrip("/")
+        pkg_hash, _, path = parts.partition("/")
+        if not HASH_RE.match(pkg_hash):
+            return (None, None)
+        path = os.path.normpath(path) if path else ""
+        if path.startswith("..") or os.path.isabs(path):
+            return (None, None)
+        return (pkg_hash, path)
+
+    def entry_dir(self, pkg_hash):
+        """Return the directory holding a published entry"""
+        return os.path.join(self.server.cache_dir, pkg_hash)
+
+    def manifest_path(self, pkg_hash):
+        """Return the path of the saved file list of an entry"""
+        return os.path.join(self.server.cache_dir, "%s.files.json" % pkg_hash)
+
+    def manifest(self, pkg_hash):
+        """
+        Return the file list saved when the entry was published, or
+        compute one if the entry was not uploaded to this server
+        """
+        entry_dir = self.entry_dir(pkg_hash)
+        try:
+            with open(self.manifest_path(pkg_hash)) as saved:
+                files = json.load(saved)
+            if sorted(record["path"] for record in files) == \
+                    entry_files(entry_dir):
+                return files
+        except (IOError, ValueError, KeyError):
+            pass
+        return entry_manifest(entry_dir)
+
+    def upload_id(self):
+        """Return the upload ID in the request's query, or None"""
+        query = urlparse.parse_qs(self.path.partition("?")[2])
+        upload = query.get("upload", [None])[0]
+        if upload is None or not HASH_RE.match(upload):
+            return None
+        return upload
+
+    def staging_dir(self, pkg_hash, upload):
+        """Return the directory holding an entry being uploaded"""
+        return os.path.join(self.server.cache_dir,
+                            ".upload-%s-%s" % (pkg_hash, upload))
+
+    def send_empty(self, code):
+        """Send a response with no body"""
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):  # pylint: disable=C0103
+        (pkg_hash, path) = self.parse_entry_path()
+        if pkg_hash is None:
+            self.send_empty(400)
+        elif os.path.exists(os.path.join(self.entry_dir(pkg_hash), path)):
+            self.send_empty(200)
+        else:
+            self.send_empty(404)
+
+    def do_GET(self):  # pylint: disable=C0103
+        (pkg_hash, path) = self.parse_entry_path()
+        if pkg_hash is None:
+            self.send_empty(400)
+            return
+
+        entry_dir = self.entry_dir(pkg_hash)
+        if not os.path.isdir(entry_dir):
+            self.send_empty(404)
+            return
+
+        if not path:
+            body = json.dumps(self.manifest(pkg_hash))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        filename = os.path.join(entry_dir, path)
+        if not os.path.isfile(filename):
+            self.send_empty(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(filename)))
+        self.end_headers()
+        with open(filename, "rb") as src:
+            shutil.copyfileobj(src, self.wfile, READ_SIZE)
+
+    def do_PUT(self):  # pylint: disable=C0103
+        (pkg_hash, path) = self.parse_entry_path()
+        upload = self.upload_id()
+        if pkg_hash is None or upload is None:
+            self.send_empty(400)
+            return
+
+        length = self.headers.getheader("Content-Length")
+        if length is None:
+            self.send_empty(411)
+            return
+        length = int(length)
+        staging_dir = self.staging_dir(pkg_hash, upload)
+
+        if path:
+            dest = os.path.join(staging_dir, path)
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError as exn:
+                # Files in the same directory are uploaded concurrently
+                if exn.errno != errno.EEXIST:
+                    raise
+            with open(dest, "wb") as dest_file:
+                while length > 0:
+                    data = self.rfile.read(min(length, READ_SIZE))
+                    if not data:
+                        break
+                    dest_file.write(data)
+                    length -= len(data)
+            if length > 0:
+                # The client went away before sending the whole file
+                os.unlink(dest)
+                self.send_empty(400)
+            else:
+                self.send_empty(201)
+            return
+
+        # Publish the staged entry if it holds exactly the listed files
+        files = sorted(json.loads(self.rfile.read(length)),
+                       key=lambda record: record["path"])
+        if os.path.isdir(self.entry_dir(pkg_hash)):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self.send_empty(200)
+        elif not os.path.isdir(staging_dir) or \
+                entry_manifest(staging_dir) != files:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            self.send_empty(409)
+        else:
+            tmp_path = "%s.%s" % (self.manifest_path(pkg_hash), upload)
+            with open(tmp_path, "w") as saved:
+                json.dump(files, saved)
+            os.rename(tmp_path, self.manifest_path(pkg_hash))
+            try:
+                os.rename(staging_dir, self.entry_dir(pkg_hash))
+                self.send_empty(201)
+            except OSError:
+                # Another upload of the same entry was published first
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                self.send_empty(200)
+
+    def log_message(self, fmt, *args):
+        logging.debug("%s - %s", self.address_string(), fmt % args)
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server for a planex cache directory"""
+    daemon_threads = True
+
+    def __init__(self, address, cache_dir):
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheRequestHandler)
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+
+def parse_args_or_exit(argv=None):
+    """
+    Parse command line options
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve a planex cache directory over HTTP")
+    parser.add_argument(
+        '--debug', action='store_true', default=False,
+        help='Print debugging information')
+    parser.add_argument(
+        '--bind', default="", metavar="ADDRESS",
+        help='Address to listen on (default: all addresses)')
+    parser.add_argument(
+        '--port', type=int, default=8080,
+        help='Port to listen on (default: 8080)')
+    parser.add_argument(
+        'cache_dir', metavar="DIR", nargs="?", default="~/.planex-cache",
+        help='Cache directory to serve (default: ~/.planex-cache)')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """
+    Main function
+    """
+    args = parse_args_or_exit(argv)
+
+    loglevel = logging.INFO
+    if args.debug:
+        loglevel = logging.DEBUG
+    logging.basicConfig(format='%(message)s', level=loglevel)
+
+    server = CacheServer((args.bind, args.port),
+                         os.path.expanduser(args.cache_dir))
+    logging.info("Serving %s on port %d", server.cache_dir,
+                 server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def _main():
+    """
+    Entry point for setuptools CLI wrapper
+    """
+    main(sys.argv[1:])
+
+# Entry point when run directly
+if __name__ == "__main__":
+    _main()
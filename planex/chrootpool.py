@@ -0,0 +1,184 @@
+"""
+A pool of warm mock chroots for planex-cache builds.
+
+Building with a single mock root means that every build tears down and
+reinstalls a complete buildroot, and that concurrent builds fight over
+the same chroot.   Instead, builds can be dispatched to one of a fixed
+number of slots derived from the base configuration with mock's
+--uniqueext option.   Each slot is locked while a build is using it and
+is left in place afterwards.
+
+Each slot records the build requirements installed in it, and the
+packages which satisfied them.   A free slot is only reused, with
+--no-clean, if everything installed in it is also required by the next
+build, with the same package versions and the same mock configuration
+and base repositories, and if it already has most of the requirements
+of the next build installed.   Otherwise the slot is cleaned as usual.
+A build therefore never sees a package it would not have had in a clean
+chroot, and its output can be cached like any other.
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import time
+
+from planex.util import atomic_write
+
+DEFAULT_REUSE_THRESHOLD = 0.8
+POOL_DIR = ".chroot-pool"
+POLL_INTERVAL = 1
+
+
+def installed_requirements(manifest):
+    """
+    Return the build requirements in a cache manifest, mapped to the
+    checksums of the packages which satisfy them
+    """
+    return dict((req, sorted(pkg["checksum"] for pkg in pkgs))
+                for (req, pkgs) in manifest.get("requires", {}).items())
+
+
+def can_reuse(installed, wanted):
+    """
+    Return True if every requirement in installed is also in wanted,
+    satisfied by the same packages, so that a chroot with installed has
+    nothing in it which a build needing wanted would not install anyway
+    """
+    return all(req in wanted and wanted[req] == pkgs
+               for (req, pkgs) in installed.items())
+
+
+def similarity(installed, wanted):
+    """
+    Return the proportion of the requirements in installed and wanted
+    which they have in common.   If a requirement is satisfied by
+    different packages in each, the chroot is out of date and the
+    similarity is 0.
+    """
+    common = set(installed) & set(wanted)
+    if any(installed[req] != wanted[req] for req in common):
+        return 0.0
+    union = set(installed) | set(wanted)
+    if not union:
+        return 1.0
+    return len(common) / float(len(union))
+
+
+class Slot(object):
+    """One chroot in the pool"""
+
+    def __init__(self, pool_dir, root, index):
+        self.index = index
+        self.uniqueext = "planex-slot%d" % index
+        base = os.path.join(pool_dir, "%s-slot%d" % (root, index))
+        self.lock_path = base + ".lock"
+        self.state_path = base + ".json"
+        self.lock_file = None
+
+    def try_acquire(self):
+        """Lock the slot and return True, or return False if it is busy"""
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def release(self):
+        """Unlock the slot"""
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+    def load_state(self):
+        """
+        Return the mock configuration and the requirements installed
+        in the slot, or None if they are not known
+        """
+        try:
+            with open(self.state_path) as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError):
+            return None
+
+    def save_state(self, state):
+        """Record what is installed in the slot, or None if not known"""
+        if state is None:
+            if os.path.exists(self.state_path):
+                os.unlink(self.state_path)
+            return
+        atomic_write(self.state_path, json.dumps(state))
+
+    def score(self, config, wanted):
+        """
+        Return how well the slot suits a build with requirements wanted,
+        or None if the slot cannot be reused for it
+        """
+        state = self.load_state()
+        if config is None or state is None or state.get("config") != config \
+                or not can_reuse(state["requires"], wanted):
+            return None
+        return similarity(state["requires"], wanted)
+
+
+class ChrootPool(object):
+    """
+    A pool of chroot slots for the mock root called root, whose locks
+    and state are kept in pool_dir
+    """
+
+    def __init__(self, pool_dir, root, slots,
+                 threshold=DEFAULT_REUSE_THRESHOLD):
+        if not os.path.isdir(pool_dir):
+            os.makedirs(pool_dir)
+        self.slots = [Slot(pool_dir, root, index) for index in range(slots)]
+        self.threshold = threshold
+
+    def acquire(self, config, wanted):
+        """
+        Wait for a free slot and lock it, preferring the one which is
+        most similar to a build with requirements wanted.   Returns the
+        slot and whether it is similar enough to reuse.   If config is
+        None, the build environment is not fully known and no slot is
+        reused.
+        """
+        while True:
+            free = [slot for slot in self.slots if slot.try_acquire()]
+            if free:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        scores = [(slot.score(config, wanted), -slot.index, slot)
+                  for slot in free]
+        (score, _, best) = max(scores)
+        for slot in free:
+            if slot is not best:
+                slot.release()
+        return (best, score is not None and score >= self.threshold)
+
+    @contextlib.contextmanager
+    def slot(self, config, wanted):
+        """
+        Hold a slot for a build whose mock configuration is config and
+        whose build requirements are wanted.   Yields the slot and
+        whether to reuse its chroot.   Records what is installed in the
+        slot if the build succeeds, and that it is unknown otherwise.
+        """
+        (slot, reuse) = self.acquire(config, wanted)
+        logging.debug("Building in chroot slot %d (%s)", slot.index,
+                      "reusing" if reuse else "cleaning")
+        try:
+            installed = {}
+            if reuse:
+                installed = slot.load_state()["requires"]
+            slot.save_state(None)
+            yield (slot, reuse)
+            installed.update(wanted)
+            slot.save_state({"config": config, "requires": installed})
+        finally:
+            slot.release()
@@ -60,7 +60,8 @@ def main():
 
     specs_path = os.path.join(config.config_dir,
                               config.specs_path, "*.spec.in")
-    templates = [planex.spec.Spec(path) for path in glob.glob(specs_path)]
+    templates = [planex.spec.load_spec(path)
+                 for path in glob.glob(specs_path)]
 
     if config.print_only:
         for template in templates:
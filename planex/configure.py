@@ -9,21 +9,44 @@ import sys
 import os.path
 import re
 import glob
+import json
 import shutil
+import threading
+import urlparse
+from multiprocessing.dummy import Pool
 from planex.globals import (BUILD_ROOT_DIR, SPECS_DIR, SOURCES_DIR, SRPMS_DIR,
                             MOCK_DIR, RPMS_DIR, SPECS_GLOB, HASHFN,
-                            PLANEX_REPO_NAME)
+                            PLANEX_REPO_NAME, SRPM_FILES_INDEX)
 import planex.spec
 from planex.util import (bcolours, print_col, run, rewrite_url,
-                         load_mock_config, get_yumbase)
+                         load_mock_config, get_yumbase, GroupedOutput,
+                         write_if_changed, copy_if_changed)
 import planex.sources
 from pkg_resources import resource_string
 from planex import exceptions
+from planex import repodata
+from planex.digestcache import file_digests
+from planex.srpm import srpms_by_name
 
 GITHUB_MIRROR = "~/github_mirror"
 
 MANIFEST = {}
 
+# Names of the files which were copied into SOURCES from the
+# configuration directory's SOURCES by the last run, so that those which
+# have since been removed can be deleted again.
+COPIED_SOURCES = os.path.join(BUILD_ROOT_DIR, "copied-sources.json")
+
+# Sources fetched over the network rather than archived from local
+# repositories.   Fetches are limited to DOWNLOADS at once, separately
+# from the number of SRPMs being prepared.
+NETWORK_SCHEMES = ["http", "https", "ftp"]
+DOWNLOADS = threading.BoundedSemaphore(4)
+
+# librpm keeps the macros defined while parsing a spec file in global
+# state, so only one thread may parse spec files at a time.
+SPEC_LOCK = threading.Lock()
+
 
 def name_from_spec(spec_path):
     """
@@ -60,7 +83,9 @@ def sources_from_spec(spec_path, config):
     Returns a list of source URLs with RPM macros expanded.
     """
     name_check = not config.no_package_name_check
-    spec = planex.spec.Spec(spec_path, check_package_name=name_check)
+    with SPEC_LOCK:
+        spec = planex.spec.load_spec(spec_path,
+                                     check_package_name=name_check)
     return spec.source_urls()
 
 
@@ -68,7 +93,8 @@ def preprocess_spec(spec_in_path, spec_out_path, scmsources, source_mapping):
     """
     Preprocesses a spec file containing placeholders.
     Writes the result to the same filename, with the '.in' extension
-    stripped, in spec_out_path.
+    stripped, in spec_out_path, unless it is unchanged.   Returns the
+    name of the output file.
     """
     assert spec_in_path.endswith('.in')
 
@@ -78,7 +104,7 @@ def preprocess_spec(spec_in_path, spec_out_path, scmsources, source_mapping):
     spec_in.close()
 
     output_filename = os.path.basename(spec_in_path)[:-len(".in")]
-    spec_out = open(os.path.join(spec_out_path, output_filename), "w")
+    spec_out = []
 
     spec_basename = spec_in_path.split("/")[-1]
 
@@ -106,9 +132,11 @@ def preprocess_spec(spec_in_path, spec_out_path, scmsources, source_mapping):
             line = match.group(1) + match.group(2) + " " + \
                 subs[match.group(2)] + "\n"
 
-        spec_out.write(line)
+        spec_out.append(line)
 
-    spec_out.close()
+    write_if_changed(os.path.join(spec_out_path, output_filename),
+                     "".join(spec_out))
+    return output_filename
 
 
 def prepare_srpm(spec_path, config):
@@ -131,75 +159,69 @@ def prepare_srpm(spec_path, config):
 
     allsources = [rewrite_url(url, config.mirror_path) for url in allsources]
     for source in allsources:
-        planex.sources.source(source, config).archive()
+        if urlparse.urlparse(source).scheme in NETWORK_SCHEMES:
+            with DOWNLOADS:
+                planex.sources.source(source, config).archive()
+        else:
+            planex.sources.source(source, config).archive()
 
 
 def get_hashes(hash_alg):
+    """
+    Return a dictionary mapping the names of files in SPECS and SOURCES
+    to their digests.   Digests are looked up in the shared digest cache,
+    so only files which have changed since the last run are rehashed.
+    """
     spec_files = glob.glob(os.path.join(SPECS_DIR, "*"))
     sources_files = glob.glob(os.path.join(SOURCES_DIR, "*"))
-    all_files = spec_files + sources_files
-    if all_files == []:
-        return []
-    if hash_alg == "md5":
-        cmd = ["md5sum"] + all_files
-    elif hash_alg == "sha256":
-        cmd = ["sha256sum"] + all_files
-    else:
+    all_files = [path for path in spec_files + sources_files
+                 if os.path.isfile(path)]
+    if hash_alg not in ["md5", "sha256"]:
         print "Invalid hash type"
         raise Exception
-    results = run(cmd)['stdout'].strip().split('\n')
+    digests = file_digests(all_files, hash_alg)
+    return dict((os.path.basename(path), digest)
+                for (path, digest) in digests.iteritems())
 
-    def fix(output):
-        words = output.split()
-        if len(words) == 2:
-            fname = words[1].split("/")[-1]
-            return (fname, words[0])
-        else:
-            return None
-    fixed = [fix(result) for result in results]
-    return dict(fixed)
 
-
-def ensure_existing_ok(hashes, spec_path):
+def ensure_existing_ok(hashes, spec_path, srpms):
+    """
+    Check the existing SRPMs for the package built by the spec file at
+    spec_path, as indexed by srpms_by_name, against the digests of the
+    files in SPECS and SOURCES.   SRPMs containing files which are
+    missing or have changed are removed.   Returns True if at least one
+    SRPM is up to date.
+    """
     pkg_name = name_from_spec(spec_path)
 
     one_correct = False
 
-    for srpm in glob.glob(os.path.join(SRPMS_DIR, '%s-*.src.rpm' % pkg_name)):
-        # Check it's for the right package:
-        cmd = ["rpm", "-qp", srpm, "--qf", "%{name}"]
-        result = run(cmd)['stdout'].strip().split('\n')
-
-        if result[0] == pkg_name:
-            cmd = ["rpm", "--dump", "-qp", srpm]
-            result = run(cmd)['stdout'].strip().split('\n')
-            is_ok = True
-            for line in result:
-                split = line.split()
-                fname = split[0]
-                thishash = split[3]
-                if fname not in hashes or hashes[fname] != thishash:
-                    is_ok = False
-
-            if not is_ok:
-                print_col(bcolours.WARNING,
-                          "WARNING: Removing SRPM '%s' "
-                          "(hash mismatch with desired)" % srpm)
-                os.remove(srpm)
-            else:
-                one_correct = True
+    for (srpm, files) in srpms.get(pkg_name, []):
+        is_ok = True
+        for (fname, thishash) in files.iteritems():
+            if fname not in hashes or hashes[fname] != thishash:
+                is_ok = False
+
+        if not is_ok:
+            print_col(bcolours.WARNING,
+                      "WARNING: Removing SRPM '%s' "
+                      "(hash mismatch with desired)" % srpm)
+            os.remove(srpm)
+        else:
+            one_correct = True
 
     return one_correct
 
 
-def build_srpm(hashes, spec_path):
+def build_srpm(hashes, spec_path, srpms):
     """
-    Builds an SRPM from the spec file at spec_path.
+    Builds an SRPM from the spec file at spec_path, unless one of the
+    existing SRPMs in srpms is up to date.
 
     Assumes that all source files have already been downloaded to
     the rpmbuild sources directory, and are correctly named.
     """
-    is_ok = ensure_existing_ok(hashes, spec_path)
+    is_ok = ensure_existing_ok(hashes, spec_path, srpms)
 
     if not is_ok:
         cmd = (["rpmbuild", "-bs", spec_path,
@@ -211,25 +233,53 @@ def build_srpm(hashes, spec_path):
 
 
 def prepare_buildroot():
-    """Create a clean rpmbuild directory structure"""
-
-    if os.path.exists(SPECS_DIR):
-        shutil.rmtree(SPECS_DIR)
-    os.makedirs(SPECS_DIR)
-
-    for path in [SRPMS_DIR, SOURCES_DIR, RPMS_DIR]:
+    """
+    Create the rpmbuild directory structure, if it does not already
+    exist, and bring the repository metadata for RPMS up to date.
+    Existing files are left alone, so that their modification times
+    only change when configure changes their contents.
+    """
+    for path in [SPECS_DIR, SRPMS_DIR, SOURCES_DIR, RPMS_DIR]:
         if not os.path.exists(path):
             os.makedirs(path)
 
-    cmd = (["createrepo", RPMS_DIR])
-    run(cmd)
+    repodata.refresh(RPMS_DIR)
+
+
+def remove_stale(directory, wanted, candidates=None):
+    """
+    Remove the files in directory which are not named in wanted.   If
+    candidates is given, only files named in it are considered.
+    """
+    if candidates is None:
+        candidates = os.listdir(directory)
+    for name in set(candidates) - set(wanted):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            print "  removing stale file '%s'" % path
+            os.remove(path)
 
 
 def copy_patches_to_buildroot(config):
-    """Copy patches into the build root"""
+    """
+    Copy patches into the build root, skipping those which are already
+    up to date and removing any copied by an earlier run which are no
+    longer in the configuration
+    """
     patches_dir = os.path.join(config.config_dir, config.sources_path)
-    for patch in glob.glob(os.path.join(patches_dir, '*')):
-        shutil.copy(patch, SOURCES_DIR)
+    patches = [patch for patch in glob.glob(os.path.join(patches_dir, '*'))
+               if os.path.isfile(patch)]
+    for patch in patches:
+        copy_if_changed(patch, os.path.join(SOURCES_DIR,
+                                            os.path.basename(patch)))
+
+    copied = [os.path.basename(patch) for patch in patches]
+    try:
+        with open(COPIED_SOURCES) as copied_file:
+            remove_stale(SOURCES_DIR, copied, json.load(copied_file))
+    except (IOError, ValueError):
+        pass
+    write_if_changed(COPIED_SOURCES, json.dumps(sorted(copied)))
 
 
 def is_scm(uri):
@@ -241,29 +291,45 @@ def is_scm(uri):
 
 
 def copy_specs_to_buildroot(config):
-    """Pull in spec files, preprocessing if necessary"""
+    """
+    Pull in spec files, preprocessing if necessary.   Spec files whose
+    contents have not changed are left untouched, and spec files which
+    are no longer in the configuration are removed.
+    """
     config_dir = config.config_dir
     specs = glob.glob(os.path.join(config_dir, config.specs_path, "*.spec"))
     spec_ins = glob.glob(os.path.join(config_dir, config.specs_path,
                                       "*.spec.in"))
+
+    # Pin the repositories used by all the templates at once, so that
+    # those which need it are pinned in parallel
+    scm_urls = dict((spec_path, [url for url
+                                 in sources_from_spec(spec_path, config)
+                                 if is_scm(url)])
+                    for spec_path in spec_ins)
+    pinned = planex.sources.pin_sources(
+        [url for urls in scm_urls.values() for url in urls], config)
+
+    wanted = []
     for spec_path in specs + spec_ins:
         # check_spec_name(spec_path)
         basename = spec_path.split("/")[-1]
         if spec_path.endswith('.in'):
             print_col(bcolours.OKGREEN,
                       "Configuring and fetching sources for '%s'" % basename)
-            scmsources = [planex.sources.source(source, config) for source
-                          in sources_from_spec(spec_path, config)
-                          if is_scm(source)]
+            scmsources = [pinned[url] for url in scm_urls[spec_path]]
             mapping = {}
             for source in scmsources:
                 source.pin()
                 MANIFEST[source.repo_name] = source.scmhash
                 mapping[source.orig_url] = source.extendedurl
-            preprocess_spec(spec_path, SPECS_DIR, scmsources, mapping)
+            wanted.append(preprocess_spec(spec_path, SPECS_DIR, scmsources,
+                                          mapping))
         else:
             print_col(bcolours.OKGREEN, "Fetching sources for '%s'" % basename)
-            shutil.copy(spec_path, SPECS_DIR)
+            copy_if_changed(spec_path, os.path.join(SPECS_DIR, basename))
+            wanted.append(basename)
+    remove_stale(SPECS_DIR, wanted)
 
 
 def build_srpms(config):
@@ -275,15 +341,60 @@ def build_srpms(config):
     sys.stdout.flush()
     hashes = get_hashes(HASHFN)
     print "OK"
+    srpms = srpms_by_name(glob.glob(os.path.join(SRPMS_DIR, "*.src.rpm")),
+                          SRPM_FILES_INDEX)
     specs = glob.glob(SPECS_GLOB)
-    num_built = 0
-    for spec_path in specs:
-        prepare_srpm(spec_path, config)
-        num_built += build_srpm(hashes, spec_path)
+    if config.jobs > 1:
+        num_built = build_srpms_parallel(hashes, srpms, specs, config)
+    else:
+        num_built = 0
+        for spec_path in specs:
+            prepare_srpm(spec_path, config)
+            num_built += build_srpm(hashes, spec_path, srpms)
     print_col(bcolours.OKGREEN,
               "Rebuilt %d out of %d SRPMS" % (num_built, len(specs)))
 
 
+def build_srpms_parallel(hashes, srpms, specs, config):
+    """
+    Prepare sources and build SRPMs for specs using up to config.jobs
+    threads, with at most config.download_jobs network fetches running
+    at once.   The output for each spec is written out in one piece
+    when it finishes.   Returns the number of SRPMs built.
+    """
+    global DOWNLOADS  # pylint: disable=W0603
+    DOWNLOADS = threading.BoundedSemaphore(config.download_jobs)
+    output = GroupedOutput(sys.stdout)
+
+    def build_one(spec_path):
+        """
+        Prepare and build one SRPM.   SystemExit is returned rather than
+        raised, because it would kill the pool's worker thread.
+        """
+        output.begin()
+        try:
+            prepare_srpm(spec_path, config)
+            return build_srpm(hashes, spec_path, srpms)
+        except SystemExit as exn:
+            return exn
+        finally:
+            output.end()
+
+    sys.stdout = output
+    pool = Pool(config.jobs)
+    try:
+        results = pool.map(build_one, specs)
+    finally:
+        pool.close()
+        pool.join()
+        sys.stdout = output.stream
+
+    for result in results:
+        if isinstance(result, SystemExit):
+            raise result
+    return sum(results)
+
+
 def dump_manifest():
     print "---------------------------------------"
     print_col(bcolours.OKGREEN, "MANIFEST")
@@ -356,11 +467,8 @@ def sort_makefile():
         # Makefile does not exist
         pass
 
-    with open(name, 'w') as makefile:
-        makefile.write(firstline)
-        makefile.write("DIST := .el6\n")
-        makefile.write("all : rpms\n")
-        makefile.write(makefile_common)
+    write_if_changed(name, firstline + "DIST := .el6\n" + "all : rpms\n" +
+                     makefile_common)
 
 
 def main(argv):
@@ -441,6 +549,13 @@ def parse_cmdline(argv=None):
     parser.add_argument(
         '--build_srpms', action="store_true", default=False,
         help='Build SRPMs')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1, metavar="N",
+        help='Number of SRPMs to prepare and build concurrently')
+    parser.add_argument(
+        '--download-jobs', type=int, default=4, metavar="N",
+        help='Number of sources to download concurrently when building '
+             'SRPMs in parallel')
     parser.add_argument(
         "--no-package-name-check",
         action="store_true", default=False,
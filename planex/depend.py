@@ -5,13 +5,25 @@ planex-depend: Generate Makefile-format dependencies from spec files
 """
 
 import argparse
+import contextlib
+import json
+import multiprocessing
 import os
+import pipes
 import planex.spec as pkg
 import platform
+import StringIO
 import sys
 import urlparse
 from planex import mappkgname
+from planex import ninja
 from planex import sources
+from planex.digestcache import hash_file
+from planex.globals import BUILD_ROOT_DIR
+from planex.util import atomic_write, write_if_changed
+
+DEPDIR_STATE = "provides.json"
+DEPDIR_VERSION = 1
 
 
 def build_type():
@@ -30,6 +42,51 @@ def build_type():
         return "rpm"
 
 
+def load_spec_record(job):
+    """
+    Load one spec file and return its record as a dictionary.   job is
+    a tuple of the spec path and the options controlling how it is
+    loaded.   This runs in a worker process when specs are loaded in
+    parallel, so it must not close over any state in the parent and
+    its argument and result must be picklable.
+    """
+    (spec_path, packaging, dist, os_type, check_package_name, topdir) = job
+    if packaging == "deb":
+        def map_name_fn(name):
+            """Map an RPM package name to a Debian package name"""
+            return mappkgname.map_package(name, os_type)
+
+        spec = pkg.load_spec(spec_path, target="deb", map_name=map_name_fn,
+                             map_name_id="deb:%s" % os_type,
+                             check_package_name=check_package_name,
+                             topdir=topdir)
+    else:
+        spec = pkg.load_spec(spec_path, target="rpm", dist=dist,
+                             check_package_name=check_package_name,
+                             topdir=topdir)
+    return spec.to_dict()
+
+
+def load_spec_records(jobs, workers):
+    """
+    Load the spec files described by jobs, using up to workers worker
+    processes.   librpm keeps the macros defined while loading a spec in
+    global state, so specs cannot be loaded in parallel threads; each
+    worker process has its own copy of that state instead.   Returns the
+    records in the same order as jobs.
+    """
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        try:
+            records = pool.map(load_spec_record, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        records = [load_spec_record(job) for job in jobs]
+    return [pkg.SpecRecord(**record) for record in records]
+
+
 def build_srpm_from_spec(spec):
     """
     Generate rules to build SRPM from spec
@@ -123,7 +180,353 @@ def buildrequires_for_rpm(spec, provides_to_rpm):
             print "%s: %s" % (rpmpath, buildreqrpm)
 
 
-def parse_cmdline():
+def print_spec_rules(spec, args, provides_to_rpm):
+    """
+    Generate all the rules for a single spec
+    """
+    build_srpm_from_spec(spec)
+    download_rpm_sources(spec, args)
+    build_rpm_from_srpm(spec)
+    buildrequires_for_rpm(spec, provides_to_rpm)
+    print ""
+
+
+def print_aggregate_rules(specs):
+    """
+    Generate targets to build all srpms and all rpms
+    """
+    all_rpms = []
+    all_srpms = []
+    for spec in specs.itervalues():
+        rpm_path = spec.binary_package_paths()[0]
+        all_rpms.append(rpm_path)
+        all_srpms.append(spec.source_package_path())
+        print "%s: %s" % (spec.name(), rpm_path)
+    print ""
+
+    print "rpms: " + " \\\n\t".join(all_rpms)
+    print ""
+    print "srpms: " + " \\\n\t".join(all_srpms)
+    print ""
+    print "install: all"
+    print "\t. scripts/%s/install.sh" % build_type()
+
+
+def load_specs(args, spec_paths):
+    """
+    Load the spec files in spec_paths as specified by the command line
+    arguments, exiting if a spec file is misnamed
+    """
+    os_type = None
+    if args.packaging == "deb":
+        os_type = platform.linux_distribution(
+            full_distribution_name=False)[1].lower()
+    jobs = [(spec_path, args.packaging, args.dist, os_type,
+             not args.no_package_name_check, args.topdir)
+            for spec_path in spec_paths]
+
+    try:
+        return load_spec_records(jobs, args.jobs)
+    except pkg.SpecNameMismatch as exn:
+        sys.stderr.write("error: %s\n" % exn.message)
+        sys.exit(1)
+
+
+def resolved_buildrequires(spec, provides_to_rpm):
+    """
+    Return the sorted list of RPMs built here which spec's build
+    requirements resolve to
+    """
+    return sorted(set(provides_to_rpm[buildreq]
+                      for buildreq in spec.buildrequires()
+                      if buildreq in provides_to_rpm))
+
+
+def fragment_path(depdir, spec_name):
+    """
+    Return the path of the dependency fragment for the named spec file
+    """
+    return os.path.join(depdir, "%s.d" % os.path.splitext(spec_name)[0])
+
+
+def depdir_options(args):
+    """
+    Return the options which affect the contents of the fragments.   If
+    they change, all the fragments must be regenerated.
+    """
+    return {"version": DEPDIR_VERSION, "packaging": args.packaging,
+            "dist": args.dist, "topdir": args.topdir,
+            "repos_path": args.repos_path,
+            "check_package_names": not args.no_package_name_check}
+
+
+def load_depdir_state(depdir, options):
+    """
+    Return the state recorded when the fragments in depdir were last
+    generated, or an empty state if they were generated with different
+    options
+    """
+    try:
+        with open(os.path.join(depdir, DEPDIR_STATE)) as state_file:
+            state = json.load(state_file)
+    except (IOError, ValueError):
+        return {}
+    if state.get("options") != options:
+        return {}
+    return state.get("specs", {})
+
+
+def save_depdir_state(depdir, options, specs):
+    """
+    Atomically record the state of the fragments in depdir
+    """
+    atomic_write(os.path.join(depdir, DEPDIR_STATE),
+                 json.dumps({"options": options, "specs": specs}))
+
+
+@contextlib.contextmanager
+def stdout_to(path):
+    """
+    Redirect rules printed within the block into the file at path.   The
+    file is only replaced if the block succeeds, and is left untouched
+    if its contents have not changed.
+    """
+    output = StringIO.StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+    write_if_changed(path, output.getvalue())
+
+
+def update_fragments(args, pkgs_to_ignore):
+    """
+    Bring the per-spec dependency fragments in args.depdir up to date,
+    in the style of gcc -MD.   Alongside the fragments, the state file
+    records the digest and parsed record of each spec file and the RPMs
+    which its build requirements resolved to.   Only spec files whose
+    contents have changed are loaded again, and only the fragments of
+    changed spec files and of spec files whose build requirements now
+    resolve differently are rewritten.   Returns the loaded specs which
+    are not ignored, keyed by spec file name.
+    """
+    if not os.path.isdir(args.depdir):
+        os.makedirs(args.depdir)
+    options = depdir_options(args)
+    old_state = load_depdir_state(args.depdir, options)
+
+    digests = dict((spec_path, hash_file(spec_path, "md5"))
+                   for spec_path in args.specs)
+    changed = [spec_path for spec_path in args.specs
+               if old_state.get(os.path.basename(spec_path), {})
+               .get("digest") != digests[spec_path]]
+    loaded = dict(zip(changed, load_specs(args, changed)))
+
+    specs = {}
+    state = {}
+    for spec_path in args.specs:
+        spec_name = os.path.basename(spec_path)
+        if spec_path in loaded:
+            spec = loaded[spec_path]
+        else:
+            spec = pkg.SpecRecord(**old_state[spec_name]["record"])
+        state[spec_name] = {"digest": digests[spec_path],
+                            "record": spec.to_dict()}
+        if spec.name() not in pkgs_to_ignore:
+            specs[spec_name] = spec
+
+    provides_to_rpm = package_to_rpm_map(specs.values())
+    for (spec_name, spec) in specs.iteritems():
+        edges = resolved_buildrequires(spec, provides_to_rpm)
+        state[spec_name]["edges"] = edges
+        old = old_state.get(spec_name, {})
+        path = fragment_path(args.depdir, spec_name)
+        if old.get("digest") != state[spec_name]["digest"] or \
+                old.get("edges") != edges or not os.path.exists(path):
+            with stdout_to(path):
+                print_spec_rules(spec, args, provides_to_rpm)
+
+    wanted = set(fragment_path(args.depdir, spec_name)
+                 for spec_name in specs)
+    for filename in os.listdir(args.depdir):
+        path = os.path.join(args.depdir, filename)
+        if filename.endswith(".d") and path not in wanted:
+            os.unlink(path)
+
+    save_depdir_state(args.depdir, options, state)
+    return specs
+
+
+# Rules for the Ninja build file.   Source trees named by file:// URLs
+# are archived by a rule which writes a depfile listing the files in the
+# tree, so Ninja tracks them itself rather than running find on every
+# build, and which only replaces the archive if its contents change, so
+# that restat can prune the source and binary package builds below it.
+NINJA_SOURCE_RULES = [
+    ("download", {
+        "command": "planex-downloader $url $out",
+        "description": "[DOWNLOADER] $out"}),
+    ("archive_tree", {
+        "command": "(printf '%s:' $out && find $srcdir -type f -printf ' %p')"
+                   " > $out.d && git --git-dir=$srcdir/.git archive"
+                   " --prefix $prefix/ -o $tmp HEAD &&"
+                   " if cmp -s $tmp $out; then rm -f $tmp;"
+                   " else mv -f $tmp $out; fi",
+        "description": "[GIT] $out",
+        "depfile": "$out.d",
+        "deps": "gcc",
+        "restat": True}),
+    ("archive_scm", {
+        "command": "$commands",
+        "description": "[ARCHIVER] $out"}),
+]
+
+NINJA_PACKAGE_RULES = {
+    "rpm": [
+        ("srpm", {
+            "command": 'rpmbuild --quiet --define "_topdir $topdir"'
+                       ' --define "%dist $dist" -bs $in',
+            "description": "[RPMBUILD] $out"}),
+        ("binary", {
+            "command": "planex-repodata refresh $topdir/RPMS &&"
+                       " planex-cache --debug --configdir=$topdir/mock"
+                       " --quiet --resultdir=$resultdir"
+                       " --chroot-slots=$chroot_slots"
+                       " --package-cache=$package_cache"
+                       " --disable-plugin=package_state --rebuild $in &&"
+                       " planex-repodata add $topdir/RPMS $resultdir*.rpm",
+            "description": "[MOCK] $out",
+            "pool": "mock"}),
+        ("repodata", {
+            "command": "planex-repodata refresh $topdir/RPMS",
+            "description": "[CREATEREPO] RPMS",
+            "restat": True}),
+    ],
+    "deb": [
+        ("srpm", {
+            "command": "planex-makedeb $in && flock --timeout 30"
+                       " $topdir/SRPMS scripts/deb/updaterepo sources"
+                       " $topdir/SRPMS",
+            "description": "[MAKEDEB] $out"}),
+        ("binary", {
+            "command": "touch RPMS/Packages && sudo cowbuilder --build"
+                       " --configfile pbuilder/pbuilderrc"
+                       " --buildresult RPMS $in && flock --timeout 30 RPMS"
+                       " scripts/deb/updaterepo packages RPMS",
+            "description": "[COWBUILDER] $out",
+            "pool": "mock"}),
+    ],
+}
+
+
+def ninja_source_builds(writer, spec, args, written):
+    """
+    Write build statements to fetch or archive the sources of spec,
+    skipping any which have already been written
+    """
+    for (url, path) in zip(spec.source_urls(), spec.source_paths()):
+        if path in written:
+            continue
+        source = urlparse.urlparse(url)
+
+        # Source comes from a remote HTTP server
+        if source.scheme in ["http", "https"]:
+            writer.build(path, "download", spec.specpath(),
+                         variables={"url": ninja.escape(url)})
+
+        # Source comes from a local file or directory
+        elif source.scheme == "file":
+            dirname = "%s-%s" % (os.path.basename(source.path),
+                                 spec.version())
+            (head, tail) = os.path.split(path)
+            writer.build(path, "archive_tree", spec.specpath(), variables={
+                "srcdir": ninja.escape(source.path),
+                "prefix": ninja.escape(dirname),
+                "tmp": ninja.escape(os.path.join(head, ".%s" % tail))})
+
+        elif source.scheme in ["git", "hg"]:
+            cmds = sources.source(url, args).archive_commands()
+            writer.build(path, "archive_scm", spec.specpath(), variables={
+                "commands": ninja.escape(" && ".join(" ".join(cmd)
+                                                     for cmd in cmds))})
+        else:
+            continue
+        written.add(path)
+
+
+def ninja_regen_build(writer, args):
+    """
+    Write a generator rule which reruns planex-depend, with the same
+    arguments, when any of the spec files changes, so that Ninja
+    reloads an up to date build file before building anything else.
+    The build file is only rewritten if it changes, so the rule needs
+    restat or Ninja would keep regenerating an unchanged file.
+    """
+    output = args.output or "build.ninja"
+    argv = list(args.argv)
+    if not args.output:
+        argv += ["--output", output]
+    writer.rule("regen", ninja.escape(" ".join(
+        pipes.quote(arg) for arg in ["planex-depend"] + argv)),
+                description="[DEPEND] $out", generator=True, restat=True)
+    writer.build(output, "regen", args.specs)
+    writer.line()
+
+
+def write_ninja(specs, args, provides_to_rpm):
+    """
+    Write a Ninja build file equivalent to the Makefile rules
+    """
+    writer = ninja.Writer(sys.stdout)
+    writer.comment("Generated by planex-depend: do not edit")
+    writer.variable("ninja_required_version", "1.3")
+    writer.line()
+    writer.variable("topdir", ninja.escape(args.topdir or BUILD_ROOT_DIR))
+    writer.variable("dist", ninja.escape(args.dist))
+    writer.variable("chroot_slots", str(args.chroot_slots))
+    if args.package_cache:
+        writer.variable("package_cache", ninja.escape(args.package_cache))
+    else:
+        writer.variable("package_cache", "$$HOME/.planex-cache/packages")
+    writer.line()
+    writer.pool("mock", args.chroot_slots)
+    for (name, rule) in NINJA_SOURCE_RULES + \
+            NINJA_PACKAGE_RULES[args.packaging]:
+        writer.rule(name, **rule)
+    ninja_regen_build(writer, args)
+
+    written = set()
+    all_rpms = []
+    for spec in specs.itervalues():
+        srpm_path = spec.source_package_path()
+        rpm_path = spec.binary_package_paths()[0]
+        ninja_source_builds(writer, spec, args, written)
+        writer.build(srpm_path, "srpm", spec.specpath(),
+                     implicit=spec.source_paths())
+        writer.build(rpm_path, "binary", srpm_path,
+                     implicit=resolved_buildrequires(spec, provides_to_rpm),
+                     variables={"resultdir": ninja.escape(
+                         os.path.dirname(rpm_path) + "/")})
+        writer.build(spec.name(), "phony", rpm_path)
+        writer.line()
+        all_rpms.append(rpm_path)
+
+    writer.build("srpms", "phony", [spec.source_package_path()
+                                    for spec in specs.itervalues()])
+    if args.packaging == "rpm":
+        # Make sure the metadata covers the last packages to be built
+        repomd = os.path.join(args.topdir or BUILD_ROOT_DIR,
+                              "RPMS", "repodata", "repomd.xml")
+        writer.build(repomd, "repodata", all_rpms)
+        writer.build("rpms", "phony", repomd)
+    else:
+        writer.build("rpms", "phony", all_rpms)
+    writer.default(["rpms"])
+
+
+def parse_cmdline(argv=None):
     """
     Parse command line options
     """
@@ -152,15 +555,41 @@ def parse_cmdline():
     parser.add_argument(
         "-t", "--topdir", metavar="DIR", default=None,
         help='Set rpmbuild toplevel directory')
-    return parser.parse_args()
-
-
-def main():
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, metavar="N",
+        help="Number of spec files to load concurrently")
+    parser.add_argument(
+        "-f", "--format", choices=["make", "ninja"], default="make",
+        help="Generate Makefile rules or a Ninja build file: default make")
+    parser.add_argument(
+        "-o", "--output", metavar="FILE", default=None,
+        help="Write to FILE, which is only touched if its contents change, "
+        "instead of to stdout")
+    parser.add_argument(
+        "--chroot-slots", type=int, default=4, metavar="N",
+        help="Number of mock builds which the Ninja build file runs at once")
+    parser.add_argument(
+        "--package-cache", metavar="DIR", default=None,
+        help="Package cache shared by the mock builds which the Ninja build "
+        "file runs: default $HOME/.planex-cache/packages")
+    parser.add_argument(
+        "-D", "--depdir", metavar="DIR", default=None,
+        help="Write the rules for each spec file to a separate fragment "
+        "in DIR, regenerating only those which have changed, and print "
+        "an index which includes them")
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    args.argv = argv
+    if args.depdir and args.format != "make":
+        parser.error("--depdir can only be used with --format make")
+    return args
+
+
+def print_rules(args):
     """
-    Entry point
+    Generate rules for all the spec files named on the command line
     """
-    args = parse_cmdline()
-    check_package_names = not args.no_package_name_check
     specs = {}
 
     pkgs_to_ignore = args.ignore
@@ -174,58 +603,39 @@ def main():
     for i in pkgs_to_ignore:
         print "# Will ignore: %s" % i
 
-    for spec_path in args.specs:
-        try:
-            if args.packaging == "deb":
-                os_type = platform.linux_distribution(
-                    full_distribution_name=False)[1].lower()
-
-                def map_name_fn(name):
-                    return mappkgname.map_package(name, os_type)
-
-                spec = pkg.Spec(spec_path, target="deb", map_name=map_name_fn,
-                                check_package_name=check_package_names,
-                                topdir=args.topdir)
-
-            else:
-                spec = pkg.Spec(spec_path, target="rpm", dist=args.dist,
-                                check_package_name=check_package_names,
-                                topdir=args.topdir)
-            pkg_name = spec.name()
-            if pkg_name in pkgs_to_ignore:
-                continue
-
-            specs[os.path.basename(spec_path)] = spec
+    if args.depdir:
+        specs = update_fragments(args, pkgs_to_ignore)
+        for spec_name in specs:
+            print "-include %s" % fragment_path(args.depdir, spec_name)
+        print ""
+        print_aggregate_rules(specs)
+        return
 
-        except pkg.SpecNameMismatch as exn:
-            sys.stderr.write("error: %s\n" % exn.message)
-            sys.exit(1)
+    records = load_specs(args, args.specs)
+    for (spec_path, spec) in zip(args.specs, records):
+        if spec.name() in pkgs_to_ignore:
+            continue
+        specs[os.path.basename(spec_path)] = spec
 
     provides_to_rpm = package_to_rpm_map(specs.values())
-
+    if args.format == "ninja":
+        write_ninja(specs, args, provides_to_rpm)
+        return
     for spec in specs.itervalues():
-        build_srpm_from_spec(spec)
-        download_rpm_sources(spec, args)
-        build_rpm_from_srpm(spec)
-        buildrequires_for_rpm(spec, provides_to_rpm)
-        print ""
+        print_spec_rules(spec, args, provides_to_rpm)
+    print_aggregate_rules(specs)
 
-    # Generate targets to build all srpms and all rpms
-    all_rpms = []
-    all_srpms = []
-    for spec in specs.itervalues():
-        rpm_path = spec.binary_package_paths()[0]
-        all_rpms.append(rpm_path)
-        all_srpms.append(spec.source_package_path())
-        print "%s: %s" % (spec.name(), rpm_path)
-    print ""
 
-    print "rpms: " + " \\\n\t".join(all_rpms)
-    print ""
-    print "srpms: " + " \\\n\t".join(all_srpms)
-    print ""
-    print "install: all"
-    print "\t. scripts/%s/install.sh" % build_type()
+def main():
+    """
+    Entry point
+    """
+    args = parse_cmdline()
+    if args.output:
+        with stdout_to(args.output):
+            print_rules(args)
+    else:
+        print_rules(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+"""
+Persistent cache of file digests.   A file is only rehashed if its
+inode, size or modification time have changed since it was last hashed.
+The cache is stored in the build root and shared by all planex tools.
+"""
+
+import hashlib
+import json
+import os
+import time
+from multiprocessing.dummy import Pool
+
+from planex.globals import DIGEST_CACHE
+from planex.util import atomic_write, locked
+
+READ_SIZE = 1024 * 1024
+
+# Some filesystems only record modification times to the second (or two,
+# on FAT).   A file modified within this long of being hashed could be
+# rewritten again without its stamp changing, so its digest is not cached.
+RACY_WINDOW = 2.0
+
+
+def hash_file(path, algo):
+    """Return the hex digest of the file at path"""
+    digest = hashlib.new(algo)
+    with open(path, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(READ_SIZE), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stamp(path):
+    """
+    Return the (inode, size, mtime) triple used to detect changed files.
+    A change is only detected if it alters one of these, so digests of
+    recently modified files are not cached (see RACY_WINDOW).
+    """
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime]
+
+
+class DigestCache(object):
+    """A persistent map from file paths to digests of their contents"""
+
+    def __init__(self, path=DIGEST_CACHE):
+        self.path = path
+        self.entries = self.load()
+        self.updates = {}
+
+    def load(self):
+        """Read the cache file, returning an empty cache if it is missing"""
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+
+    def digests(self, paths, algo="md5", jobs=None):
+        """
+        Return a dictionary mapping each file in paths to its digest.
+        Files which have changed since they were last hashed are hashed
+        concurrently, using up to jobs threads.   Files modified within
+        RACY_WINDOW of being hashed are hashed again next time.
+        """
+        results = {}
+        missing = []
+        for path in paths:
+            key = "%s:%s" % (algo, os.path.abspath(path))
+            entry = self.entries.get(key)
+            current = stamp(path)
+            if entry and entry[:3] == current:
+                results[path] = entry[3]
+            else:
+                missing.append((path, key, current))
+
+        hashed_at = time.time()
+        if len(missing) > 1 and jobs != 1:
+            pool = Pool(jobs)
+            try:
+                digests = pool.map(lambda item: hash_file(item[0], algo),
+                                   missing)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            digests = [hash_file(path, algo) for (path, _, _) in missing]
+
+        for ((path, key, current), digest) in zip(missing, digests):
+            results[path] = digest
+            if hashed_at - current[2] >= RACY_WINDOW:
+                self.entries[key] = self.updates[key] = current + [digest]
+        return results
+
+    def digest(self, path, algo="md5"):
+        """Return the digest of the file at path"""
+        return self.digests([path], algo)[path]
+
+    def save(self):
+        """
+        Merge our new entries into the cache file.   Other planex tools
+        may be updating the cache at the same time, so hold a lock and
+        reread the file rather than overwriting their entries.
+        """
+        if not self.updates:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with locked(self.path + ".lock"):
+            entries = self.load()
+            entries.update(self.updates)
+            for key in entries.keys():
+                if not os.path.exists(key.split(":", 1)[1]):
+                    del entries[key]
+            atomic_write(self.path, json.dumps(entries))
+        self.updates = {}
+
+
+def file_digests(paths, algo="md5", cache_path=DIGEST_CACHE):
+    """
+    Return a dictionary mapping each file in paths to its digest,
+    using and updating the shared digest cache
+    """
+    cache = DigestCache(cache_path)
+    results = cache.digests(paths, algo)
+    cache.save()
+    return results
@@ -16,3 +16,8 @@ class InvalidURL(Exception):
 class NoRepository(Exception):
     """No repository exists at path"""
     pass
+
+
+class BuildFailed(Exception):
+    """A package failed to build; the message is the tail of its log"""
+    pass
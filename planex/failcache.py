@@ -0,0 +1,137 @@
+"""
+Negative cache of build failures.
+
+When a package fails to build, the tail of its build logs is recorded
+next to where the successful build would have been cached, as
+HASH.failed.   Until the record expires, later attempts to build the
+same hash fail immediately with the recorded log instead of spending
+minutes setting up a chroot only to fail in the same way.
+
+Failures which look like problems with the build host or the network
+rather than with the package are not recorded.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+
+from planex.util import atomic_write
+
+FAILED_SUFFIX = ".failed"
+DEFAULT_TTL = 24 * 3600
+LOG_TAIL_LINES = 50
+
+INFRASTRUCTURE_RE = re.compile("|".join([
+    r"Cannot retrieve repository metadata",
+    r"Could not resolve host",
+    r"Network is unreachable",
+    r"Connection (refused|reset|timed out)",
+    r"\[Errno 14\]",
+    r"No space left on device",
+    r"Cannot allocate memory",
+    r"\bKilled\b",
+    r"locked by another process",
+    r"^sudo: ",
+]), re.MULTILINE)
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(duration):
+    """Parse a duration such as 3600, 90m, 12h or 2d into seconds"""
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$", duration.lower())
+    if not match:
+        raise ValueError("Invalid duration: %s" % duration)
+    (number, unit) = match.groups()
+    return float(number) * DURATION_UNITS.get(unit or "s")
+
+
+def tail(text, lines=LOG_TAIL_LINES):
+    """Return the last lines of text"""
+    return "\n".join(text.rstrip("\n").split("\n")[-lines:]) + "\n"
+
+
+def build_log_tail(resultdir, output=""):
+    """
+    Return the tails of the mock logs in resultdir, followed by the tail
+    of output, the output of the build command
+    """
+    sections = []
+    for name in ["root.log", "build.log"]:
+        path = os.path.join(resultdir, name)
+        if os.path.isfile(path):
+            with open(path) as log:
+                sections.append("==> %s <==\n%s" % (name, tail(log.read())))
+    if output.strip():
+        sections.append("==> output <==\n%s" % tail(output))
+    return "".join(sections)
+
+
+def is_infrastructure_failure(log):
+    """
+    Return True if log suggests the build failed because of a problem
+    with the build host or the network, rather than with the package
+    """
+    return INFRASTRUCTURE_RE.search(log) is not None
+
+
+def failure_path(cache_dir, pkg_hash):
+    """Return the path of the failure record for pkg_hash"""
+    return os.path.join(cache_dir, pkg_hash + FAILED_SUFFIX)
+
+
+def record(cache_dir, pkg_hash, log):
+    """
+    Record that pkg_hash failed to build with the given log tail.
+    Returns False, recording nothing, for infrastructure failures.
+    """
+    if is_infrastructure_failure(log):
+        logging.info("Not caching failure of %s: it looks like an "
+                     "infrastructure problem", pkg_hash)
+        return False
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    path = failure_path(cache_dir, pkg_hash)
+    atomic_write(path, json.dumps({"time": time.time(), "log": log}))
+    logging.debug("Recorded failure of %s in %s", pkg_hash, path)
+    return True
+
+
+def lookup(cachedirs, pkg_hash, ttl=DEFAULT_TTL):
+    """
+    Return the unexpired failure record for pkg_hash in cachedirs, a
+    dictionary with the time of the failure and its log, or None.
+    Expired records are removed.
+    """
+    now = time.time()
+    for cache_dir in cachedirs:
+        path = failure_path(cache_dir, pkg_hash)
+        try:
+            with open(path) as failure_file:
+                failure = json.load(failure_file)
+        except (IOError, ValueError):
+            continue
+        if now - failure["time"] < ttl:
+            return failure
+        logging.debug("Failure record %s has expired", path)
+        clear([cache_dir], pkg_hash)
+    return None
+
+
+def clear(cachedirs, pkg_hash):
+    """Remove any failure records for pkg_hash"""
+    for cache_dir in cachedirs:
+        try:
+            os.unlink(failure_path(cache_dir, pkg_hash))
+        except OSError:
+            pass
+
+
+def describe(pkg_hash, failure):
+    """Return the message reported when a build fails fast"""
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(failure["time"]))
+    return ("%s failed to build at %s; not retrying (use --retry-failed)\n"
+            "%s" % (pkg_hash, when, failure["log"]))
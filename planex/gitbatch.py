@@ -0,0 +1,161 @@
+"""
+Long-running git processes for object and ref queries.
+
+Resolving a revision with 'git rev-parse' costs a process spawn, and
+planex makes several such queries against each of hundreds of
+repositories.   Instead, one 'git cat-file --batch-check' process is
+kept per repository and queries are written to it over a pipe.   The
+processes are started on first use and closed when planex exits.   At
+most MAX_PROCESSES are kept open at once; the least recently used is
+closed to make room for another.
+
+Tags are listed by reading the ref files and packed-refs directly.
+"""
+
+import atexit
+import fcntl
+import os
+import subprocess
+import threading
+
+# Each process holds two pipes open.   Planex sweeps over every
+# repository in turn, so the limit should cover a whole build's worth.
+MAX_PROCESSES = 256
+
+
+class GitBatchError(Exception):
+    """The batch process for a repository exited unexpectedly"""
+    pass
+
+
+class BatchCheck(object):
+    """A 'git cat-file --batch-check' process for one repository"""
+
+    def __init__(self, dotgitdir):
+        self.dotgitdir = dotgitdir
+        self.lock = threading.Lock()
+        self.proc = subprocess.Popen(
+            ["git", "--git-dir=%s" % dotgitdir, "cat-file", "--batch-check"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # Stop later children inheriting the pipes, which would keep
+        # this process running after close().   This is much cheaper
+        # than close_fds, which closes every possible descriptor.
+        for pipe in [self.proc.stdin, self.proc.stdout]:
+            flags = fcntl.fcntl(pipe.fileno(), fcntl.F_GETFD)
+            fcntl.fcntl(pipe.fileno(), fcntl.F_SETFD,
+                        flags | fcntl.FD_CLOEXEC)
+
+    def query(self, obj):
+        """
+        Return the (hash, type, size) of the object named by obj, which
+        may be any revision expression, or None if it does not exist
+        """
+        with self.lock:
+            try:
+                self.proc.stdin.write(obj + "\n")
+                self.proc.stdin.flush()
+                line = self.proc.stdout.readline()
+            except IOError:
+                line = ""
+        if not line:
+            raise GitBatchError("git cat-file exited for %s" % self.dotgitdir)
+        fields = line.split()
+        if len(fields) != 3:
+            # "<obj> missing" or "<obj> ambiguous"
+            return None
+        return (fields[0], fields[1], int(fields[2]))
+
+    def close(self):
+        """Stop the process and close its pipes"""
+        with self.lock:
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+            self.proc.wait()
+            self.proc.stdout.close()
+
+
+_PROCESSES = {}
+_RECENTLY_USED = []
+_PROCESSES_LOCK = threading.Lock()
+
+
+def batch_check(dotgitdir):
+    """Return the batch process for the repository at dotgitdir"""
+    dotgitdir = os.path.abspath(dotgitdir)
+    with _PROCESSES_LOCK:
+        if dotgitdir in _PROCESSES:
+            _RECENTLY_USED.remove(dotgitdir)
+        else:
+            if len(_PROCESSES) >= MAX_PROCESSES:
+                _PROCESSES.pop(_RECENTLY_USED.pop(0)).close()
+            _PROCESSES[dotgitdir] = BatchCheck(dotgitdir)
+        _RECENTLY_USED.append(dotgitdir)
+        return _PROCESSES[dotgitdir]
+
+
+@atexit.register
+def close_all():
+    """Stop all the batch processes"""
+    with _PROCESSES_LOCK:
+        for proc in _PROCESSES.values():
+            proc.close()
+        _PROCESSES.clear()
+        del _RECENTLY_USED[:]
+
+
+def resolve(dotgitdir, rev):
+    """
+    Return the hash of the object named by rev in the repository at
+    dotgitdir, or None if it does not exist
+    """
+    try:
+        result = batch_check(dotgitdir).query(rev)
+    except GitBatchError:
+        dotgitdir = os.path.abspath(dotgitdir)
+        with _PROCESSES_LOCK:
+            dead = _PROCESSES.pop(dotgitdir, None)
+            if dead:
+                _RECENTLY_USED.remove(dotgitdir)
+        if dead:
+            dead.close()
+        raise
+    if result is None:
+        return None
+    return result[0]
+
+
+def commit_of(dotgitdir, rev):
+    """Return the hash of the commit which rev refers to, or None"""
+    return resolve(dotgitdir, "%s^{commit}" % rev)
+
+
+def tags(dotgitdir):
+    """Return the names of the tags in the repository at dotgitdir"""
+    names = set()
+    tags_dir = os.path.join(dotgitdir, "refs", "tags")
+    for (dirpath, _, filenames) in os.walk(tags_dir):
+        for filename in filenames:
+            names.add(os.path.relpath(os.path.join(dirpath, filename),
+                                      tags_dir))
+    try:
+        with open(os.path.join(dotgitdir, "packed-refs")) as packed_refs:
+            for line in packed_refs:
+                fields = line.split()
+                if len(fields) == 2 and fields[1].startswith("refs/tags/"):
+                    names.add(fields[1][len("refs/tags/"):])
+    except IOError:
+        pass
+    return sorted(names)
+
+
+def tags_at(dotgitdir, commit, names=None):
+    """
+    Return the names of the tags which refer to commit, considering only
+    the tags in names if it is given
+    """
+    if names is None:
+        names = tags(dotgitdir)
+    return [name for name in names
+            if commit_of(dotgitdir, "refs/tags/%s" % name) == commit]
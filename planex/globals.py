@@ -8,6 +8,10 @@ BUILD_ROOT_DIR = "planex-build-root"
 
 SPECS_GLOB = os.path.join(SPECS_DIR, "*.spec")
 
+DIGEST_CACHE = os.path.join(BUILD_ROOT_DIR, "digests.json")
+
+SRPM_FILES_INDEX = os.path.join(BUILD_ROOT_DIR, "srpm-files.json")
+
 HASHFN = "md5"
 
 PLANEX_REPO_NAME = "planex-repo"
@@ -0,0 +1,203 @@
+"""
+Remote HTTP tier for planex-cache.
+
+A cache entry is a directory named after its hash.   An HTTP cache
+server, such as planex-cache-server, exposes entries as follows:
+
+  HEAD /HASH/                200 if the entry exists, 404 otherwise
+  GET  /HASH/                JSON list of the files in the entry
+  GET  /HASH/PATH            contents of a file in the entry
+  PUT  /HASH/PATH?upload=ID  upload a file into pending upload ID
+  PUT  /HASH/?upload=ID      publish pending upload ID; the body is the
+                             JSON list of files it should contain
+
+Lists of files contain a {"path": PATH, "size": SIZE, "sha256": DIGEST}
+object for each file.   Each uploader chooses a random upload ID, so
+concurrent uploads of the same entry do not interfere.   The server
+rejects a file which is shorter than its Content-Length and only
+publishes an upload if its files match the list, and clients check
+downloaded files against the list in the same way.   Entries only
+become visible once they have been published, so a reader never sees a
+partially uploaded entry.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import urllib2
+import uuid
+from multiprocessing.dummy import Pool
+
+DEFAULT_JOBS = 4
+READ_SIZE = 1024 * 1024
+URL_RE = re.compile(r"https?://[^/:]+(?::\d+)?[^:]*|[^:]+")
+
+
+def is_remote(location):
+    """Return True if location is the URL of a remote cache"""
+    return location.startswith("http://") or location.startswith("https://")
+
+
+def split_cachedirs(cachedirs):
+    """
+    Split a colon-separated cache search path, which may contain
+    http:// and https:// URLs as well as local directories
+    """
+    return URL_RE.findall(cachedirs)
+
+
+def entry_files(entry_dir):
+    """Return the paths of all files in a cache entry, relative to it"""
+    files = []
+    for (dirpath, _, filenames) in os.walk(entry_dir):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(dirpath, filename),
+                                         entry_dir))
+    return sorted(files)
+
+
+def file_record(path, filename):
+    """Return the file list entry for filename, stored at path"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(filename, "rb") as src:
+        for block in iter(lambda: src.read(READ_SIZE), ""):
+            digest.update(block)
+            size += len(block)
+    return {"path": path, "size": size, "sha256": digest.hexdigest()}
+
+
+def entry_manifest(entry_dir):
+    """Return the list of files in a cache entry, with their digests"""
+    return [file_record(path, os.path.join(entry_dir, path))
+            for path in entry_files(entry_dir)]
+
+
+def copy_checked(src, dest_file, record):
+    """
+    Copy from src to dest_file, raising IOError unless the data copied
+    has the size and digest in record
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for block in iter(lambda: src.read(READ_SIZE), ""):
+        digest.update(block)
+        size += len(block)
+        dest_file.write(block)
+    if size != record["size"] or digest.hexdigest() != record["sha256"]:
+        raise IOError("%s: expected %d bytes with SHA-256 %s, got %d bytes "
+                      "with SHA-256 %s" % (record["path"], record["size"],
+                                           record["sha256"], size,
+                                           digest.hexdigest()))
+
+
+class MethodRequest(urllib2.Request):
+    """An HTTP request with an explicit method"""
+
+    def __init__(self, method, url, data=None):
+        urllib2.Request.__init__(self, url, data)
+        self.method = method
+
+    def get_method(self):
+        return self.method
+
+
+class HttpCache(object):
+    """A remote cache served over HTTP"""
+
+    def __init__(self, url, jobs=DEFAULT_JOBS):
+        self.url = url.rstrip("/") + "/"
+        self.jobs = jobs
+
+    def entry_url(self, pkg_hash, path="", upload=None):
+        """
+        Return the URL of an entry, or of a file within it, optionally
+        as part of an upload
+        """
+        url = "%s%s/%s" % (self.url, pkg_hash, urllib2.quote(path))
+        if upload is not None:
+            url += "?upload=%s" % upload
+        return url
+
+    def exists(self, pkg_hash):
+        """Return True if the remote cache has an entry for pkg_hash"""
+        try:
+            urllib2.urlopen(MethodRequest("HEAD", self.entry_url(pkg_hash)))
+            return True
+        except urllib2.HTTPError as err:
+            if err.code == 404:
+                return False
+            raise
+
+    def download_file(self, pkg_hash, record, entry_dir):
+        """
+        Download one file of an entry, described by its record in the
+        entry's file list, into entry_dir
+        """
+        dest = os.path.join(entry_dir, record["path"])
+        try:
+            os.makedirs(os.path.dirname(dest))
+        except OSError as exn:
+            # Files in the same directory are downloaded concurrently
+            if exn.errno != errno.EEXIST:
+                raise
+        response = urllib2.urlopen(self.entry_url(pkg_hash, record["path"]))
+        try:
+            with open(dest, "wb") as dest_file:
+                copy_checked(response, dest_file, record)
+        finally:
+            response.close()
+
+    def fetch(self, pkg_hash, entry_dir):
+        """
+        Download the entry for pkg_hash into entry_dir, fetching its files
+        in parallel.   entry_dir should be a staging directory which is
+        only published once the download has succeeded.
+        """
+        response = urllib2.urlopen(self.entry_url(pkg_hash))
+        try:
+            files = json.load(response)
+        finally:
+            response.close()
+
+        pool = Pool(self.jobs)
+        try:
+            pool.map(lambda record: self.download_file(pkg_hash, record,
+                                                       entry_dir), files)
+        finally:
+            pool.close()
+            pool.join()
+        logging.debug("Fetched %s from %s", pkg_hash, self.url)
+
+    def upload_file(self, pkg_hash, path, entry_dir, upload):
+        """
+        Upload one file of an entry as part of upload.   The file is
+        streamed rather than read into memory.
+        """
+        filename = os.path.join(entry_dir, path)
+        with open(filename, "rb") as src:
+            request = MethodRequest(
+                "PUT", self.entry_url(pkg_hash, path, upload), src)
+            request.add_header("Content-Length",
+                               str(os.fstat(src.fileno()).st_size))
+            request.add_header("Content-Type", "application/octet-stream")
+            urllib2.urlopen(request).close()
+
+    def upload(self, pkg_hash, entry_dir):
+        """Upload the local entry in entry_dir and publish it"""
+        upload = uuid.uuid4().hex
+        files = entry_manifest(entry_dir)
+        pool = Pool(self.jobs)
+        try:
+            pool.map(lambda record: self.upload_file(
+                pkg_hash, record["path"], entry_dir, upload), files)
+        finally:
+            pool.close()
+            pool.join()
+        urllib2.urlopen(MethodRequest("PUT",
+                                      self.entry_url(pkg_hash, "", upload),
+                                      json.dumps(files))).close()
+        logging.debug("Uploaded %s to %s", pkg_hash, self.url)
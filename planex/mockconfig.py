@@ -0,0 +1,100 @@
+"""
+Normalised views of mock configurations, used in cache keys.
+
+Hashing the text of a mock configuration file means that editing a
+comment, reordering options or changing a log file path invalidates
+every cache entry built with it.   Instead, planex-cache hashes only
+the loaded configuration options which affect the build output, and
+parses the embedded yum.conf so that its formatting and cosmetic
+options do not matter either.
+"""
+
+import ConfigParser
+import StringIO
+
+# config_opts which affect what mock builds
+DEFAULT_KEYS = [
+    "chroot_setup_cmd",
+    "dist",
+    "files",
+    "macros",
+    "more_buildreqs",
+    "package_manager",
+    "releasever",
+    "target_arch",
+    "yum.conf",
+]
+
+# yum.conf options which do not affect which packages are installed
+IGNORED_YUM_OPTIONS = [
+    "cachedir",
+    "debuglevel",
+    "errorlevel",
+    "keepcache",
+    "logfile",
+    "metadata_expire",
+    "mdpolicy",
+    "retries",
+    "syslog_device",
+    "syslog_ident",
+    "timeout",
+]
+
+
+def parse_keys(keys):
+    """Parse a comma-separated list of configuration keys"""
+    return [key.strip() for key in keys.split(",") if key.strip()]
+
+
+def normalise_yum_conf(text):
+    """
+    Return the settings in a yum.conf as a dictionary of sections, each
+    a dictionary of options, ignoring comments, layout and options which
+    do not affect the build.   If the text cannot be parsed, return its
+    non-blank lines.
+    """
+    parser = ConfigParser.RawConfigParser()
+    try:
+        parser.readfp(StringIO.StringIO(text))
+    except ConfigParser.Error:
+        # Fall back to ignoring only whitespace
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    sections = {}
+    for section in parser.sections():
+        sections[section] = dict(
+            (option, " ".join(value.split()))
+            for (option, value) in parser.items(section)
+            if option not in IGNORED_YUM_OPTIONS)
+    return sections
+
+
+def jsonable(value):
+    """Convert a configuration value into a form which can be JSON encoded"""
+    if isinstance(value, dict):
+        return dict((str(key), jsonable(val)) for (key, val) in value.items())
+    if isinstance(value, (list, tuple)):
+        return [jsonable(val) for val in value]
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    return str(value)
+
+
+def normalise(config_opts, keys=None, ignored=None):
+    """
+    Return the options in config_opts which affect the build output.
+    keys replaces the default list of relevant options, and options in
+    ignored are left out.
+    """
+    if keys is None:
+        keys = DEFAULT_KEYS
+    ignored = ignored or []
+
+    normalised = {}
+    for key in keys:
+        if key in ignored or key not in config_opts:
+            continue
+        if key == "yum.conf":
+            normalised[key] = normalise_yum_conf(config_opts[key])
+        else:
+            normalised[key] = jsonable(config_opts[key])
+    return normalised
@@ -0,0 +1,94 @@
+"""
+A minimal writer for Ninja build files
+"""
+
+
+def escape(text):
+    """Escape text so that Ninja does not expand variables in it"""
+    return text.replace("$", "$$")
+
+
+def escape_path(path):
+    """Escape a path for use as an input or output of a build statement"""
+    return escape(path).replace(" ", "$ ").replace(":", "$:")
+
+
+class Writer(object):
+    """Writes Ninja declarations to a file object"""
+
+    def __init__(self, output):
+        self.output = output
+
+    def line(self, text="", indent=0):
+        """Write a single line"""
+        self.output.write("%s%s\n" % ("  " * indent, text))
+
+    def comment(self, text):
+        """Write a comment"""
+        for line in text.splitlines():
+            self.line("# %s" % line)
+
+    def variable(self, key, value, indent=0):
+        """
+        Bind a variable.   The value is written as is, so it may refer
+        to other variables.
+        """
+        if value is None:
+            return
+        if isinstance(value, list):
+            value = " ".join(value)
+        self.line("%s = %s" % (key, value), indent)
+
+    def pool(self, name, depth):
+        """Declare a pool which runs at most depth jobs at once"""
+        self.line("pool %s" % name)
+        self.variable("depth", str(depth), indent=1)
+        self.line()
+
+    def rule(self, name, command, description=None, depfile=None,
+             deps=None, restat=False, generator=False, pool=None):
+        """Declare a rule"""
+        self.line("rule %s" % name)
+        self.variable("command", command, indent=1)
+        self.variable("description", description, indent=1)
+        self.variable("depfile", depfile, indent=1)
+        self.variable("deps", deps, indent=1)
+        self.variable("pool", pool, indent=1)
+        if restat:
+            self.variable("restat", "1", indent=1)
+        if generator:
+            self.variable("generator", "1", indent=1)
+        self.line()
+
+    def build(self, outputs, rule, inputs=None, implicit=None,
+              order_only=None, variables=None):
+        """
+        Declare a build statement.   Paths are escaped; the values of
+        variables are written as is.
+        """
+        def paths(items):
+            """Escape a path or a list of paths"""
+            if items is None:
+                return []
+            if not isinstance(items, list):
+                items = [items]
+            return [escape_path(item) for item in items]
+
+        words = ["build"] + paths(outputs)
+        words[-1] += ":"
+        words.append(rule)
+        words.extend(paths(inputs))
+        if implicit:
+            words.append("|")
+            words.extend(paths(implicit))
+        if order_only:
+            words.append("||")
+            words.extend(paths(order_only))
+        self.line(" ".join(words))
+        for (key, value) in sorted((variables or {}).items()):
+            self.variable(key, value, indent=1)
+
+    def default(self, targets):
+        """Declare the targets built when none are named"""
+        self.line("default %s" % " ".join(escape_path(target)
+                                          for target in targets))
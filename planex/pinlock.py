@@ -0,0 +1,145 @@
+"""
+Persistent record of the results of pinning SCM repositories.
+
+Pinning a repository finds the hash of its head and derives a version
+from its history, which takes several git or hg commands.   The results
+are recorded in a lock file in the repositories directory, keyed by the
+path of each repository, together with a summary of the repository's
+state which can be read cheaply without running git or hg: the commit
+which HEAD refers to, read directly from the ref files, and the
+modification times of the tags.   The recorded result is reused for as
+long as the state is unchanged.
+"""
+
+import binascii
+import json
+import os
+import threading
+
+from planex.util import atomic_write, locked
+
+LOCKFILE = ".planex-pins.json"
+
+
+def mtime(path):
+    """Return the modification time of path, or None if it is missing"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def read_ref(dotgitdir, ref):
+    """
+    Return the commit which ref refers to in the repository at dotgitdir,
+    looking in packed-refs if it has no ref file, or None if it cannot
+    be found
+    """
+    try:
+        with open(os.path.join(dotgitdir, ref)) as ref_file:
+            return ref_file.read().strip()
+    except IOError:
+        pass
+    try:
+        with open(os.path.join(dotgitdir, "packed-refs")) as packed_refs:
+            for line in packed_refs:
+                fields = line.split()
+                if len(fields) == 2 and fields[1] == ref:
+                    return fields[0]
+    except IOError:
+        pass
+    return None
+
+
+def git_state(dotgitdir):
+    """
+    Return the state of the git repository at dotgitdir, or None if it
+    cannot be read
+    """
+    try:
+        with open(os.path.join(dotgitdir, "HEAD")) as head_file:
+            head = head_file.read().strip()
+    except IOError:
+        return None
+    if head.startswith("ref: "):
+        head = read_ref(dotgitdir, head[len("ref: "):])
+        if head is None:
+            return None
+    return {"head": head,
+            "tags": [mtime(os.path.join(dotgitdir, "refs", "tags")),
+                     mtime(os.path.join(dotgitdir, "packed-refs"))]}
+
+
+def hg_state(repo):
+    """
+    Return the state of the Mercurial repository at repo, or None if it
+    cannot be read
+    """
+    try:
+        with open(os.path.join(repo, ".hg", "dirstate"), "rb") as dirstate:
+            parent = binascii.hexlify(dirstate.read(20))
+    except IOError:
+        return None
+    changelog = os.path.join(repo, ".hg", "store", "00changelog.i")
+    return {"parent": parent, "changelog": mtime(changelog)}
+
+
+class PinLock(object):
+    """The pin results recorded for the repositories in one directory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        """Read the lock file, returning no entries if it is missing"""
+        try:
+            with open(self.path) as lock_file:
+                return json.load(lock_file)
+        except (IOError, ValueError):
+            return {}
+
+    def lookup(self, repo, state):
+        """
+        Return the (hash, version) pair recorded for repo, or None if
+        nothing has been recorded for its current state
+        """
+        entry = self.entries.get(repo)
+        if state is None or entry is None or entry["state"] != state:
+            return None
+        return (entry["hash"], entry["version"])
+
+    def update(self, repo, state, scmhash, version):
+        """
+        Record the result of pinning repo in state.   Entries recorded
+        concurrently by other processes are kept.   If the lock file
+        cannot be written, for instance because the repositories are
+        in a read-only mirror, the result is not recorded.
+        """
+        if state is None:
+            return
+        with self.lock:
+            try:
+                with locked(self.path + ".lock"):
+                    entries = self.load()
+                    entries[repo] = {"state": state, "hash": scmhash,
+                                     "version": version}
+                    atomic_write(self.path, json.dumps(entries, indent=2,
+                                                       sort_keys=True))
+                    self.entries = entries
+            except (IOError, OSError):
+                pass
+
+
+_PIN_LOCKS = {}
+_PIN_LOCKS_LOCK = threading.Lock()
+
+
+def pin_lock(repos_path):
+    """Return the PinLock for the repositories in repos_path"""
+    path = os.path.join(repos_path, LOCKFILE)
+    with _PIN_LOCKS_LOCK:
+        if path not in _PIN_LOCKS:
+            _PIN_LOCKS[path] = PinLock(path)
+        return _PIN_LOCKS[path]
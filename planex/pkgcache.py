@@ -0,0 +1,290 @@
+"""
+A package download cache shared by the mock roots which planex-cache
+spawns.
+
+Each mock root normally keeps its own YUM cache, so concurrent and
+successive builds in different roots download and store the same
+build requirements many times over.   planex-cache can instead point
+the yum_cache plugin of each root at a directory inside a shared store,
+laid out as follows:
+
+  objects/TYPE-CHECKSUM.rpm       packages, named by the checksum given
+                                  for them in the repository metadata
+  roots/ROOT/REPO/packages/*.rpm  each root's YUM cache
+
+After a build, packages which YUM downloaded are checked against the
+checksums in the root's cached repository metadata and cloned into the
+object store.   Before a build, packages in the store are cloned into
+the root's cache for each repository which lists them, so YUM finds
+them there instead of downloading them again.   A root which has no
+metadata for a repository yet is seeded using another root's metadata
+for a repository of the same name; YUM checks each cached package
+against its own metadata and downloads it again if it does not match.
+
+Packages are cloned with reflinks where the filesystem supports them
+and copied otherwise, never hardlinked: YUM runs as root and may resume
+a download by appending to a cached file in place, which would corrupt
+a shared inode for every root.   The store is kept within a size budget
+by evicting the least recently used packages.
+
+The object store is protected by a lock file, and each root's cache by
+the lock which mock's yum_cache plugin itself takes around YUM runs.
+"""
+
+import contextlib
+import fcntl
+import glob
+import logging
+import os
+import sqlite3
+import stat
+import struct
+
+from planex.digestcache import hash_file
+from planex.util import clone_or_copy, locked
+
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = "\x8e\xad\xe8\x01"
+RPMSIGTAG_SIZE = 1000
+YUM_CACHE_LOCK = "yumcache.lock"
+
+
+def rpm_is_complete(path):
+    """
+    Return False if the RPM at path is shorter than its signature header
+    says it should be, for instance because its download was interrupted
+    """
+    try:
+        with open(path, "rb") as rpm_file:
+            rpm_file.seek(RPM_LEAD_SIZE)
+            intro = rpm_file.read(16)
+            if len(intro) < 16 or intro[:4] != RPM_HEADER_MAGIC:
+                return False
+            (count, data_size) = struct.unpack(">II", intro[8:])
+            index = rpm_file.read(16 * count)
+    except IOError:
+        return False
+    sig_size = 16 + 16 * count + data_size
+    sig_size += -sig_size % 8
+    for offset in range(0, len(index), 16):
+        (tag, _, data_offset, _) = struct.unpack(
+            ">IIII", index[offset:offset + 16])
+        if tag == RPMSIGTAG_SIZE:
+            with open(path, "rb") as rpm_file:
+                rpm_file.seek(RPM_LEAD_SIZE + 16 + 16 * count + data_offset)
+                (size,) = struct.unpack(">I", rpm_file.read(4))
+            return os.path.getsize(path) >= RPM_LEAD_SIZE + sig_size + size
+    return True
+
+
+@contextlib.contextmanager
+def yum_cache_locked(root_dir):
+    """Hold the lock which mock's yum_cache plugin takes on root_dir"""
+    with open(os.path.join(root_dir, YUM_CACHE_LOCK), "a+") as lock_file:
+        fcntl.lockf(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def repo_checksums(repo_dir):
+    """
+    Return a dictionary mapping the file name of each package listed in
+    the YUM metadata cached in repo_dir to its object name, TYPE-CHECKSUM
+    """
+    databases = glob.glob(os.path.join(repo_dir, "*primary*.sqlite")) + \
+        glob.glob(os.path.join(repo_dir, "gen", "*primary*.sqlite"))
+    if not databases:
+        return {}
+    database = max(databases, key=os.path.getmtime)
+    checksums = {}
+    try:
+        conn = sqlite3.connect(database)
+        try:
+            for (href, algo, checksum) in conn.execute(
+                    "SELECT location_href, checksum_type, pkgId "
+                    "FROM packages"):
+                checksums[os.path.basename(href)] = "%s-%s" % (algo,
+                                                               checksum)
+        finally:
+            conn.close()
+    except sqlite3.Error as exn:
+        logging.debug("Cannot read %s: %s", database, exn)
+    return checksums
+
+
+def verify(path, name):
+    """Return True if the file at path has the checksum in its object name"""
+    (algo, checksum) = name.split("-", 1)
+    # YUM calls SHA-1 'sha'
+    algo = {"sha": "sha1"}.get(algo, algo)
+    try:
+        return hash_file(path, algo) == checksum
+    except ValueError:
+        # Unknown digest algorithm
+        return False
+
+
+class PackageCache(object):
+    """A content-addressed store of packages downloaded by YUM"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, "objects")
+        self.roots_dir = os.path.join(store_dir, "roots")
+        self.lock_path = os.path.join(store_dir, ".lock")
+        if not os.path.isdir(self.objects_dir):
+            os.makedirs(self.objects_dir)
+
+    def root_dir(self, root):
+        """Return the YUM cache directory for the mock root called root"""
+        return os.path.join(self.roots_dir, root)
+
+    def roots(self):
+        """Return the names of the roots which have used the store"""
+        if not os.path.isdir(self.roots_dir):
+            return []
+        return sorted(os.listdir(self.roots_dir))
+
+    def object_path(self, name):
+        """Return the path of the package with the given object name"""
+        return os.path.join(self.objects_dir, name + ".rpm")
+
+    def objects(self):
+        """Return the names of the packages in the store"""
+        return set(name[:-len(".rpm")] for name in os.listdir(self.objects_dir)
+                   if name.endswith(".rpm"))
+
+    def known_checksums(self, root, repo):
+        """
+        Return the checksums of the packages in repo from the metadata
+        cached for root, or failing that for any other root
+        """
+        checksums = repo_checksums(os.path.join(self.root_dir(root), repo))
+        for other in self.roots():
+            if checksums:
+                break
+            checksums = repo_checksums(os.path.join(self.root_dir(other),
+                                                    repo))
+        return checksums
+
+    def root_packages(self, root_dir):
+        """
+        Yield (repo, filename, path, name) for each package in root_dir,
+        where name is the package's object name if it is listed in the
+        root's metadata, or None
+        """
+        if not os.path.isdir(root_dir):
+            return
+        for repo in os.listdir(root_dir):
+            packages_dir = os.path.join(root_dir, repo, "packages")
+            if not os.path.isdir(packages_dir):
+                continue
+            checksums = repo_checksums(os.path.join(root_dir, repo))
+            for filename in os.listdir(packages_dir):
+                if filename.endswith(".rpm"):
+                    yield (repo, filename, os.path.join(packages_dir,
+                                                        filename),
+                           checksums.get(filename))
+
+    def seed(self, root, repos):
+        """
+        Prepare the YUM cache of root, whose configuration defines the
+        repositories repos, by cloning in every package in the store
+        which those repositories list.   Returns the directory to use as
+        the root's YUM cache.
+        """
+        root_dir = self.root_dir(root)
+        for repo in repos:
+            packages_dir = os.path.join(root_dir, repo, "packages")
+            if not os.path.isdir(packages_dir):
+                os.makedirs(packages_dir)
+
+        seeded = 0
+        with locked(self.lock_path):
+            objects = self.objects()
+            with yum_cache_locked(root_dir):
+                for repo in repos:
+                    for (filename, name) in \
+                            self.known_checksums(root, repo).items():
+                        path = os.path.join(root_dir, repo, "packages",
+                                            filename)
+                        if name in objects and not os.path.lexists(path):
+                            obj = self.object_path(name)
+                            clone_or_copy(obj, path)
+                            # Record the use for eviction
+                            os.utime(obj, None)
+                            seeded += 1
+        logging.debug("Seeded %d packages into %s", seeded, root_dir)
+        return root_dir
+
+    def harvest(self, root):
+        """
+        Clone packages which YUM downloaded into the YUM cache of root
+        into the object store, if they match the root's metadata
+        """
+        root_dir = self.root_dir(root)
+        harvested = 0
+        with locked(self.lock_path):
+            objects = self.objects()
+            with yum_cache_locked(root_dir):
+                for (_, _, path, name) in self.root_packages(root_dir):
+                    if name is None or name in objects or \
+                            not rpm_is_complete(path) or \
+                            not verify(path, name):
+                        continue
+                    obj = self.object_path(name)
+                    clone_or_copy(path, obj, stat.S_IRUSR | stat.S_IRGRP |
+                                  stat.S_IROTH)
+                    objects.add(name)
+                    harvested += 1
+        logging.debug("Harvested %d packages from %s", harvested, root_dir)
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used packages, from the object store
+        and from the roots' caches, until together they use no more than
+        max_size bytes.   Returns the evicted object names.
+        """
+        evicted = []
+        with locked(self.lock_path):
+            # object name -> [last used, size of all copies, paths]
+            usage = dict((name, [0, 0, [self.object_path(name)]])
+                         for name in self.objects())
+            total = 0
+            for root in self.roots():
+                for (_, _, path, name) in \
+                        self.root_packages(self.root_dir(root)):
+                    total += os.path.getsize(path)
+                    if name in usage:
+                        usage[name][2].append(path)
+            for (name, entry) in usage.items():
+                for path in entry[2]:
+                    info = os.stat(path)
+                    entry[0] = max(entry[0], info.st_atime, info.st_mtime)
+                    entry[1] += info.st_size
+                total += os.path.getsize(entry[2][0])
+
+            for (name, (_, size, _)) in sorted(usage.items(),
+                                               key=lambda item: item[1][0]):
+                if total <= max_size:
+                    break
+                evicted.append(name)
+                total -= size
+            if not evicted:
+                return evicted
+
+            for root in self.roots():
+                root_dir = self.root_dir(root)
+                with yum_cache_locked(root_dir):
+                    for name in evicted:
+                        for path in usage[name][2][1:]:
+                            if path.startswith(root_dir + os.sep):
+                                os.unlink(path)
+            for name in evicted:
+                os.unlink(self.object_path(name))
+        logging.debug("Evicted %d packages from %s", len(evicted),
+                      self.store_dir)
+        return evicted
@@ -0,0 +1,179 @@
+"""
+planex-repodata: Incrementally maintain yum repository metadata
+
+Builders record the packages they produce with 'add', which only
+appends them to a journal.   The metadata itself is regenerated by
+'refresh', which is called just before a build which needs to see
+the new packages.   Concurrent refreshes are coalesced: one runs
+createrepo for everything in the journal and the others find nothing
+left to do.   createrepo is given the list of known packages, so it
+does not rescan the whole repository directory.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from planex.util import atomic_write, locked, run
+
+STATE_FILE = ".planex-repodata.json"
+STATE_LOCK = ".planex-repodata.lock"
+REFRESH_LOCK = ".planex-repodata-refresh.lock"
+
+
+def load_state(repodir):
+    """
+    Load the set of packages in the repository metadata and the set
+    waiting to be added.   Both map paths relative to repodir to mtimes.
+    """
+    try:
+        with open(os.path.join(repodir, STATE_FILE)) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return {"packages": {}, "pending": {}}
+
+
+def save_state(repodir, state):
+    """Atomically replace the saved repository state"""
+    atomic_write(os.path.join(repodir, STATE_FILE), json.dumps(state))
+
+
+def scan(repodir):
+    """Return all the packages under repodir, with their mtimes"""
+    packages = {}
+    for (dirpath, _, filenames) in os.walk(repodir):
+        for filename in filenames:
+            if filename.endswith(".rpm"):
+                path = os.path.join(dirpath, filename)
+                packages[os.path.relpath(path, repodir)] = \
+                    os.path.getmtime(path)
+    return packages
+
+
+def has_metadata(repodir):
+    """Return True if repodir has been indexed by createrepo"""
+    return os.path.exists(os.path.join(repodir, "repodata", "repomd.xml"))
+
+
+def add(repodir, pkgs):
+    """
+    Record that pkgs have been added to or updated in repodir.   This
+    only updates the journal; the metadata is updated by refresh().
+    Packages which are already in the metadata and have not changed
+    since they were indexed are ignored.
+    """
+    if not os.path.isdir(repodir):
+        os.makedirs(repodir)
+
+    with locked(os.path.join(repodir, STATE_LOCK)):
+        state = load_state(repodir)
+        changed = False
+        for pkg in pkgs:
+            relpath = os.path.relpath(pkg, repodir)
+            mtime = os.path.getmtime(pkg)
+            if state["packages"].get(relpath) != mtime:
+                state["pending"][relpath] = mtime
+                changed = True
+        if changed:
+            save_state(repodir, state)
+
+
+def refresh(repodir, force=False):
+    """
+    Bring the metadata for repodir up to date with the journal.
+    If another process is already refreshing, wait for it; our packages
+    will usually have been included in its update.   Returns True if
+    createrepo was run.
+    """
+    if not os.path.isdir(repodir):
+        os.makedirs(repodir)
+
+    with locked(os.path.join(repodir, REFRESH_LOCK)):
+        with locked(os.path.join(repodir, STATE_LOCK)):
+            state = load_state(repodir)
+
+        if not has_metadata(repodir):
+            packages = scan(repodir)
+        elif state["pending"] or force:
+            packages = dict(state["packages"])
+            packages.update(state["pending"])
+        else:
+            logging.debug("%s: metadata is up to date", repodir)
+            return False
+
+        packages = dict((path, mtime) for (path, mtime) in packages.items()
+                        if os.path.exists(os.path.join(repodir, path)))
+
+        with tempfile.NamedTemporaryFile(prefix="planex-pkglist") as pkglist:
+            pkglist.write("".join("%s\n" % path for path in sorted(packages)))
+            pkglist.flush()
+            run(["createrepo", "--quiet", "--update",
+                 "--pkglist", pkglist.name, repodir])
+
+        # Packages added while createrepo was running stay pending
+        with locked(os.path.join(repodir, STATE_LOCK)):
+            latest = load_state(repodir)
+            for (path, mtime) in state["pending"].items():
+                if latest["pending"].get(path) == mtime:
+                    del latest["pending"][path]
+            latest["packages"] = packages
+            save_state(repodir, latest)
+
+    return True
+
+
+def parse_args_or_exit(argv=None):
+    """
+    Parse command line options
+    """
+    parser = argparse.ArgumentParser(
+        description="Incrementally update yum repository metadata")
+    parser.add_argument(
+        '--debug', action='store_true', default=False,
+        help='Print debugging information')
+    subparsers = parser.add_subparsers(dest="command")
+
+    add_parser = subparsers.add_parser(
+        "add", help="Record new packages, without updating the metadata")
+    add_parser.add_argument("repodir", help="repository directory")
+    add_parser.add_argument("pkgs", metavar="PKG", nargs="*",
+                            help="package file")
+
+    refresh_parser = subparsers.add_parser(
+        "refresh", help="Add recorded packages to the metadata")
+    refresh_parser.add_argument("repodir", help="repository directory")
+    refresh_parser.add_argument(
+        "--force", action="store_true", default=False,
+        help="Run createrepo even if no packages have been added")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """
+    Main function
+    """
+    args = parse_args_or_exit(argv)
+
+    loglevel = logging.INFO
+    if args.debug:
+        loglevel = logging.DEBUG
+    logging.basicConfig(format='%(message)s', level=loglevel)
+
+    if args.command == "add":
+        add(args.repodir, args.pkgs)
+    else:
+        refresh(args.repodir, args.force)
+
+
+def _main():
+    """
+    Entry point for setuptools CLI wrapper
+    """
+    main(sys.argv[1:])
+
+# Entry point when run directly
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,172 @@
+"""
+Index of the packages in the planex repository, used to hash build
+requirements.   Resolving each BuildRequires separately through YUM and
+downloading the header of every matching package is slow, and the same
+packages are looked up by many planex-cache invocations.   The index
+maps each capability provided by the newest packages in the repository,
+including their names and files, to the packages providing it, with
+their checksums and file digests.   It is stored next to the repository
+metadata and is rebuilt when the metadata changes, reusing the entries
+of packages which have not changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from planex.util import atomic_write, locked
+
+INDEX_FILE = ".planex-reqindex.json"
+
+
+def repo_revision(repodir):
+    """Return a digest of the repository's repomd.xml"""
+    try:
+        with open(os.path.join(repodir, "repodata", "repomd.xml")) as repomd:
+            return hashlib.md5(repomd.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def newest_packages(yumbase):
+    """Return the newest package for each (name, arch) in the sack"""
+    newest = {}
+    for pkg in yumbase.pkgSack.returnPackages():
+        key = (pkg.name, pkg.arch)
+        if key not in newest or pkg.verGT(newest[key]):
+            newest[key] = pkg
+    return newest
+
+
+def format_version(evr):
+    """Return an (epoch, version, release) tuple as a string"""
+    (epoch, version, release) = evr
+    text = version or ""
+    if epoch and epoch != "0":
+        text = "%s:%s" % (epoch, text)
+    if release:
+        text = "%s-%s" % (text, release)
+    return text
+
+
+def package_entry(yumbase, pkg):
+    """Return the index entry describing pkg"""
+    algo, checksum, _ = pkg.returnChecksums()[0]
+    yumbase.downloadHeader(pkg)
+    hdr = pkg.returnLocalHeader()
+    return {"pkg": str(pkg), "algo": algo, "checksum": checksum,
+            "provides": [[name, flags, format_version(evr)]
+                         for (name, flags, evr) in pkg.provides],
+            "digestalgo": hdr.filedigestalgo,
+            "files": zip(hdr.filenames, hdr.filedigests)}
+
+
+class RequirementIndex(object):
+    """
+    Map from capabilities to the newest packages in the repository
+    which provide them.   A requirement on a file is satisfied by the
+    packages containing that file.   If repodir is None, the index is
+    not persisted.
+    """
+
+    def __init__(self, repodir=None):
+        self.repodir = repodir
+        self.revision = None
+        self.provides = {}
+        self.packages = {}
+        self.files = None
+        if repodir:
+            self.path = os.path.join(repodir, INDEX_FILE)
+            self.load()
+        else:
+            self.path = None
+
+    def load(self):
+        """Load the saved index, if there is one"""
+        try:
+            with open(self.path) as index_file:
+                saved = json.load(index_file)
+            # An index in an older format lacks some of the keys, and
+            # is rebuilt rather than partially loaded
+            (revision, provides, packages) = (
+                saved["revision"], saved["provides"], saved["packages"])
+        except (IOError, ValueError, KeyError):
+            return
+        self.revision = revision
+        self.provides = provides
+        self.packages = packages
+        self.files = None
+
+    def save(self):
+        """Atomically replace the saved index"""
+        atomic_write(self.path, json.dumps(
+            {"revision": self.revision, "provides": self.provides,
+             "packages": self.packages}))
+
+    def rebuild(self, yumbase):
+        """
+        Rebuild the index from the YUM package sack.   Headers are only
+        downloaded for packages which were not in the previous index.
+        """
+        provides = {}
+        packages = {}
+        newest = newest_packages(yumbase)
+        for (_, pkg) in sorted(newest.items()):
+            _, checksum, _ = pkg.returnChecksums()[0]
+            if checksum in self.packages:
+                packages[checksum] = self.packages[checksum]
+            else:
+                logging.debug("Indexing %s", pkg)
+                packages[checksum] = package_entry(yumbase, pkg)
+            for name in set(provide[0] for provide
+                            in packages[checksum]["provides"]):
+                provides.setdefault(name, []).append(checksum)
+        self.provides = provides
+        self.packages = packages
+        self.files = None
+
+    def update(self, yumbase):
+        """Bring the index up to date with the repository"""
+        if not self.repodir:
+            if self.revision is None:
+                self.rebuild(yumbase)
+                self.revision = "memory"
+            return
+
+        revision = repo_revision(self.repodir)
+        if revision == self.revision:
+            return
+
+        # Another planex-cache may be rebuilding the index already
+        with locked(self.path + ".lock"):
+            self.load()
+            if revision != self.revision:
+                logging.debug("Rebuilding requirement index for %s",
+                              self.repodir)
+                self.rebuild(yumbase)
+                self.revision = revision
+                self.save()
+
+    def file_providers(self, path):
+        """Return the checksums of the packages containing path"""
+        if self.files is None:
+            self.files = {}
+            for (checksum, entry) in sorted(self.packages.items()):
+                for (filename, _) in entry["files"]:
+                    self.files.setdefault(filename, []).append(checksum)
+        return self.files.get(path, [])
+
+    def lookup(self, requirement):
+        """
+        Return the index entries of the newest packages which provide
+        requirement, a capability name or a file path.   All providers
+        are returned, whatever their versions, so that any of them
+        changing changes the cache hash.
+        """
+        checksums = list(self.provides.get(requirement, []))
+        if requirement.startswith("/"):
+            checksums += [checksum for checksum
+                          in self.file_providers(requirement)
+                          if checksum not in checksums]
+        return [self.packages[checksum] for checksum in checksums]
@@ -1,10 +1,29 @@
 import os
 import os.path
 import re
+import tarfile
 import urlparse
+from multiprocessing.dummy import Pool
 from planex import exceptions
+from planex import gitbatch
+from planex import pinlock
 from planex.globals import SOURCES_DIR
-from planex.util import run
+from planex.util import locked, run
+
+
+def tarball_commit(path):
+    """
+    Return the commit which 'git archive' recorded in the tarball at
+    path, or None if it is missing or has no record
+    """
+    try:
+        tarball = tarfile.open(path)
+        try:
+            return tarball.pax_headers.get("comment")
+        finally:
+            tarball.close()
+    except (IOError, tarfile.TarError):
+        return None
 
 
 class SCM(object):
@@ -56,6 +75,34 @@ class SCM(object):
         self.scmhash = scmhash
         self.version = version
 
+    def pin_state(self):
+        """
+        Return a summary of the repository's state which can be read
+        without running the SCM's commands, or None if it cannot be read
+        """
+        return None
+
+    def pin_uncached(self):
+        """Return the hash and version of the repository's head"""
+        raise NotImplementedError()
+
+    def pin(self):
+        """
+        Set the hash and version from the repository's head, reusing
+        the results recorded in the pin lock file if the repository
+        has not changed since it was last pinned
+        """
+        lock = pinlock.pin_lock(self.repos_path)
+        state = self.pin_state()
+        pinned = lock.lookup(self.localpath, state)
+        if pinned is None:
+            pinned = self.pin_uncached()
+            # Only record the result if the repository did not change
+            # while it was being pinned
+            if self.pin_state() == state:
+                lock.update(self.localpath, state, *pinned)
+        (self.scmhash, self.version) = pinned
+
     @property
     def localpath(self):
         return os.path.join(self.repos_path, self.repo_name)
@@ -75,11 +122,26 @@ class SCM(object):
         return "%s#%s/%s" % (self.repo_url, self.scmhash, self.archivename)
 
     def archive_commands(self, sources_dir=SOURCES_DIR):
+        """
+        Return the commands which create the archive in sources_dir.
+        The archive is written to a temporary name and renamed into
+        place, so that it never appears partially written.
+        """
         raise NotImplementedError()
 
+    def is_archived(self, sources_dir=SOURCES_DIR):
+        """Return True if the archive in sources_dir is up to date"""
+        return os.path.exists(os.path.join(sources_dir, self.archivename))
+
     def archive(self, sources_dir=SOURCES_DIR):
-        for cmd in self.archive_commands(sources_dir):
-            run(cmd)
+        # Several spec files may share this source and be prepared at
+        # once, so only one of them creates the archive
+        lock_path = os.path.join(sources_dir, ".%s.lock" % self.archivename)
+        with locked(lock_path):
+            if self.is_archived(sources_dir):
+                return
+            for cmd in self.archive_commands(sources_dir):
+                run(cmd)
 
     def clone_commands(self):
         raise NotImplementedError()
@@ -161,51 +223,76 @@ class GitSource(SCM):
             ]
             return [clone_cmd, checkout_cmd]
 
-    def pin(self):
-        dotgitdir = os.path.join(self.localpath, ".git")
+    def pin_state(self):
+        return pinlock.git_state(os.path.join(self.localpath, ".git"))
 
-        if not os.path.exists(dotgitdir):
+    def pin(self):
+        if not os.path.exists(os.path.join(self.localpath, ".git")):
             raise exceptions.NoRepository
+        super(GitSource, self).pin()
 
-        # First, get the hash of the commit
-        cmd = ["git", "--git-dir=%s" % dotgitdir,
-               "rev-parse", "HEAD"]
-
-        scmhash = run(cmd)['stdout'].strip()
-
-        # Verified good hash.
-        self.scmhash = scmhash
-
-        # Now lets describe that hash.
-        cmd = ["git", "--git-dir=%s" % dotgitdir,
-               "describe", "--tags", scmhash]
+    def pin_uncached(self):
+        dotgitdir = os.path.join(self.localpath, ".git")
 
-        description = run(cmd, check=False)['stdout'].strip()
+        # First, get the hash of the commit.   Fall back to rev-parse
+        # to report the error if it cannot be resolved.
+        scmhash = gitbatch.commit_of(dotgitdir, "HEAD")
+        if scmhash is None:
+            cmd = ["git", "--git-dir=%s" % dotgitdir,
+                   "rev-parse", "HEAD"]
+            scmhash = run(cmd)['stdout'].strip()
+
+        # Now lets describe that hash.   If the repository has no tags
+        # there is nothing to describe it with, and if exactly one tag
+        # refers to it, describe would just give that tag's name.
+        tags = gitbatch.tags(dotgitdir)
+        tags_here = gitbatch.tags_at(dotgitdir, scmhash, tags)
+        if not tags:
+            description = ""
+        elif len(tags_here) == 1:
+            description = tags_here[0]
+        else:
+            cmd = ["git", "--git-dir=%s" % dotgitdir,
+                   "describe", "--tags", scmhash]
+            description = run(cmd, check=False)['stdout'].strip()
 
         # if there are no tags, get the number of commits, which should
         # always increase
         if description == "":
             cmd = ["git", "--git-dir=%s" % dotgitdir,
-                   "log", scmhash, "--oneline"]
+                   "rev-list", scmhash]
             commits = run(cmd)['stdout'].strip()
             description = str(len(commits.splitlines()))
 
         match = re.search("[^0-9]*", description)
         matchlen = len(match.group())
-        self.version = description[matchlen:].replace('-', '+')
+        return (scmhash, description[matchlen:].replace('-', '+'))
+
+    def is_archived(self, sources_dir=SOURCES_DIR):
+        # The tarball is up to date if it was made from the pinned commit
+        path = os.path.join(sources_dir, self.archivename)
+        return tarball_commit(path) == self.scmhash
+
+    def archive(self, sources_dir=SOURCES_DIR):
+        if self.is_archived(sources_dir):
+            return
+        dotgitdir = os.path.join(self.localpath, ".git")
+        if gitbatch.commit_of(dotgitdir, self.scmhash) is None:
+            raise exceptions.NoRepository
+        super(GitSource, self).archive(sources_dir)
 
     def archive_commands(self, sources_dir=SOURCES_DIR):
-        # If it already exists, we're done.
         dotgitdir = os.path.join(self.localpath, ".git")
 
         # archive name always ends in .gz - strip it off
-        tarball_name = self.archivename[:-3]
+        tmp_tarball = "%s/.%s" % (sources_dir, self.archivename[:-3])
 
         return [["git", "--git-dir=%s" % dotgitdir, "archive",
                  "--prefix=%s/" % self.tarballprefix, self.scmhash, "-o",
-                 "%s/%s" % (sources_dir, tarball_name)],
-                ["gzip", "--no-name", "-f", "%s/%s" %
-                 (sources_dir, tarball_name)]]
+                 tmp_tarball],
+                ["gzip", "--no-name", "-f", tmp_tarball],
+                ["mv", "-f", "%s.gz" % tmp_tarball,
+                 "%s/%s" % (sources_dir, self.archivename)]]
 
 
 class HgSource(SCM):
@@ -241,16 +328,17 @@ class HgSource(SCM):
             dst
         ]]
 
-    def pin(self):
+    def pin_state(self):
+        return pinlock.hg_state(self.localpath)
 
+    def pin_uncached(self):
         cmd = ["hg", "-R", self.localpath, "tip", "--template", "{node}"]
         scmhash = run(cmd)['stdout'].strip()
-        self.scmhash = scmhash
 
         cmd = ["hg", "-R", self.localpath, "parents", "--template", "{rev}"]
         description = run(cmd)['stdout'].strip()
 
-        self.version = str(description)
+        return (scmhash, str(description))
 
     def archive_commands(self, sources_dir=SOURCES_DIR):
         # If it already exists, we're done.
@@ -259,8 +347,10 @@ class HgSource(SCM):
             return []
 
         print "File's not here!"
+        tmp_path = "%s/.%s" % (sources_dir, self.archivename)
         return [["hg", "-R", self.localpath, "archive", "-t", "tgz", "-p",
-                 "%s/" % self.tarballprefix,
+                 "%s/" % self.tarballprefix, tmp_path],
+                ["mv", "-f", tmp_path,
                  "%s/%s" % (sources_dir, self.archivename)]]
 
 
@@ -283,7 +373,9 @@ class FileSource(SCM):
         final_path = os.path.join(sources_dir, self.archivename)
         if os.path.exists(final_path):
             return []
-        return [["curl", "-k", "-L", "-o", final_path, self.orig_url]]
+        tmp_path = os.path.join(sources_dir, ".%s" % self.archivename)
+        return [["curl", "-k", "-L", "--fail", "-o", tmp_path, self.orig_url],
+                ["mv", "-f", tmp_path, final_path]]
 
 
 class OtherSource(SCM):
@@ -307,3 +399,22 @@ def source(url, repomirror):
         if cls.handles(scheme):
             return cls(url, repomirror)
     return OtherSource(url, repomirror)
+
+
+def pin_sources(urls, config):
+    """
+    Return a map from each of urls to its source object.   Creating the
+    source for a repository which has changed since it was last pinned
+    runs several git or hg commands, so the sources are created in
+    parallel.
+    """
+    urls = sorted(set(urls))
+    if len(urls) < 2:
+        return dict((url, source(url, config)) for url in urls)
+    pool = Pool()
+    try:
+        return dict(zip(urls, pool.map(lambda url: source(url, config),
+                                       urls)))
+    finally:
+        pool.close()
+        pool.join()
@@ -3,15 +3,25 @@
    the rpm library does not currently provide."""
 
 
+import hashlib
+import json
 import os
 import re
 import rpm
 import urlparse
 from planex import debianmisc
+from planex.util import atomic_write
 
 # Could have a decorator / context manager to set and unset all the RPM macros
 # around methods such as 'provides'
 
+# Parsed spec files are cached here, unless overridden in the environment
+SPEC_CACHE_ENV = "PLANEX_SPEC_CACHE"
+DEFAULT_SPEC_CACHE = "~/.planex-spec-cache"
+
+# Change this if the contents of SpecRecord change
+SPEC_RECORD_VERSION = 1
+
 
 # Directories where rpmbuild/mock expects to find inputs
 # and writes outputs
@@ -207,3 +217,149 @@ class Spec(object):
             rpm.delMacro('ARCH')
             return os.path.join(rpmdir(), rpmname)
         return [rpm_name_from_header(pkg.header) for pkg in self.spec.packages]
+
+
+class SpecRecord(object):
+    """
+    The information planex needs from a parsed spec file, in a form
+    which is cheap to keep in memory and to serialise.   It has the same
+    query methods as Spec, so can be used in its place.
+    """
+    __slots__ = ["spec_path", "pkg_name", "pkg_version", "urls", "paths",
+                 "provided", "buildrequired", "srpm_path", "rpm_paths"]
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields[field])
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Summarise a parsed Spec"""
+        return cls(spec_path=spec.specpath(), pkg_name=spec.name(),
+                   pkg_version=spec.version(), urls=spec.source_urls(),
+                   paths=spec.source_paths(),
+                   provided=sorted(spec.provides()),
+                   buildrequired=sorted(spec.buildrequires()),
+                   srpm_path=spec.source_package_path(),
+                   rpm_paths=spec.binary_package_paths())
+
+    def to_dict(self):
+        """Return the record as a dictionary which can be JSON encoded"""
+        return dict((field, getattr(self, field))
+                    for field in self.__slots__)
+
+    def specpath(self):
+        """Return the path to the spec file"""
+        return self.spec_path
+
+    def provides(self):
+        """Return a list of package names provided by this spec"""
+        return set(self.provided)
+
+    def name(self):
+        """Return the package name"""
+        return self.pkg_name
+
+    def version(self):
+        """Return the package version"""
+        return self.pkg_version
+
+    def source_urls(self):
+        """Return the URLs from which the sources can be downloaded"""
+        return list(self.urls)
+
+    def source_paths(self):
+        """Return the filesystem paths to source files"""
+        return list(self.paths)
+
+    def buildrequires(self):
+        """Return the set of packages needed to build this spec
+           (BuildRequires)"""
+        return set(self.buildrequired)
+
+    def source_package_path(self):
+        """Return the path of the source package which building this
+           spec will produce"""
+        return self.srpm_path
+
+    def binary_package_paths(self):
+        """Return a list of binary packages built by this spec"""
+        return list(self.rpm_paths)
+
+
+def spec_cache_dir():
+    """Return the directory holding cached spec records"""
+    return os.path.expanduser(os.environ.get(SPEC_CACHE_ENV,
+                                             DEFAULT_SPEC_CACHE))
+
+
+def spec_record_key(path, target, dist, topdir, map_name_id):
+    """
+    Return the key of the cached record for the spec file at path.
+    The key covers everything which affects the parsed result: the
+    contents and name of the file, the target, %dist, the top
+    directory, the package name mapping and the host's RPM settings.
+    """
+    with open(path) as spec:
+        content_digest = hashlib.md5(spec.read()).hexdigest()
+    # The paths in the record are built from topdir as given, so a
+    # relative and an absolute topdir must not share a record
+    if not topdir:
+        topdir = rpm.expandMacro('%_topdir')
+    return hashlib.md5(json.dumps(
+        [SPEC_RECORD_VERSION, content_digest, os.path.basename(path), target,
+         dist, topdir, map_name_id, rpm.expandMacro('%_target_cpu'),
+         rpm.expandMacro('%_build_name_fmt')])).hexdigest()
+
+
+def read_spec_record(cache_path):
+    """Return the cached SpecRecord at cache_path, or None"""
+    try:
+        with open(cache_path) as cached:
+            fields = json.load(cached)
+        return SpecRecord(**dict((str(field), value)
+                                 for (field, value) in fields.items()))
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_spec_record(cache_path, record):
+    """Atomically cache record at cache_path, if possible"""
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        atomic_write(cache_path, json.dumps(record.to_dict()))
+    except (IOError, OSError):
+        pass
+
+
+def load_spec(path, target="rpm", map_name=None, dist="",
+              check_package_name=True, topdir=None, map_name_id=None):
+    """
+    Return a SpecRecord for the spec file at path, taking it from the
+    spec cache if possible and parsing the spec with librpm otherwise.
+    The arguments are as for Spec.   Records built with a map_name
+    function are only cached if map_name_id, a string identifying the
+    mapping, is also given.
+    """
+    cache_path = None
+    record = None
+    if map_name is None or map_name_id is not None:
+        key = spec_record_key(path, target, dist, topdir, map_name_id)
+        cache_path = os.path.join(spec_cache_dir(), key + ".json")
+        record = read_spec_record(cache_path)
+
+    if record is None:
+        record = SpecRecord.from_spec(
+            Spec(path, target=target, map_name=map_name, dist=dist,
+                 check_package_name=False, topdir=topdir))
+        if cache_path:
+            write_spec_record(cache_path, record)
+
+    if check_package_name:
+        file_basename = os.path.basename(path).split(".")[0]
+        if file_basename != record.name():
+            raise SpecNameMismatch(
+                "spec file name '%s' does not match package name '%s'" %
+                (path, record.name()))
+    return record
@@ -0,0 +1,268 @@
+"""
+Read source RPMs in-process.   The header and the embedded spec file
+are read directly from the SRPM, rather than by installing it with
+'rpm -i' and parsing the spec file it leaves behind.
+"""
+
+import bz2
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import zlib
+
+import rpm
+
+from planex.util import atomic_write, run
+
+CPIO_MAGICS = ["070701", "070702"]
+CPIO_HEADER_LEN = 110
+CPIO_TRAILER = "TRAILER!!!"
+READ_SIZE = 1024 * 1024
+
+
+class UnsupportedPayload(Exception):
+    """The SRPM payload is compressed with an unsupported algorithm"""
+    pass
+
+
+def read_header(fileobj):
+    """
+    Read the header of the RPM open as fileobj, leaving the file
+    positioned at the start of the payload.   Signatures are not
+    checked; we only want the metadata.
+    """
+    trans = rpm.ts()
+    trans.setVSFlags(rpm._RPMVSF_NOSIGNATURES)  # pylint: disable=W0212
+    return trans.hdrFromFdno(fileobj.fileno())
+
+
+def decompressor(compressor):
+    """
+    Return a streaming decompressor object for the named payload
+    compression algorithm
+    """
+    if compressor in [None, "gzip"]:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compressor == "bzip2":
+        return bz2.BZ2Decompressor()
+    try:
+        import lzma
+        if compressor in ["xz", "lzma"]:
+            return lzma.LZMADecompressor()
+    except ImportError:
+        pass
+    raise UnsupportedPayload(compressor)
+
+
+def payload_chunks(fileobj, compressor):
+    """Yield the decompressed payload of the RPM open as fileobj"""
+    decomp = decompressor(compressor)
+    for block in iter(lambda: fileobj.read(READ_SIZE), ""):
+        data = decomp.decompress(block)
+        if data:
+            yield data
+
+
+def cpio_members(chunks):
+    """
+    Yield (name, contents) for each file in the 'newc' format cpio
+    archive produced by the iterator chunks
+    """
+    buf = ""
+    chunks = iter(chunks)
+
+    def fill(buf, length):
+        """Read from chunks until buf holds at least length bytes"""
+        while len(buf) < length:
+            buf += next(chunks)
+        return buf
+
+    def padded(length):
+        """Round length up to the next multiple of 4"""
+        return (length + 3) & ~3
+
+    while True:
+        buf = fill(buf, CPIO_HEADER_LEN)
+        header = buf[:CPIO_HEADER_LEN]
+        assert header[:6] in CPIO_MAGICS, "Not a cpio archive"
+        fields = [int(header[i:i + 8], 16) for i in range(6, 110, 8)]
+        filesize, namesize = fields[6], fields[11]
+
+        name_end = CPIO_HEADER_LEN + namesize
+        data_start = padded(name_end)
+        buf = fill(buf, data_start)
+        name = buf[CPIO_HEADER_LEN:name_end - 1]
+        if name == CPIO_TRAILER:
+            return
+
+        data_end = data_start + filesize
+        buf = fill(buf, padded(data_end))
+        yield (name, buf[data_start:data_end])
+        buf = buf[padded(data_end):]
+
+
+def read_spec(srpm):
+    """Return the text of the spec file embedded in srpm"""
+    with open(srpm, "rb") as srpm_file:
+        hdr = read_header(srpm_file)
+        try:
+            chunks = payload_chunks(srpm_file, hdr['payloadcompressor'])
+            members = cpio_members(chunks)
+            for (name, contents) in members:
+                if name.endswith(".spec"):
+                    return contents
+        except UnsupportedPayload:
+            # Let rpm2cpio do the decompression
+            cpio = run(["rpm2cpio", srpm])['stdout']
+            for (name, contents) in cpio_members([cpio]):
+                if name.endswith(".spec"):
+                    return contents
+    return None
+
+
+def parse_spec_text(text, topdir):
+    """Parse the spec file in text, returning an rpm.spec object"""
+    rpm.addMacro('_topdir', topdir)
+    with tempfile.NamedTemporaryFile(suffix=".spec") as spec_file:
+        spec_file.write(text)
+        spec_file.flush()
+        return rpm.ts().parseSpec(spec_file.name)
+
+
+def srpm_info(srpm, topdir, arch):
+    """
+    Return a dictionary describing srpm: its build requirements,
+    the binary packages it produces and the digest of its spec file
+    """
+    text = read_spec(srpm)
+    spec = parse_spec_text(text, topdir)
+    return {'deps': list(spec.sourceHeader['requires']),
+            'arch': arch,
+            'packages': [{'name': p.header['name']} for p in spec.packages],
+            'srcrpm': srpm,
+            'spec_digest': hashlib.md5(text).hexdigest()}
+
+
+def _srpm_info_worker(args):
+    """Unpack arguments for srpm_info when run in a process pool"""
+    return srpm_info(*args)
+
+
+class SrpmIndex(object):
+    """
+    Persistent index of SRPM metadata.   Entries are keyed by SRPM path
+    and are reused for as long as the file's size and mtime are unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(path) as index_file:
+                self.entries = json.load(index_file)
+        except (IOError, ValueError):
+            pass
+
+    @staticmethod
+    def stamp(srpm):
+        """Return the (size, mtime) pair used to detect changed SRPMs"""
+        stat = os.stat(srpm)
+        return [stat.st_size, stat.st_mtime]
+
+    def lookup(self, srpm):
+        """Return the indexed information for srpm, or None if stale"""
+        entry = self.entries.get(srpm)
+        if entry and entry['stamp'] == self.stamp(srpm):
+            return entry['info']
+        return None
+
+    def update(self, srpm, info):
+        """Record info for srpm"""
+        self.entries[srpm] = {'stamp': self.stamp(srpm), 'info': info}
+        self.dirty = True
+
+    def prune(self, srpms):
+        """Forget SRPMs which are not in srpms"""
+        for srpm in set(self.entries) - set(srpms):
+            del self.entries[srpm]
+            self.dirty = True
+
+    def save(self):
+        """Write the index back to disk, if it has changed"""
+        if not self.dirty:
+            return
+        atomic_write(self.path, json.dumps(self.entries))
+        self.dirty = False
+
+
+def srpm_files(srpm):
+    """
+    Return the package name of srpm and a map from the names of the
+    files it contains to their digests, read from its header
+    """
+    with open(srpm, "rb") as srpm_file:
+        hdr = read_header(srpm_file)
+    return {'name': hdr['name'],
+            'files': dict(zip(hdr['basenames'], hdr['filedigests']))}
+
+
+def srpms_by_name(srpms, index_path):
+    """
+    Return a map from package names to (srpm, files) pairs for each SRPM
+    in srpms which builds that package, where files is as returned by
+    srpm_files.   Only SRPMs which are not in the index at index_path,
+    or which have changed since they were indexed, are read.   SRPMs
+    which cannot be read, for instance because they are still being
+    written, are left out.
+    """
+    index = SrpmIndex(index_path)
+    index.prune(srpms)
+    result = {}
+    for srpm in srpms:
+        try:
+            info = index.lookup(srpm)
+            if info is None:
+                info = srpm_files(srpm)
+                index.update(srpm, info)
+        except (rpm.error, IOError, OSError):
+            continue
+        result.setdefault(info['name'], []).append((srpm, info['files']))
+    index.save()
+    return result
+
+
+def get_srpm_infos(srpms, index_path, topdir, arch, jobs=None):
+    """
+    Return information about each SRPM in srpms.   SRPMs which are
+    not in the index at index_path, or which have changed since they
+    were indexed, are read in parallel using a pool of jobs processes.
+    """
+    index = SrpmIndex(index_path)
+    index.prune(srpms)
+    missing = [srpm for srpm in srpms if index.lookup(srpm) is None]
+
+    if len(missing) > 1 and jobs != 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            infos = pool.map(_srpm_info_worker,
+                             [(srpm, topdir, arch) for srpm in missing])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        infos = [srpm_info(srpm, topdir, arch) for srpm in missing]
+
+    for (srpm, info) in zip(missing, infos):
+        index.update(srpm, info)
+    index.save()
+
+    results = []
+    for srpm in srpms:
+        info = dict(index.lookup(srpm))
+        # The architecture depends on the command line, not the SRPM
+        info['arch'] = arch
+        results.append(info)
+    return results
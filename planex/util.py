@@ -2,16 +2,26 @@
 
 # Some generic utils used by several other files
 
+import contextlib
+import errno
+import fcntl
+import shutil
+import stat
 import subprocess
 import os
 import pipes
 import urlparse
+import StringIO
 import sys
 import tempfile
+import threading
 import yum
 
 DUMP_CMDS = True
 
+# ioctl to clone a file on copy-on-write filesystems (linux/fs.h)
+FICLONE = 0x40049409
+
 
 class bcolours:
     HEADER = '\033[95m'
@@ -30,6 +40,139 @@ def print_col(col, msg):
     sys.stdout.flush()
 
 
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock on the file at path"""
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _tmp_path(path):
+    """Return the temporary name under which path is written"""
+    return "%s.%d.tmp" % (path, os.getpid())
+
+
+def atomic_write(path, text):
+    """
+    Replace the file at path with text, writing it under a temporary
+    name first so that readers never see a partially written file
+    """
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as output:
+        output.write(text)
+    os.rename(tmp_path, path)
+
+
+def write_if_changed(path, text):
+    """
+    Atomically replace the file at path with text, unless it already
+    contains text, in which case the file and its modification time are
+    left untouched.   Returns True if the file was written.
+    """
+    try:
+        with open(path, "rb") as existing:
+            if existing.read() == text:
+                return False
+    except IOError:
+        pass
+    atomic_write(path, text)
+    return True
+
+
+def copy_if_changed(src, dst):
+    """
+    Copy the file src to dst, unless dst already has the same contents.
+    Returns True if dst was written.
+    """
+    with open(src, "rb") as src_file:
+        written = write_if_changed(dst, src_file.read())
+    if written:
+        shutil.copymode(src, dst)
+    return written
+
+
+def reflink(src, dst):
+    """
+    Make dst a copy-on-write clone of src.   Raises IOError if the
+    filesystem does not support it.
+    """
+    with open(src, "rb") as src_file:
+        with open(dst, "wb") as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except IOError:
+                os.unlink(dst)
+                raise
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src, dst):
+    """
+    Make the file src available at dst without copying its contents
+    if possible: hardlink it, or failing that clone it, and only copy
+    it if neither is possible (for instance across devices).   If dst
+    is a directory, the file is placed in it.   Returns the new path.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    try:
+        os.link(src, dst)
+        return dst
+    except OSError as err:
+        if err.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK,
+                             errno.EACCES]:
+            raise
+
+    try:
+        reflink(src, dst)
+        return dst
+    except IOError:
+        pass
+
+    shutil.copy2(src, dst)
+    return dst
+
+
+def clone_or_copy(src, dst, mode=None):
+    """
+    Atomically copy the file src to dst, cloning it if the filesystem
+    supports it, and setting its permissions to mode if given.   Unlike
+    link_or_copy, dst never shares an inode with src, so writing to
+    either afterwards does not affect the other.   Returns dst.
+    """
+    tmp_path = _tmp_path(dst)
+    if os.path.lexists(tmp_path):
+        os.unlink(tmp_path)
+    try:
+        reflink(src, tmp_path)
+    except IOError:
+        shutil.copy2(src, tmp_path)
+    if mode is not None:
+        os.chmod(tmp_path, mode)
+    os.rename(tmp_path, dst)
+    return dst
+
+
+def make_read_only(path):
+    """
+    Remove write permission from all files under path.   Cached files
+    are hardlinked into result directories, so a write to a linked file
+    would otherwise silently corrupt the cache.
+    """
+    no_write = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    for (dirpath, _, filenames) in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            os.chmod(filepath, os.stat(filepath).st_mode & no_write)
+
+
 def rewrite_url(url, destination=None):
     """
     Rewrite url to point to destination
@@ -78,7 +221,7 @@ def get_yumbase(config):
     return yumbase
 
 
-def run(cmd, check=True, env=None, inputtext=None):
+def run(cmd, check=True, env=None, inputtext=None, cwd=None):
     """
     Run a command, dumping it cut-n-pasteably if required. Checks the return
     code unless check=False. Returns a dictionary of stdout, stderr and return
@@ -92,7 +235,7 @@ def run(cmd, check=True, env=None, inputtext=None):
         env = os.environ.copy()
 
     proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
+                            stderr=subprocess.PIPE, cwd=cwd)
     [stdout, stderr] = proc.communicate(inputtext)
 
     if check and proc.returncode != 0:
@@ -107,3 +250,53 @@ def run(cmd, check=True, env=None, inputtext=None):
         raise Exception
 
     return {"stdout": stdout, "stderr": stderr, "rc": proc.returncode}
+
+
+class GroupedOutput(object):
+    """
+    A stand-in for sys.stdout which stops the output of concurrent jobs
+    from being interleaved.   Output written by a thread between begin()
+    and end() is collected, and end() writes it out in one piece.
+    Output written outside a job is passed straight through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.softspace = 0
+
+    def begin(self):
+        """Start collecting the output of the current thread"""
+        self.local.buffer = StringIO.StringIO()
+
+    def end(self, passthrough=True):
+        """
+        Stop collecting the output of the current thread and return it,
+        writing it out unless passthrough is False
+        """
+        output = self.local.buffer.getvalue()
+        self.local.buffer = None
+        if passthrough:
+            with self.lock:
+                self.stream.write(output)
+                self.stream.flush()
+        return output
+
+    def write(self, text):
+        """Write text to the current job's output, or straight out"""
+        buf = getattr(self.local, "buffer", None)
+        if buf is not None:
+            buf.write(text)
+            return
+        with self.lock:
+            self.stream.write(text)
+
+    def flush(self):
+        """Flush output written outside a job"""
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def isatty(self):
+        """Return whether the underlying stream is a terminal"""
+        return self.stream.isatty()
@@ -14,9 +14,13 @@ setup(name='planex',
               'planex-configure = planex.configure:_main',
               'planex-build = planex.build:main',
               'planex-clone = planex.clone:main',
-              'planex-cache = planex.cache:_main',
+              'planex-cache = planex.cacheclient:_main',
+              'planex-cache-daemon = planex.cachedaemon:_main',
+              'planex-cache-server = planex.cacheserver:_main',
+              'planex-cache-gc = planex.cachegc:_main',
               'planex-downloader = planex.downloader:main',
               'planex-makedeb = planex.makedeb:main',
-              'planex-depend = planex.depend:main'
+              'planex-depend = planex.depend:main',
+              'planex-repodata = planex.repodata:_main'
           ]
       })
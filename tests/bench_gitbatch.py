@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+Benchmark pinning and archive checks with and without the batch git
+processes in planex.gitbatch, over many synthetic repositories.
+
+  python tests/bench_gitbatch.py --repos 200
+
+A quarter of the repositories have no tags, a quarter are tagged at
+HEAD, a quarter are tagged behind HEAD and a quarter have packed tags.
+The results of pinning each way are checked against each other.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from planex import gitbatch
+from planex import sources
+from planex.util import run
+import planex.util
+
+ENV = dict(os.environ, GIT_AUTHOR_NAME="planex",
+           GIT_AUTHOR_EMAIL="planex@example.com",
+           GIT_COMMITTER_NAME="planex",
+           GIT_COMMITTER_EMAIL="planex@example.com")
+
+
+def git(repo, *args):
+    """Run a git command in repo"""
+    subprocess.check_call(["git"] + list(args), cwd=repo, env=ENV)
+
+
+def make_repo(path, index, commits):
+    """Create a synthetic repository, with tags depending on index"""
+    os.makedirs(path)
+    git(path, "init", "-q")
+    for commit in range(commits):
+        with open(os.path.join(path, "file"), "w") as contents:
+            contents.write("%d\n" % commit)
+        git(path, "add", "file")
+        git(path, "commit", "-q", "-m", "commit %d" % commit)
+        if index % 4 == 2 and commit == commits // 2:
+            git(path, "tag", "-a", "-m", "release", "v1.%d" % commit)
+    if index % 4 in [1, 3]:
+        git(path, "tag", "v2.%d" % index)
+    if index % 4 == 3:
+        git(path, "pack-refs", "--all")
+
+
+def old_pin(dotgitdir):
+    """Pin a repository with one git process per query, as before"""
+    scmhash = run(["git", "--git-dir=%s" % dotgitdir,
+                   "rev-parse", "HEAD"])['stdout'].strip()
+    description = run(["git", "--git-dir=%s" % dotgitdir,
+                       "describe", "--tags", scmhash],
+                      check=False)['stdout'].strip()
+    if description == "":
+        commits = run(["git", "--git-dir=%s" % dotgitdir,
+                       "log", scmhash, "--oneline"])['stdout'].strip()
+        description = str(len(commits.splitlines()))
+    match = re.search("[^0-9]*", description)
+    return (scmhash, description[len(match.group()):].replace('-', '+'))
+
+
+def old_archive_check(dotgitdir, scmhash):
+    """Check that the pinned commit exists with a git process"""
+    return run(["git", "--git-dir=%s" % dotgitdir, "cat-file", "-e",
+                "%s^{commit}" % scmhash], check=False)['rc'] == 0
+
+
+def timed(label, func, items):
+    """Call func on each item, print the time taken and return results"""
+    start = time.time()
+    results = [func(item) for item in items]
+    print "%-32s %8.3fs" % (label, time.time() - start)
+    return results
+
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repos", type=int, default=200,
+                        help="number of repositories")
+    parser.add_argument("--commits", type=int, default=20,
+                        help="number of commits in each repository")
+    args = parser.parse_args()
+    planex.util.DUMP_CMDS = False
+
+    workdir = tempfile.mkdtemp(prefix="planex-bench-")
+    try:
+        print "Creating %d repositories..." % args.repos
+        # Create the sources before the repositories, so that they are
+        # not pinned (and the batch processes started) until timed
+        config = argparse.Namespace(repos_path=workdir)
+        repos = [sources.GitSource("git://example.com/repo%d.git" % index,
+                                   config) for index in range(args.repos)]
+        for (index, repo) in enumerate(repos):
+            make_repo(repo.localpath, index, args.commits)
+        dotgitdirs = [os.path.join(repo.localpath, ".git") for repo in repos]
+
+        old = timed("pin (process per query)", old_pin, dotgitdirs)
+        new = timed("pin (batch processes)",
+                    lambda repo: repo.pin_uncached(), repos)
+        assert old == new, "pin results differ"
+
+        timed("archive check (process)",
+              lambda (path, pin): old_archive_check(path, pin[0]),
+              zip(dotgitdirs, old))
+        timed("archive check (batch)",
+              lambda (path, pin): gitbatch.commit_of(path, pin[0]),
+              zip(dotgitdirs, old))
+    finally:
+        gitbatch.close_all()
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
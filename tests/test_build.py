@@ -0,0 +1,76 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import threading
+import unittest
+
+from planex import build
+
+
+class BuildParallelTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.deps = {"a": set(), "b": set(["a"]), "c": set(["a"]),
+                     "d": set(["b", "c"]), "e": set()}
+        self.built = []
+        self.lock = threading.Lock()
+
+    def record(self, srpm):
+        with self.lock:
+            self.built.append(srpm)
+
+    def test_dependencies_built_first(self):
+        build.build_parallel(self.deps, 3, self.record)
+        self.assertEqual(sorted(self.built), ["a", "b", "c", "d", "e"])
+        for (srpm, srpm_deps) in self.deps.iteritems():
+            for dep in srpm_deps:
+                self.assertTrue(self.built.index(dep) <
+                                self.built.index(srpm))
+
+    def test_serial(self):
+        build.build_parallel(self.deps, 1, self.record)
+        self.assertEqual(len(self.built), 5)
+
+    def test_failure_stops_dependents(self):
+        def fail_b(srpm):
+            if srpm == "b":
+                raise ValueError(srpm)
+            self.record(srpm)
+
+        self.assertRaises(ValueError, build.build_parallel,
+                          self.deps, 2, fail_b)
+        self.assertFalse("b" in self.built)
+        self.assertFalse("d" in self.built)
+
+
+class CacheKeyTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.infos = [{"srcrpm": name, "spec_digest": "digest of %s" % name}
+                      for name in ["a", "b", "c", "d"]]
+        self.deps = {"a": set(), "b": set(["a"]), "c": set(["a"]),
+                     "d": set(["b", "c"])}
+        self.order = [set(["a"]), set(["b", "c"]), set(["d"])]
+
+    def test_keys_unique(self):
+        keys = build.get_cache_keys(self.infos, "ext", self.deps, self.order)
+        self.assertEqual(len(set(keys.values())), 4)
+
+    def test_dependency_change_propagates(self):
+        keys = build.get_cache_keys(self.infos, "ext", self.deps, self.order)
+        self.infos[1]["spec_digest"] = "changed"
+        new_keys = build.get_cache_keys(self.infos, "ext", self.deps,
+                                        self.order)
+        self.assertEqual(keys["a"], new_keys["a"])
+        self.assertEqual(keys["c"], new_keys["c"])
+        self.assertNotEqual(keys["b"], new_keys["b"])
+        self.assertNotEqual(keys["d"], new_keys["d"])
+
+    def test_external_change_propagates(self):
+        keys = build.get_cache_keys(self.infos, "ext", self.deps, self.order)
+        new_keys = build.get_cache_keys(self.infos, "other", self.deps,
+                                        self.order)
+        self.assertNotEqual(keys["a"], new_keys["a"])
@@ -0,0 +1,119 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import mock
+from mock import patch
+
+from planex import cache
+from planex import cacheclient
+from planex import cachedaemon
+from planex import cacheentry
+from planex import exceptions
+from planex import util
+
+
+class CacheDaemonTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.socket = os.path.join(self.working_dir, "daemon.sock")
+        self.server = cachedaemon.CacheDaemon(self.socket)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.working_dir)
+
+    def test_ping(self):
+        self.assertEqual(
+            cacheclient.send_request({"op": "ping"}, self.socket), {"rc": 0})
+
+    def test_lookup(self):
+        os.mkdir(os.path.join(self.working_dir, "abc"))
+        open(os.path.join(self.working_dir, "abc",
+                          cacheentry.COMPLETE_MARKER), "w").close()
+        response = cacheclient.send_request(
+            {"op": "lookup", "cachedirs": [self.working_dir], "hash": "abc"},
+            self.socket)
+        self.assertEqual(response["path"],
+                         os.path.join(self.working_dir, "abc"))
+
+    def test_lookup_incomplete(self):
+        os.mkdir(os.path.join(self.working_dir, "abc"))
+        response = cacheclient.send_request(
+            {"op": "lookup", "cachedirs": [self.working_dir], "hash": "abc"},
+            self.socket)
+        self.assertEqual(response["path"], None)
+
+    def test_lookup_miss(self):
+        response = cacheclient.send_request(
+            {"op": "lookup", "cachedirs": [self.working_dir], "hash": "def"},
+            self.socket)
+        self.assertEqual(response["path"], None)
+
+    def test_error(self):
+        response = cacheclient.send_request({"op": "bogus"}, self.socket)
+        self.assertEqual(response["rc"], 1)
+
+    def test_no_daemon(self):
+        self.assertEqual(cacheclient.send_request(
+            {"op": "ping"}, os.path.join(self.working_dir, "missing")), None)
+
+    @patch("planex.cache.main")
+    def test_client_falls_back(self, mock_main):
+        with patch.dict(os.environ, {cacheclient.SOCKET_ENV:
+                                     os.path.join(self.working_dir, "none")}):
+            cacheclient.main(["--rebuild", "foo.src.rpm"])
+        mock_main.assert_called_with(["--rebuild", "foo.src.rpm"])
+
+    def test_build_output_returned(self):
+        def build_args(*_):
+            logging.debug("debug message")
+            logging.info("info message")
+            print "printed"
+            raise exceptions.BuildFailed("log tail\n")
+
+        with patch.object(cachedaemon.CacheDaemon, "build_args",
+                          side_effect=build_args), \
+                patch.object(logging.getLogger(), "level", logging.DEBUG), \
+                patch("sys.stdout", util.GroupedOutput(sys.stdout)):
+            response = cacheclient.send_request(
+                {"op": "build", "argv": ["--rebuild", "foo.src.rpm"],
+                 "cwd": self.working_dir}, self.socket)
+        self.assertEqual(response["rc"], 1)
+        self.assertEqual(response["error"], "log tail\n")
+        self.assertEqual(response["output"], "printed\n")
+        self.assertEqual(response["log"], "info message\n")
+
+
+class MockConfigTests(unittest.TestCase):
+    @patch("planex.cache.repo_revision")
+    def test_refresh_keeps_yumbase(self, mock_revision):
+        config = cache.MockConfig.__new__(cache.MockConfig)
+        config.yumbase = mock.Mock()
+        config.revision = "1"
+        mock_revision.return_value = "1"
+        config.refresh()
+        self.assertFalse(config.yumbase.repos.getRepo.called)
+
+        mock_revision.return_value = "2"
+        yumbase = config.yumbase
+        config.refresh()
+        self.assertTrue(config.yumbase is yumbase)
+        self.assertEqual(
+            yumbase.repos.getRepo.return_value.metadata_expire, 0)
+        self.assertEqual(config.revision, "2")
@@ -0,0 +1,130 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mock import patch
+
+from planex import cache
+from planex import cacheentry
+from planex import exceptions
+
+HASH = "0123456789abcdef0123456789abcdef"
+
+
+class CacheEntryTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.cache_dir = tempfile.mkdtemp()
+        self.entry_dir = os.path.join(self.cache_dir, HASH)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.cache_dir)
+
+    def stage(self, contents):
+        tmp_dir = cacheentry.staging_dir(self.cache_dir, HASH)
+        with open(os.path.join(tmp_dir, "foo.rpm"), "w") as rpm:
+            rpm.write(contents)
+        return tmp_dir
+
+    def test_staging_dir_is_hidden(self):
+        tmp_dir = cacheentry.staging_dir(self.cache_dir, HASH)
+        self.assertEqual(os.path.dirname(tmp_dir), self.cache_dir)
+        self.assertTrue(os.path.basename(tmp_dir).startswith("."))
+        self.assertFalse(cacheentry.is_complete(tmp_dir))
+
+    def test_publish(self):
+        cacheentry.publish(self.stage("new"), self.entry_dir)
+        self.assertTrue(cacheentry.is_complete(self.entry_dir))
+        self.assertEqual(os.listdir(self.cache_dir), [HASH])
+
+    def test_incomplete_entry_is_replaced(self):
+        os.makedirs(self.entry_dir)
+        self.assertFalse(cacheentry.is_complete(self.entry_dir))
+        cacheentry.publish(self.stage("new"), self.entry_dir)
+        self.assertTrue(cacheentry.is_complete(self.entry_dir))
+
+    def test_complete_entry_is_kept(self):
+        cacheentry.publish(self.stage("first"), self.entry_dir)
+        cacheentry.publish(self.stage("second"), self.entry_dir)
+        with open(os.path.join(self.entry_dir, "foo.rpm")) as rpm:
+            self.assertEqual(rpm.read(), "first")
+        self.assertEqual(os.listdir(self.cache_dir), [HASH])
+
+    def test_single_flight(self):
+        builds = []
+
+        def fetch_or_build():
+            with cacheentry.lock(self.cache_dir, HASH):
+                if not cacheentry.is_complete(self.entry_dir):
+                    builds.append(threading.current_thread().name)
+                    time.sleep(0.1)
+                    cacheentry.publish(self.stage("built"), self.entry_dir)
+
+        threads = [threading.Thread(target=fetch_or_build)
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertTrue(cacheentry.is_complete(self.entry_dir))
+
+
+class FetchOrBuildTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.cache_dir = tempfile.mkdtemp()
+        self.resultdir = os.path.join(self.cache_dir, "result")
+        self.args = argparse.Namespace(
+            cachedirs=self.cache_dir, remote_jobs=1, no_push=True,
+            max_cache_size=0, resultdir=self.resultdir)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.cache_dir)
+
+    def publish(self):
+        tmp_dir = cacheentry.staging_dir(self.cache_dir, HASH)
+        os.mkdir(os.path.join(tmp_dir, "output"))
+        with open(os.path.join(tmp_dir, "output", "foo.rpm"), "w") as rpm:
+            rpm.write("built")
+        cacheentry.publish(tmp_dir, os.path.join(self.cache_dir, HASH))
+
+    @patch("planex.cache.cachegc.collect")
+    def test_hit_not_collected(self, mock_collect):
+        self.publish()
+        cache.fetch_or_build(self.args, [], None, HASH)
+        self.assertFalse(mock_collect.called)
+        self.assertTrue(os.path.exists(os.path.join(self.resultdir,
+                                                    "foo.rpm")))
+
+    @patch("planex.cache.build_or_fail_fast")
+    @patch("planex.cache.cachegc.collect")
+    def test_collected_after_materialising(self, mock_collect, mock_build):
+        def collect(*_):
+            self.assertTrue(os.path.exists(os.path.join(self.resultdir,
+                                                        "foo.rpm")))
+        mock_collect.side_effect = collect
+        output = os.path.join(self.cache_dir, "build")
+        os.mkdir(output)
+        open(os.path.join(output, "foo.rpm"), "w").close()
+        mock_build.return_value = (output, 1.0)
+        cache.fetch_or_build(self.args, [], None, HASH)
+        mock_collect.assert_called_once_with(self.cache_dir, 0)
+
+    def test_missing_entry_raises(self):
+        self.assertRaises(exceptions.NoSuchFile, cache.get_from_cache,
+                          [self.cache_dir], HASH, self.resultdir)
@@ -0,0 +1,67 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from planex import cachegc
+
+DAY = 86400
+
+
+class CacheGCTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.cache_dir)
+
+    def make_entry(self, char, size, build_time, idle):
+        path = os.path.join(self.cache_dir, char * 32)
+        os.makedirs(os.path.join(path, "output"))
+        with open(os.path.join(path, "output", "foo.rpm"), "w") as rpm:
+            rpm.write("x" * size)
+        cachegc.record_build_time(path, build_time)
+        last_used = time.time() - idle
+        os.utime(path, (last_used, last_used))
+        return path
+
+    def test_parse_size(self):
+        self.assertEqual(cachegc.parse_size("100"), 100)
+        self.assertEqual(cachegc.parse_size("2k"), 2048)
+        self.assertEqual(cachegc.parse_size("1.5G"), 1536 * 1024 ** 2)
+
+    def test_under_budget(self):
+        self.make_entry("a", 1000, 10, DAY)
+        self.assertEqual(cachegc.collect(self.cache_dir, 10000), [])
+
+    def test_cheap_builds_evicted_first(self):
+        cheap = self.make_entry("a", 1000, 10, DAY)
+        expensive = self.make_entry("b", 1000, 3600, DAY)
+        self.assertEqual(cachegc.collect(self.cache_dir, 1500), [cheap])
+        self.assertTrue(os.path.isdir(expensive))
+        self.assertFalse(os.path.exists(cheap))
+
+    def test_idle_entries_evicted_first(self):
+        stale = self.make_entry("a", 1000, 600, 30 * DAY)
+        fresh = self.make_entry("b", 1000, 600, DAY)
+        self.assertEqual(cachegc.collect(self.cache_dir, 1500), [stale])
+        self.assertTrue(os.path.isdir(fresh))
+
+    def test_recently_used_entries_kept(self):
+        self.make_entry("a", 1000, 10, 60)
+        self.assertEqual(cachegc.collect(self.cache_dir, 0), [])
+
+    def test_other_directories_ignored(self):
+        os.makedirs(os.path.join(self.cache_dir, "planex-build-root"))
+        self.make_entry("a", 1000, 10, DAY)
+        cachegc.collect(self.cache_dir, 0)
+        self.assertEqual(os.listdir(self.cache_dir), ["planex-build-root"])
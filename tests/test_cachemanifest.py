@@ -0,0 +1,98 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from planex import cacheentry
+from planex import cachemanifest
+
+MANIFEST = {
+    "name": "foo",
+    "salt": "planex-cache-2",
+    "mock_config": {"target_arch": "x86_64",
+                    "macros": {"%_topdir": "/builddir/build"}},
+    "sources": [["foo.spec", "1111"], ["foo.tar.gz", "2222"]],
+    "requires": {
+        "ocaml": [{"pkg": "ocaml-4.02-1.x86_64", "checksum": "3333",
+                   "files": "4444"}],
+        "gcc": []}}
+
+
+class CacheManifestTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.cache_dir)
+
+    def make_entry(self, manifest):
+        pkg_hash = cachemanifest.manifest_hash(manifest)
+        tmp_dir = cacheentry.staging_dir(self.cache_dir, pkg_hash)
+        cachemanifest.write(tmp_dir, manifest)
+        entry_dir = os.path.join(self.cache_dir, pkg_hash)
+        cacheentry.publish(tmp_dir, entry_dir)
+        return entry_dir
+
+    def test_hash_is_stable(self):
+        self.assertEqual(cachemanifest.manifest_hash(MANIFEST),
+                         cachemanifest.manifest_hash(copy.deepcopy(MANIFEST)))
+
+    def test_write_and_load(self):
+        entry_dir = self.make_entry(MANIFEST)
+        self.assertEqual(cachemanifest.load(entry_dir), MANIFEST)
+        self.assertEqual(cachemanifest.load(self.cache_dir), None)
+
+    def test_diff(self):
+        new = copy.deepcopy(MANIFEST)
+        new["mock_config"]["macros"]["%dist"] = ".el7"
+        new["mock_config"]["target_arch"] = "i686"
+        new["sources"][1][1] = "5555"
+        new["sources"].append(["fix.patch", "6666"])
+        new["requires"]["ocaml"][0]["checksum"] = "7777"
+        del new["requires"]["gcc"]
+
+        self.assertEqual(cachemanifest.diff(MANIFEST, MANIFEST), [])
+        self.assertEqual(cachemanifest.diff(MANIFEST, new), [
+            "mock_config macros %dist: added",
+            'mock_config target_arch: "x86_64" -> "i686"',
+            "source fix.patch: added",
+            "source foo.tar.gz: 2222 -> 5555",
+            "requirement gcc: removed",
+            "requirement ocaml: ocaml-4.02-1.x86_64 (3333) -> "
+            "ocaml-4.02-1.x86_64 (7777)"])
+
+    def test_nearest(self):
+        near = copy.deepcopy(MANIFEST)
+        near["mock_config"]["target_arch"] = "i686"
+        far = copy.deepcopy(near)
+        far["sources"] = []
+        other = copy.deepcopy(MANIFEST)
+        other["name"] = "bar"
+
+        self.make_entry(far)
+        near_dir = self.make_entry(near)
+        self.make_entry(other)
+
+        (entry_dir, differences) = cachemanifest.nearest([self.cache_dir],
+                                                         MANIFEST)
+        self.assertEqual(entry_dir, near_dir)
+        self.assertEqual(differences,
+                         ['mock_config target_arch: "i686" -> "x86_64"'])
+
+    def test_explain(self):
+        pkg_hash = cachemanifest.manifest_hash(MANIFEST)
+        self.assertTrue("no cached builds of foo" in cachemanifest.explain(
+            [self.cache_dir], pkg_hash, MANIFEST))
+
+        self.make_entry(MANIFEST)
+        self.assertTrue("cache hit" in cachemanifest.explain(
+            [self.cache_dir], pkg_hash, MANIFEST))
@@ -0,0 +1,92 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import shutil
+import tempfile
+import unittest
+
+from planex import chrootpool
+
+WANTED = {"ocaml": ["1111"], "gcc": [], "make": []}
+
+
+class ChrootPoolTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.pool_dir = tempfile.mkdtemp()
+        self.pool = chrootpool.ChrootPool(self.pool_dir, "planex", 2)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.pool_dir)
+
+    def test_installed_requirements(self):
+        manifest = {"requires": {"ocaml": [{"pkg": "ocaml", "checksum": "b"},
+                                           {"pkg": "ocaml", "checksum": "a"}],
+                                 "gcc": []}}
+        self.assertEqual(chrootpool.installed_requirements(manifest),
+                         {"ocaml": ["a", "b"], "gcc": []})
+
+    def test_similarity(self):
+        self.assertEqual(chrootpool.similarity(WANTED, WANTED), 1.0)
+        self.assertEqual(chrootpool.similarity({}, {}), 1.0)
+        extra = dict(WANTED, openssl=[])
+        self.assertEqual(chrootpool.similarity(extra, WANTED), 0.75)
+        stale = dict(WANTED, ocaml=["2222"])
+        self.assertEqual(chrootpool.similarity(stale, WANTED), 0.0)
+
+    def test_cold_slot_is_cleaned(self):
+        with self.pool.slot("config", WANTED) as (slot, reuse):
+            self.assertFalse(reuse)
+        self.assertEqual(slot.load_state(),
+                         {"config": "config", "requires": WANTED})
+
+    def test_warm_slot_is_reused(self):
+        with self.pool.slot("config", WANTED) as (first, _):
+            pass
+        with self.pool.slot("config", WANTED) as (second, reuse):
+            self.assertTrue(reuse)
+            self.assertEqual(second.index, first.index)
+
+    def test_can_reuse(self):
+        self.assertTrue(chrootpool.can_reuse(WANTED, WANTED))
+        self.assertTrue(chrootpool.can_reuse({"ocaml": ["1111"]}, WANTED))
+        self.assertFalse(chrootpool.can_reuse(dict(WANTED, openssl=[]),
+                                              WANTED))
+        self.assertFalse(chrootpool.can_reuse({"ocaml": ["2222"]}, WANTED))
+
+    def test_extra_packages_clean(self):
+        extra = dict(WANTED, openssl=[])
+        with self.pool.slot("config", extra):
+            pass
+        with self.pool.slot("config", WANTED) as (_, reuse):
+            self.assertFalse(reuse)
+
+    def test_unknown_config_cleans(self):
+        with self.pool.slot(None, WANTED):
+            pass
+        with self.pool.slot(None, WANTED) as (_, reuse):
+            self.assertFalse(reuse)
+
+    def test_config_change_cleans(self):
+        with self.pool.slot("config", WANTED):
+            pass
+        with self.pool.slot("new config", WANTED) as (_, reuse):
+            self.assertFalse(reuse)
+
+    def test_busy_slot_not_used(self):
+        with self.pool.slot("config", WANTED) as (first, _):
+            with self.pool.slot("config", WANTED) as (second, reuse):
+                self.assertNotEqual(first.index, second.index)
+                self.assertFalse(reuse)
+
+    def test_failed_build_forgets_state(self):
+        try:
+            with self.pool.slot("config", WANTED) as (slot, _):
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(slot.load_state(), None)
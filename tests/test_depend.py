@@ -3,12 +3,17 @@
 #   run 'nosetests' in the root of the repository
 
 import glob
+import json
 import os
+import shutil
+import StringIO
 import sys
+import tempfile
 import unittest
+from mock import patch
 
-import depend
-import pkg
+from planex import depend
+import planex.spec as pkg
 
 
 class BasicTests(unittest.TestCase):
@@ -74,3 +79,192 @@ class BasicTests(unittest.TestCase):
             "./RPMS/x86_64/ocaml-re-devel-1.2.1-1.el6.x86_64.rpm\n"
             "./RPMS/x86_64/ocaml-cohttp-devel-0.9.8-1.el6.x86_64.rpm: "
             "./RPMS/x86_64/ocaml-lwt-devel-2.4.3-1.el6.x86_64.rpm\n")
+
+
+def write_spec(path, name, version="1.0", provides=None, buildrequires=None):
+    """
+    Write a stand-in spec file, which fake_load_spec loads, so that
+    planex-depend can be run without rpm
+    """
+    record = {
+        "spec_path": path, "pkg_name": name, "pkg_version": version,
+        "urls": ["http://example.com/%s-%s.tar.gz" % (name, version)],
+        "paths": ["./SOURCES/%s-%s.tar.gz" % (name, version)],
+        "provided": sorted([name, name + "-devel"] + (provides or [])),
+        "buildrequired": sorted(buildrequires or []),
+        "srpm_path": "./SRPMS/%s-%s-1.src.rpm" % (name, version),
+        "rpm_paths": ["./RPMS/x86_64/%s-%s-1.x86_64.rpm" % (name, version)]}
+    with open(path, "w") as spec_file:
+        json.dump(record, spec_file)
+
+
+def fake_load_spec(path, **_):
+    """Load a spec file written by write_spec"""
+    with open(path) as spec_file:
+        return pkg.SpecRecord(**json.load(spec_file))
+
+
+class DependTestCase(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.specs = {}
+        write_spec(self.spec("ocaml-uri"), "ocaml-uri")
+        write_spec(self.spec("ocaml-lwt"), "ocaml-lwt")
+        write_spec(self.spec("ocaml-re"), "ocaml-re",
+                   buildrequires=["ocaml-uri-devel"])
+        write_spec(self.spec("ocaml-cohttp"), "ocaml-cohttp",
+                   buildrequires=["ocaml-re-devel", "ocaml-uri-devel",
+                                  "libfoo"])
+        self.patches = [patch("planex.spec.load_spec",
+                              side_effect=fake_load_spec),
+                        patch("planex.depend.build_type",
+                              return_value="rpm")]
+        self.load_spec = self.patches[0].start()
+        self.patches[1].start()
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        for patcher in self.patches:
+            patcher.stop()
+        shutil.rmtree(self.working_dir)
+
+    def spec(self, name):
+        """Return the path of the spec file for name"""
+        path = os.path.join(self.working_dir, "%s.spec" % name)
+        self.specs[name] = path
+        return path
+
+    def parse(self, *argv):
+        """Parse planex-depend arguments for all the spec files"""
+        return depend.parse_cmdline(["-p", "rpm"] + list(argv) +
+                                    sorted(self.specs.values()))
+
+    def run_depend(self, *argv):
+        """Run planex-depend, returning the rules it prints"""
+        output = StringIO.StringIO()
+        with patch("sys.stdout", output):
+            depend.print_rules(self.parse(*argv))
+        return output.getvalue()
+
+
+class ParallelLoadTests(DependTestCase):
+    def test_records_match_serial(self):
+        spec_paths = sorted(self.specs.values())
+        serial = depend.load_specs(self.parse("--jobs", "1"), spec_paths)
+        parallel = depend.load_specs(self.parse("--jobs", "2"), spec_paths)
+        self.assertEqual([record.to_dict() for record in parallel],
+                         [record.to_dict() for record in serial])
+        self.assertEqual([record.specpath() for record in parallel],
+                         spec_paths)
+
+    def test_rules_match_serial(self):
+        serial = self.run_depend("--jobs", "1")
+        self.assertEqual(self.run_depend("--jobs", "2"), serial)
+        self.assertTrue("ocaml-re-1.0-1.x86_64.rpm: "
+                        "./RPMS/x86_64/ocaml-uri-1.0-1.x86_64.rpm" in serial)
+
+
+class FragmentTests(DependTestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        DependTestCase.setUp(self)
+        self.depdir = os.path.join(self.working_dir, "deps.d")
+        self.run_depend("--depdir", self.depdir)
+        for name in self.specs:
+            os.utime(self.fragment(name), (1000, 1000))
+        self.load_spec.reset_mock()
+        patcher = patch("planex.depend.print_spec_rules",
+                        wraps=depend.print_spec_rules)
+        self.print_spec_rules = patcher.start()
+        self.patches.append(patcher)
+
+    def fragment(self, name):
+        """Return the path of the fragment for name"""
+        return os.path.join(self.depdir, "%s.d" % name)
+
+    def regenerated(self):
+        """
+        Return the names of the specs whose fragments were regenerated,
+        checking that the others were left untouched
+        """
+        names = sorted(call[0][0].name()
+                       for call in self.print_spec_rules.call_args_list)
+        for name in self.specs:
+            if name not in names:
+                self.assertEqual(os.path.getmtime(self.fragment(name)), 1000)
+        return names
+
+    def loaded(self):
+        """Return the paths of the spec files which were loaded"""
+        return sorted(call[0][0] for call in self.load_spec.call_args_list)
+
+    def test_fragments_included(self):
+        output = self.run_depend("--depdir", self.depdir)
+        for name in self.specs:
+            self.assertTrue("-include %s" % self.fragment(name) in output)
+
+    def test_nothing_changed(self):
+        self.run_depend("--depdir", self.depdir)
+        self.assertEqual(self.regenerated(), [])
+        self.assertEqual(self.loaded(), [])
+
+    def test_only_edited_spec_regenerated(self):
+        write_spec(self.specs["ocaml-cohttp"], "ocaml-cohttp", "2.0",
+                   buildrequires=["ocaml-re-devel", "ocaml-uri-devel"])
+        self.run_depend("--depdir", self.depdir)
+        self.assertEqual(self.regenerated(), ["ocaml-cohttp"])
+        self.assertEqual(self.loaded(), [self.specs["ocaml-cohttp"]])
+        with open(self.fragment("ocaml-cohttp")) as fragment:
+            self.assertTrue("ocaml-cohttp-2.0-1.src.rpm" in fragment.read())
+
+    def test_changed_edges_regenerated(self):
+        # ocaml-cohttp's requirement on libfoo now resolves to ocaml-lwt
+        write_spec(self.specs["ocaml-lwt"], "ocaml-lwt", provides=["libfoo"])
+        self.run_depend("--depdir", self.depdir)
+        self.assertEqual(self.regenerated(), ["ocaml-cohttp", "ocaml-lwt"])
+        self.assertEqual(self.loaded(), [self.specs["ocaml-lwt"]])
+        with open(self.fragment("ocaml-cohttp")) as fragment:
+            self.assertTrue("ocaml-lwt-1.0-1.x86_64.rpm" in fragment.read())
+
+    def test_removed_spec_fragment_deleted(self):
+        os.unlink(self.specs.pop("ocaml-lwt"))
+        self.run_depend("--depdir", self.depdir)
+        self.assertFalse(os.path.exists(self.fragment("ocaml-lwt")))
+        self.assertEqual(self.regenerated(), [])
+
+    def test_ignored_spec_fragment_deleted(self):
+        self.run_depend("--depdir", self.depdir, "--ignore", "ocaml-lwt")
+        self.assertFalse(os.path.exists(self.fragment("ocaml-lwt")))
+        del self.specs["ocaml-lwt"]
+        self.assertEqual(self.regenerated(), [])
+
+    def test_option_change_regenerates_all(self):
+        self.run_depend("--depdir", self.depdir, "--dist", ".el7")
+        self.assertEqual(self.loaded(), sorted(self.specs.values()))
+        self.assertEqual(self.regenerated(), sorted(self.specs))
+
+
+class NinjaTests(DependTestCase):
+    def test_regen_rule(self):
+        output = os.path.join(self.working_dir, "build.ninja")
+        lines = self.run_depend("--format", "ninja",
+                                "--output", output).splitlines()
+        rule = lines.index("rule regen")
+        command = lines[rule + 1]
+        self.assertTrue(command.startswith("  command = planex-depend "))
+        self.assertEqual(depend.parse_cmdline(command.split()[3:]).argv,
+                         self.parse("--format", "ninja",
+                                    "--output", output).argv)
+        self.assertTrue("  generator = 1" in lines[rule:lines.index("", rule)])
+        self.assertTrue("  restat = 1" in lines[rule:lines.index("", rule)])
+        self.assertTrue("build %s: regen %s" % (
+            output, " ".join(sorted(self.specs.values()))) in lines)
+
+    def test_regen_defaults_to_build_ninja(self):
+        ninja = self.run_depend("--format", "ninja")
+        self.assertTrue(" --output build.ninja\n" in ninja)
+        self.assertTrue("\nbuild build.ninja: regen " in ninja)
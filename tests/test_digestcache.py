@@ -0,0 +1,70 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from mock import patch
+
+from planex import digestcache
+
+
+class DigestCacheTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.working_dir, "digests.json")
+        self.paths = []
+        for name in ["a", "b", "c"]:
+            path = os.path.join(self.working_dir, name)
+            with open(path, "w") as data:
+                data.write(name * 1000)
+            old = time.time() - 60
+            os.utime(path, (old, old))
+            self.paths.append(path)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.working_dir)
+
+    def test_digests(self):
+        digests = digestcache.file_digests(self.paths, "sha256",
+                                           self.cache_path)
+        self.assertEqual(digests[self.paths[0]],
+                         hashlib.sha256("a" * 1000).hexdigest())
+
+    def test_unchanged_files_not_rehashed(self):
+        digestcache.file_digests(self.paths, "md5", self.cache_path)
+        with patch("planex.digestcache.hash_file") as mock_hash_file:
+            digestcache.file_digests(self.paths, "md5", self.cache_path)
+            self.assertFalse(mock_hash_file.called)
+
+    def test_changed_file_rehashed(self):
+        digestcache.file_digests(self.paths, "md5", self.cache_path)
+        with open(self.paths[1], "w") as data:
+            data.write("changed")
+        mtime = time.time() + 10
+        os.utime(self.paths[1], (mtime, mtime))
+        digests = digestcache.file_digests(self.paths, "md5", self.cache_path)
+        self.assertEqual(digests[self.paths[1]],
+                         hashlib.md5("changed").hexdigest())
+
+    def test_recently_modified_file_not_cached(self):
+        with open(self.paths[0], "w") as data:
+            data.write("racy")
+        digestcache.file_digests(self.paths, "md5", self.cache_path)
+        with patch("planex.digestcache.hash_file") as mock_hash_file:
+            mock_hash_file.return_value = "digest"
+            digestcache.file_digests(self.paths, "md5", self.cache_path)
+            mock_hash_file.assert_called_once_with(self.paths[0], "md5")
+
+    def test_algorithms_cached_separately(self):
+        md5 = digestcache.file_digests(self.paths, "md5", self.cache_path)
+        sha = digestcache.file_digests(self.paths, "sha256", self.cache_path)
+        self.assertNotEqual(md5[self.paths[0]], sha[self.paths[0]])
@@ -0,0 +1,69 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from planex import failcache
+
+HASH = "0123456789abcdef0123456789abcdef"
+
+
+class FailCacheTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.cache_dir)
+
+    def test_parse_duration(self):
+        self.assertEqual(failcache.parse_duration("30"), 30)
+        self.assertEqual(failcache.parse_duration("90m"), 5400)
+        self.assertEqual(failcache.parse_duration("1.5h"), 5400)
+        self.assertEqual(failcache.parse_duration("2d"), 172800)
+        self.assertRaises(ValueError, failcache.parse_duration, "soon")
+
+    def test_build_log_tail(self):
+        with open(os.path.join(self.cache_dir, "build.log"), "w") as log:
+            log.write("".join("line %d\n" % i for i in range(100)))
+        tail = failcache.build_log_tail(self.cache_dir, "mock failed\n")
+        self.assertTrue(tail.startswith("==> build.log <==\nline 50\n"))
+        self.assertTrue(tail.endswith("line 99\n==> output <==\n"
+                                      "mock failed\n"))
+
+    def test_record_and_lookup(self):
+        self.assertEqual(failcache.lookup([self.cache_dir], HASH), None)
+        self.assertTrue(failcache.record(self.cache_dir, HASH,
+                                         "error: Bad exit status\n"))
+        failure = failcache.lookup([self.cache_dir], HASH)
+        self.assertEqual(failure["log"], "error: Bad exit status\n")
+        self.assertTrue(HASH in failcache.describe(HASH, failure))
+
+    def test_expiry(self):
+        path = failcache.failure_path(self.cache_dir, HASH)
+        with open(path, "w") as failure_file:
+            json.dump({"time": time.time() - 7200, "log": ""}, failure_file)
+        self.assertNotEqual(
+            failcache.lookup([self.cache_dir], HASH, ttl=86400), None)
+        self.assertEqual(failcache.lookup([self.cache_dir], HASH, ttl=3600),
+                         None)
+        self.assertFalse(os.path.exists(path))
+
+    def test_infrastructure_failures_not_recorded(self):
+        log = "Error: Cannot retrieve repository metadata (repomd.xml)\n"
+        self.assertFalse(failcache.record(self.cache_dir, HASH, log))
+        self.assertEqual(failcache.lookup([self.cache_dir], HASH), None)
+
+    def test_clear(self):
+        failcache.record(self.cache_dir, HASH, "error\n")
+        failcache.clear([self.cache_dir], HASH)
+        self.assertEqual(os.listdir(self.cache_dir), [])
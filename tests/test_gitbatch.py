@@ -0,0 +1,95 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from planex import gitbatch
+
+
+def git(repo, *args):
+    """Run a git command in repo, returning its output"""
+    env = dict(os.environ, GIT_AUTHOR_NAME="planex",
+               GIT_AUTHOR_EMAIL="planex@example.com",
+               GIT_COMMITTER_NAME="planex",
+               GIT_COMMITTER_EMAIL="planex@example.com")
+    proc = subprocess.Popen(["git"] + list(args), cwd=repo, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (stdout, _) = proc.communicate()
+    assert proc.returncode == 0
+    return stdout.strip()
+
+
+class GitBatchTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.repo = tempfile.mkdtemp()
+        self.dotgitdir = os.path.join(self.repo, ".git")
+        git(self.repo, "init", "-q")
+        git(self.repo, "commit", "-q", "--allow-empty", "-m", "first")
+        self.first = git(self.repo, "rev-parse", "HEAD")
+        git(self.repo, "tag", "-a", "-m", "release", "v1.0")
+        git(self.repo, "commit", "-q", "--allow-empty", "-m", "second")
+        self.second = git(self.repo, "rev-parse", "HEAD")
+        git(self.repo, "tag", "v1.1")
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        gitbatch.close_all()
+        shutil.rmtree(self.repo)
+
+    def test_resolve(self):
+        self.assertEqual(gitbatch.commit_of(self.dotgitdir, "HEAD"),
+                         self.second)
+        self.assertEqual(gitbatch.commit_of(self.dotgitdir, "v1.0"),
+                         self.first)
+        self.assertNotEqual(gitbatch.resolve(self.dotgitdir, "v1.0"),
+                            self.first)
+        self.assertEqual(gitbatch.resolve(self.dotgitdir, "nonexistent"),
+                         None)
+
+    def test_process_is_reused(self):
+        first = gitbatch.batch_check(self.dotgitdir)
+        gitbatch.resolve(self.dotgitdir, "HEAD")
+        self.assertTrue(gitbatch.batch_check(self.dotgitdir) is first)
+
+    def test_tags(self):
+        self.assertEqual(gitbatch.tags(self.dotgitdir), ["v1.0", "v1.1"])
+        git(self.repo, "pack-refs", "--all")
+        self.assertEqual(gitbatch.tags(self.dotgitdir), ["v1.0", "v1.1"])
+
+    def test_tags_at(self):
+        self.assertEqual(gitbatch.tags_at(self.dotgitdir, self.first),
+                         ["v1.0"])
+        self.assertEqual(gitbatch.tags_at(self.dotgitdir, self.second),
+                         ["v1.1"])
+
+    def test_least_recently_used_process_is_closed(self):
+        first = gitbatch.batch_check(self.dotgitdir)
+        old_max = gitbatch.MAX_PROCESSES
+        gitbatch.MAX_PROCESSES = 1
+        try:
+            gitbatch.batch_check(self.repo)
+            self.assertTrue(first.proc.poll() is not None)
+        finally:
+            gitbatch.MAX_PROCESSES = old_max
+        self.assertEqual(gitbatch.commit_of(self.dotgitdir, "HEAD"),
+                         self.second)
+
+    def test_dead_process_is_closed(self):
+        dead = gitbatch.batch_check(self.dotgitdir)
+        dead.proc.kill()
+        dead.proc.wait()
+        self.assertRaises(gitbatch.GitBatchError, gitbatch.resolve,
+                          self.dotgitdir, "HEAD")
+        self.assertTrue(dead.proc.stdin.closed)
+        self.assertTrue(dead.proc.stdout.closed)
+        self.assertEqual(gitbatch.commit_of(self.dotgitdir, "HEAD"),
+                         self.second)
+        self.assertFalse(gitbatch.batch_check(self.dotgitdir) is dead)
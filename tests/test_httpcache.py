@@ -0,0 +1,133 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import httplib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from planex import cacheserver
+from planex import httpcache
+
+
+class SplitCachedirsTests(unittest.TestCase):
+    def test_local_only(self):
+        self.assertEqual(
+            httpcache.split_cachedirs("~/.planex-cache:/misc/cache"),
+            ["~/.planex-cache", "/misc/cache"])
+
+    def test_urls(self):
+        self.assertEqual(
+            httpcache.split_cachedirs(
+                "~/.planex-cache:http://cache.example.com:8080/planex:"
+                "https://other.example.com/cache:/misc/cache"),
+            ["~/.planex-cache", "http://cache.example.com:8080/planex",
+             "https://other.example.com/cache", "/misc/cache"])
+
+
+class HttpCacheTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.server_dir = os.path.join(self.working_dir, "server")
+        self.local_dir = os.path.join(self.working_dir, "local")
+        os.mkdir(self.local_dir)
+        self.server = cacheserver.CacheServer(("127.0.0.1", 0),
+                                              self.server_dir)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.remote = httpcache.HttpCache(
+            "http://127.0.0.1:%d/" % self.server.server_address[1])
+
+        self.pkg_hash = "0123456789abcdef0123456789abcdef"
+        self.entry_dir = os.path.join(self.working_dir, self.pkg_hash)
+        os.makedirs(os.path.join(self.entry_dir, "output"))
+        for name in ["foo.rpm", "foo-devel.rpm", "build.log"]:
+            with open(os.path.join(self.entry_dir, "output", name),
+                      "w") as output:
+                output.write("contents of %s" % name)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.working_dir)
+
+    def test_miss(self):
+        self.assertFalse(self.remote.exists(self.pkg_hash))
+
+    def test_upload_and_fetch(self):
+        self.remote.upload(self.pkg_hash, self.entry_dir)
+        self.assertTrue(self.remote.exists(self.pkg_hash))
+
+        fetched = os.path.join(self.local_dir, self.pkg_hash)
+        self.remote.fetch(self.pkg_hash, fetched)
+        self.assertEqual(httpcache.entry_files(fetched),
+                         httpcache.entry_files(self.entry_dir))
+        with open(os.path.join(fetched, "output", "foo.rpm")) as rpm:
+            self.assertEqual(rpm.read(), "contents of foo.rpm")
+
+    def test_unpublished_entry_invisible(self):
+        self.remote.upload_file(self.pkg_hash, "output/foo.rpm",
+                                self.entry_dir, "1234")
+        self.assertFalse(self.remote.exists(self.pkg_hash))
+
+    def test_bad_path_rejected(self):
+        self.assertRaises(IOError, self.remote.download_file, "../etc",
+                          {"path": "passwd", "size": 0, "sha256": ""},
+                          self.local_dir)
+
+    def test_short_upload_rejected(self):
+        conn = httplib.HTTPConnection("127.0.0.1",
+                                      self.server.server_address[1])
+        conn.putrequest("PUT", "/%s/output/foo.rpm?upload=1234" %
+                        self.pkg_hash)
+        conn.putheader("Content-Length", "100")
+        conn.endheaders()
+        conn.send("truncated")
+        conn.sock.shutdown(socket.SHUT_WR)
+        self.assertEqual(conn.getresponse().status, 400)
+        conn.close()
+
+    def test_mismatched_upload_not_published(self):
+        self.remote.upload_file(self.pkg_hash, "output/foo.rpm",
+                                self.entry_dir, "1234")
+        record = httpcache.file_record(
+            "output/foo.rpm", os.path.join(self.entry_dir, "output",
+                                           "foo.rpm"))
+        record["sha256"] = "0" * 64
+        request = httpcache.MethodRequest(
+            "PUT", self.remote.entry_url(self.pkg_hash, "", "1234"),
+            json.dumps([record]))
+        try:
+            httpcache.urllib2.urlopen(request)
+            self.fail("Mismatched upload was published")
+        except httpcache.urllib2.HTTPError as err:
+            self.assertEqual(err.code, 409)
+        self.assertFalse(self.remote.exists(self.pkg_hash))
+
+    def test_concurrent_uploads_staged_separately(self):
+        self.remote.upload_file(self.pkg_hash, "output/foo.rpm",
+                                self.entry_dir, "1234")
+        self.remote.upload(self.pkg_hash, self.entry_dir)
+        self.assertTrue(self.remote.exists(self.pkg_hash))
+        self.assertTrue(os.path.isdir(os.path.join(
+            self.server_dir, ".upload-%s-1234" % self.pkg_hash)))
+
+    def test_corrupt_download_detected(self):
+        self.remote.upload(self.pkg_hash, self.entry_dir)
+        os.chmod(os.path.join(self.server_dir, self.pkg_hash, "output"),
+                 0755)
+        with open(os.path.join(self.server_dir, self.pkg_hash, "output",
+                               "foo.rpm"), "w") as output:
+            output.write("truncated")
+        self.assertRaises(IOError, self.remote.fetch, self.pkg_hash,
+                          os.path.join(self.local_dir, self.pkg_hash))
@@ -0,0 +1,71 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import unittest
+
+from planex import mockconfig
+
+YUM_CONF = """
+[main]
+# Comments and layout do not matter
+cachedir=/var/cache/yum
+debuglevel=1
+logfile=/var/log/yum.log
+gpgcheck=0
+
+[planex]
+name=Planex
+baseurl=file:///build/RPMS
+"""
+
+CONFIG_OPTS = {
+    "root": "planex-x86_64",
+    "target_arch": "x86_64",
+    "chroot_setup_cmd": "install @buildsys-build",
+    "macros": {"%_topdir": "/builddir/build", "%_smp_mflags": 4},
+    "plugin_conf": {"tmpfs_enable": False},
+    "yum.conf": YUM_CONF,
+}
+
+
+class MockConfigTests(unittest.TestCase):
+    def test_parse_keys(self):
+        self.assertEqual(mockconfig.parse_keys("macros, yum.conf,"),
+                         ["macros", "yum.conf"])
+
+    def test_normalise_yum_conf(self):
+        self.assertEqual(mockconfig.normalise_yum_conf(YUM_CONF), {
+            "main": {"gpgcheck": "0"},
+            "planex": {"name": "Planex",
+                       "baseurl": "file:///build/RPMS"}})
+
+    def test_cosmetic_yum_conf_changes(self):
+        edited = YUM_CONF.replace("debuglevel=1", "debuglevel = 10")
+        edited = edited.replace("[planex]", "# local repo\n[planex]")
+        self.assertEqual(mockconfig.normalise_yum_conf(YUM_CONF),
+                         mockconfig.normalise_yum_conf(edited))
+
+    def test_unparseable_yum_conf(self):
+        self.assertEqual(mockconfig.normalise_yum_conf("  gpgcheck=0\n\n"),
+                         ["gpgcheck=0"])
+
+    def test_normalise(self):
+        normalised = mockconfig.normalise(CONFIG_OPTS)
+        self.assertEqual(sorted(normalised),
+                         ["chroot_setup_cmd", "macros", "target_arch",
+                          "yum.conf"])
+        self.assertEqual(normalised["macros"]["%_smp_mflags"], 4)
+
+    def test_irrelevant_options(self):
+        edited = dict(CONFIG_OPTS)
+        edited["root"] = "another-root"
+        edited["plugin_conf"] = {"tmpfs_enable": True}
+        self.assertEqual(mockconfig.normalise(CONFIG_OPTS),
+                         mockconfig.normalise(edited))
+
+    def test_keys(self):
+        self.assertEqual(mockconfig.normalise(CONFIG_OPTS, keys=["root"]),
+                         {"root": "planex-x86_64"})
+        self.assertFalse("macros" in mockconfig.normalise(
+            CONFIG_OPTS, ignored=["macros"]))
@@ -0,0 +1,41 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import StringIO
+import unittest
+
+from planex import ninja
+
+
+class NinjaWriterTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.output = StringIO.StringIO()
+        self.writer = ninja.Writer(self.output)
+
+    def test_escape_path(self):
+        self.assertEqual(ninja.escape_path("a b:$c"), "a$ b$:$$c")
+
+    def test_rule(self):
+        self.writer.rule("mock", "planex-cache $in", pool="mock",
+                         restat=True)
+        self.assertEqual(self.output.getvalue(),
+                         "rule mock\n"
+                         "  command = planex-cache $in\n"
+                         "  pool = mock\n"
+                         "  restat = 1\n\n")
+
+    def test_build(self):
+        self.writer.build("foo.rpm", "mock", "foo.src.rpm",
+                          implicit=["bar.rpm"], order_only="repo",
+                          variables={"resultdir": "RPMS/"})
+        self.assertEqual(self.output.getvalue(),
+                         "build foo.rpm: mock foo.src.rpm | bar.rpm || repo\n"
+                         "  resultdir = RPMS/\n")
+
+    def test_pool(self):
+        self.writer.pool("mock", 4)
+        self.assertEqual(self.output.getvalue(),
+                         "pool mock\n  depth = 4\n\n")
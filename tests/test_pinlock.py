@@ -0,0 +1,67 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from planex import pinlock
+
+HEAD = "0123456789abcdef0123456789abcdef01234567"
+
+
+class PinLockTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.dotgitdir = os.path.join(self.working_dir, "repo", ".git")
+        os.makedirs(os.path.join(self.dotgitdir, "refs", "heads"))
+        with open(os.path.join(self.dotgitdir, "HEAD"), "w") as head:
+            head.write("ref: refs/heads/master\n")
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.working_dir)
+
+    def write_ref(self, commit):
+        path = os.path.join(self.dotgitdir, "refs", "heads", "master")
+        with open(path, "w") as ref:
+            ref.write(commit + "\n")
+
+    def test_git_state_from_ref_file(self):
+        self.write_ref(HEAD)
+        self.assertEqual(pinlock.git_state(self.dotgitdir)["head"], HEAD)
+
+    def test_git_state_from_packed_refs(self):
+        with open(os.path.join(self.dotgitdir, "packed-refs"), "w") as refs:
+            refs.write("# pack-refs with: peeled\n%s refs/heads/master\n" %
+                       HEAD)
+        self.assertEqual(pinlock.git_state(self.dotgitdir)["head"], HEAD)
+
+    def test_git_state_unborn_branch(self):
+        self.assertEqual(pinlock.git_state(self.dotgitdir), None)
+
+    def test_lookup(self):
+        self.write_ref(HEAD)
+        state = pinlock.git_state(self.dotgitdir)
+        lock = pinlock.PinLock(os.path.join(self.working_dir, "pins.json"))
+        self.assertEqual(lock.lookup("repo", state), None)
+        lock.update("repo", state, HEAD, "1.0")
+
+        lock = pinlock.PinLock(os.path.join(self.working_dir, "pins.json"))
+        self.assertEqual(lock.lookup("repo", state), (HEAD, "1.0"))
+        self.write_ref("f" * 40)
+        self.assertEqual(
+            lock.lookup("repo", pinlock.git_state(self.dotgitdir)), None)
+
+    def test_unwritable_not_recorded(self):
+        self.write_ref(HEAD)
+        state = pinlock.git_state(self.dotgitdir)
+        path = os.path.join(self.working_dir, "missing", "pins.json")
+        lock = pinlock.PinLock(path)
+        lock.update("repo", state, HEAD, "1.0")
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,149 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import unittest
+
+from planex import pkgcache
+
+
+def fake_rpm(payload):
+    """Return the contents of an RPM whose signature gives its size"""
+    lead = "\xed\xab\xee\xdb" + "\0" * 92
+    signature = pkgcache.RPM_HEADER_MAGIC + "\0" * 4 + \
+        struct.pack(">II", 1, 4) + \
+        struct.pack(">IIII", pkgcache.RPMSIGTAG_SIZE, 4, 0, 1) + \
+        struct.pack(">I", len(payload)) + "\0" * 4
+    return lead + signature + payload
+
+
+class PackageCacheTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.store_dir = tempfile.mkdtemp()
+        self.cache = pkgcache.PackageCache(self.store_dir)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.store_dir)
+
+    def write_metadata(self, root, repo, packages):
+        """Write YUM's metadata for a repository listing packages"""
+        gen_dir = os.path.join(self.cache.root_dir(root), repo, "gen")
+        if not os.path.isdir(gen_dir):
+            os.makedirs(gen_dir)
+        conn = sqlite3.connect(os.path.join(gen_dir, "primary_db.sqlite"))
+        conn.execute("CREATE TABLE packages (pkgId TEXT, "
+                     "checksum_type TEXT, location_href TEXT)")
+        for (filename, contents) in packages.items():
+            conn.execute("INSERT INTO packages VALUES (?, ?, ?)",
+                         (hashlib.sha256(contents).hexdigest(), "sha256",
+                          "Packages/%s" % filename))
+        conn.commit()
+        conn.close()
+
+    def download(self, root, repo, filename, contents):
+        """Pretend that YUM downloaded a package into root's cache"""
+        packages_dir = os.path.join(self.cache.root_dir(root), repo,
+                                    "packages")
+        if not os.path.isdir(packages_dir):
+            os.makedirs(packages_dir)
+        path = os.path.join(packages_dir, filename)
+        with open(path, "wb") as rpm_file:
+            rpm_file.write(contents)
+        return path
+
+    def test_rpm_is_complete(self):
+        path = os.path.join(self.store_dir, "foo.rpm")
+        with open(path, "wb") as rpm_file:
+            rpm_file.write(fake_rpm("x" * 100))
+        self.assertTrue(pkgcache.rpm_is_complete(path))
+        with open(path, "r+b") as rpm_file:
+            rpm_file.truncate(150)
+        self.assertFalse(pkgcache.rpm_is_complete(path))
+
+    def test_harvest_and_seed(self):
+        gcc = fake_rpm("gcc")
+        self.write_metadata("el6-a", "base", {"gcc.rpm": gcc})
+        self.cache.seed("el6-a", ["base"])
+        first = self.download("el6-a", "base", "gcc.rpm", gcc)
+        self.cache.harvest("el6-a")
+        obj = self.cache.object_path("sha256-%s" %
+                                     hashlib.sha256(gcc).hexdigest())
+        self.assertTrue(os.path.exists(obj))
+        self.assertFalse(os.path.samefile(first, obj))
+
+        # el6-b has no metadata of its own yet, so el6-a's is used
+        root_dir = self.cache.seed("el6-b", ["base", "epel"])
+        seeded = os.path.join(root_dir, "base", "packages", "gcc.rpm")
+        with open(seeded, "rb") as rpm_file:
+            self.assertEqual(rpm_file.read(), gcc)
+        self.assertFalse(os.listdir(os.path.join(root_dir, "epel",
+                                                 "packages")))
+
+    def test_seeded_copies_are_independent(self):
+        gcc = fake_rpm("gcc")
+        self.write_metadata("a", "base", {"gcc.rpm": gcc})
+        self.download("a", "base", "gcc.rpm", gcc)
+        self.cache.harvest("a")
+        root_dir = self.cache.seed("b", ["base"])
+        with open(os.path.join(root_dir, "base", "packages", "gcc.rpm"),
+                  "ab") as rpm_file:
+            rpm_file.write("appended by a resumed download")
+        (name,) = self.cache.objects()
+        self.assertTrue(pkgcache.verify(self.cache.object_path(name), name))
+
+    def test_identical_downloads_are_shared(self):
+        gcc = fake_rpm("gcc")
+        self.write_metadata("a", "base", {"gcc.rpm": gcc})
+        self.write_metadata("b", "updates", {"gcc.rpm": gcc})
+        self.download("a", "base", "gcc.rpm", gcc)
+        self.download("b", "updates", "gcc.rpm", gcc)
+        self.cache.harvest("a")
+        self.cache.harvest("b")
+        self.assertEqual(len(os.listdir(self.cache.objects_dir)), 1)
+
+    def test_partial_downloads_are_ignored(self):
+        gcc = fake_rpm("gcc")
+        self.write_metadata("a", "base", {"gcc.rpm": gcc})
+        self.download("a", "base", "gcc.rpm", gcc[:-1])
+        self.cache.harvest("a")
+        self.assertEqual(os.listdir(self.cache.objects_dir), [])
+
+    def test_mismatched_downloads_are_ignored(self):
+        self.write_metadata("a", "base", {"gcc.rpm": fake_rpm("gcc")})
+        self.download("a", "base", "gcc.rpm", fake_rpm("other"))
+        self.cache.harvest("a")
+        self.assertEqual(os.listdir(self.cache.objects_dir), [])
+
+    def test_unlisted_downloads_are_ignored(self):
+        self.download("a", "base", "gcc.rpm", fake_rpm("gcc"))
+        self.cache.harvest("a")
+        self.assertEqual(os.listdir(self.cache.objects_dir), [])
+
+    def test_evict(self):
+        packages = {"old.rpm": fake_rpm("x" * 1000),
+                    "new.rpm": fake_rpm("y" * 1000)}
+        self.write_metadata("a", "base", packages)
+        old = self.download("a", "base", "old.rpm", packages["old.rpm"])
+        new = self.download("a", "base", "new.rpm", packages["new.rpm"])
+        self.cache.harvest("a")
+        for (path, when) in [(old, 1000), (new, 2000)]:
+            os.utime(path, (when, when))
+        for name in self.cache.objects():
+            os.utime(self.cache.object_path(name), (1000, 1000))
+
+        evicted = self.cache.evict(2 * os.path.getsize(new))
+        self.assertEqual(evicted, ["sha256-%s" % hashlib.sha256(
+            packages["old.rpm"]).hexdigest()])
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(len(self.cache.objects()), 1)
@@ -2,8 +2,12 @@
 #   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
 #   run 'nosetests' in the root of the repository
 
+import os
+import shutil
+import tempfile
 import unittest
 import platform
+from mock import patch
 import planex.spec
 
 
@@ -95,6 +99,62 @@ class RpmTests(unittest.TestCase):
         )
 
 
+class SpecRecordTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved_env = os.environ.get(planex.spec.SPEC_CACHE_ENV)
+        os.environ[planex.spec.SPEC_CACHE_ENV] = self.cache_dir
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        if self.saved_env is None:
+            del os.environ[planex.spec.SPEC_CACHE_ENV]
+        else:
+            os.environ[planex.spec.SPEC_CACHE_ENV] = self.saved_env
+        shutil.rmtree(self.cache_dir)
+
+    def test_record_matches_spec(self):
+        spec = planex.spec.Spec("tests/data/ocaml-cohttp.spec", dist=".el6")
+        record = planex.spec.load_spec("tests/data/ocaml-cohttp.spec",
+                                       dist=".el6")
+        for method in ["specpath", "name", "version", "provides",
+                       "source_urls", "source_paths", "buildrequires",
+                       "source_package_path", "binary_package_paths"]:
+            self.assertEqual(getattr(record, method)(),
+                             getattr(spec, method)())
+
+    def test_record_is_cached(self):
+        first = planex.spec.load_spec("tests/data/ocaml-cohttp.spec")
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        with patch("planex.spec.Spec") as spec:
+            second = planex.spec.load_spec("tests/data/ocaml-cohttp.spec")
+            self.assertFalse(spec.called)
+        self.assertEqual(second.to_dict(), first.to_dict())
+
+    def test_dist_is_part_of_key(self):
+        planex.spec.load_spec("tests/data/ocaml-cohttp.spec", dist=".el6")
+        record = planex.spec.load_spec("tests/data/ocaml-cohttp.spec",
+                                       dist=".el7")
+        self.assertTrue(record.source_package_path().endswith(".el7.src.rpm"))
+
+    def test_topdir_is_part_of_key_as_given(self):
+        key = planex.spec.spec_record_key(
+            "tests/data/ocaml-cohttp.spec", "rpm", "", "planex-build-root",
+            None)
+        self.assertNotEqual(key, planex.spec.spec_record_key(
+            "tests/data/ocaml-cohttp.spec", "rpm", "",
+            os.path.abspath("planex-build-root"), None))
+
+    def test_bad_filename(self):
+        for _ in range(2):
+            self.assertRaises(planex.spec.SpecNameMismatch,
+                              planex.spec.load_spec,
+                              "tests/data/bad-name.spec")
+
+
 class DebTests(unittest.TestCase):
     def setUp(self):
         # 'setUp' breaks Pylint's naming rules
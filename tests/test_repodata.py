@@ -0,0 +1,68 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from planex import repodata
+
+
+def fake_createrepo(cmd):
+    """Pretend to run createrepo, creating repomd.xml"""
+    repodir = cmd[-1]
+    if not os.path.isdir(os.path.join(repodir, "repodata")):
+        os.makedirs(os.path.join(repodir, "repodata"))
+    open(os.path.join(repodir, "repodata", "repomd.xml"), "w").close()
+
+
+class RepodataTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.repodir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.repodir)
+
+    def make_pkg(self, name):
+        path = os.path.join(self.repodir, name)
+        open(path, "w").close()
+        return path
+
+    @patch("planex.repodata.run")
+    def test_initial_refresh_scans(self, mock_run):
+        mock_run.side_effect = fake_createrepo
+        self.make_pkg("foo-1.0-1.x86_64.rpm")
+        self.assertTrue(repodata.refresh(self.repodir))
+        state = repodata.load_state(self.repodir)
+        self.assertEqual(state["packages"].keys(), ["foo-1.0-1.x86_64.rpm"])
+
+    @patch("planex.repodata.run")
+    def test_refresh_only_when_pending(self, mock_run):
+        mock_run.side_effect = fake_createrepo
+        repodata.refresh(self.repodir)
+        self.assertFalse(repodata.refresh(self.repodir))
+        repodata.add(self.repodir, [self.make_pkg("foo-1.0-1.x86_64.rpm")])
+        repodata.add(self.repodir, [self.make_pkg("bar-1.0-1.x86_64.rpm")])
+        self.assertTrue(repodata.refresh(self.repodir))
+        self.assertFalse(repodata.refresh(self.repodir))
+        self.assertEqual(mock_run.call_count, 2)
+
+        state = repodata.load_state(self.repodir)
+        self.assertEqual(sorted(state["packages"].keys()),
+                         ["bar-1.0-1.x86_64.rpm", "foo-1.0-1.x86_64.rpm"])
+        self.assertEqual(state["pending"], {})
+
+    @patch("planex.repodata.run")
+    def test_unchanged_package_not_pending(self, mock_run):
+        mock_run.side_effect = fake_createrepo
+        pkg = self.make_pkg("foo-1.0-1.x86_64.rpm")
+        repodata.refresh(self.repodir)
+        repodata.add(self.repodir, [pkg])
+        self.assertFalse(repodata.refresh(self.repodir))
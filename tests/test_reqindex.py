@@ -0,0 +1,108 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from planex import reqindex
+
+
+def fake_package(name, version, checksum, provides=None):
+    pkg = mock.Mock()
+    pkg.name = name
+    pkg.arch = "x86_64"
+    pkg.version = version
+    pkg.provides = [(name, "EQ", ("0", version, "1"))] + (provides or [])
+    pkg.verGT = lambda other: pkg.version > other.version
+    pkg.returnChecksums.return_value = [("sha256", checksum, 1)]
+    pkg.returnLocalHeader.return_value = mock.Mock(
+        filedigestalgo=8, filenames=["/usr/lib/%s" % name],
+        filedigests=["digest-%s" % checksum])
+    pkg.__str__ = lambda _: "%s-%s" % (name, version)
+    return pkg
+
+
+class RequirementIndexTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.repodir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.repodir, "repodata"))
+        self.set_revision("1")
+        self.yumbase = mock.Mock()
+        self.yumbase.pkgSack.returnPackages.return_value = [
+            fake_package("foo", "1.0", "aaa"),
+            fake_package("foo", "2.0", "bbb"),
+            fake_package("bar", "1.0", "ccc",
+                         [("libbar.so.1()(64bit)", None, (None, None, None))])]
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.repodir)
+
+    def set_revision(self, revision):
+        with open(os.path.join(self.repodir, "repodata", "repomd.xml"),
+                  "w") as repomd:
+            repomd.write(revision)
+
+    def test_newest_only(self):
+        index = reqindex.RequirementIndex(self.repodir)
+        index.update(self.yumbase)
+        self.assertEqual([pkg["checksum"] for pkg in index.lookup("foo")],
+                         ["bbb"])
+        self.assertEqual(index.lookup("foo")[0]["files"],
+                         [("/usr/lib/foo", "digest-bbb")])
+        self.assertEqual(index.lookup("baz"), [])
+
+    def test_persisted(self):
+        reqindex.RequirementIndex(self.repodir).update(self.yumbase)
+        self.yumbase.reset_mock()
+        index = reqindex.RequirementIndex(self.repodir)
+        index.update(self.yumbase)
+        self.assertFalse(self.yumbase.pkgSack.returnPackages.called)
+        self.assertEqual(index.lookup("bar")[0]["checksum"], "ccc")
+
+    def test_only_new_packages_indexed(self):
+        reqindex.RequirementIndex(self.repodir).update(self.yumbase)
+        self.set_revision("2")
+        self.yumbase.reset_mock()
+        self.yumbase.pkgSack.returnPackages.return_value.append(
+            fake_package("baz", "1.0", "ddd"))
+        index = reqindex.RequirementIndex(self.repodir)
+        index.update(self.yumbase)
+        self.assertEqual(self.yumbase.downloadHeader.call_count, 1)
+        self.assertEqual(index.lookup("baz")[0]["checksum"], "ddd")
+
+    def test_virtual_provides(self):
+        index = reqindex.RequirementIndex(self.repodir)
+        index.update(self.yumbase)
+        self.assertEqual(
+            [pkg["checksum"] for pkg in index.lookup("libbar.so.1()(64bit)")],
+            ["ccc"])
+        self.assertEqual(index.lookup("bar")[0]["provides"][0],
+                         ["bar", "EQ", "1.0-1"])
+
+    def test_file_provides(self):
+        index = reqindex.RequirementIndex(self.repodir)
+        index.update(self.yumbase)
+        self.assertEqual([pkg["checksum"] for pkg
+                          in index.lookup("/usr/lib/bar")], ["ccc"])
+        self.assertEqual(index.lookup("/usr/lib/baz"), [])
+
+    def test_old_format_rebuilt(self):
+        with open(os.path.join(self.repodir, reqindex.INDEX_FILE),
+                  "w") as index_file:
+            json.dump({"revision": reqindex.repo_revision(self.repodir),
+                       "names": {"foo": ["aaa"]}, "packages": {}},
+                      index_file)
+        index = reqindex.RequirementIndex(self.repodir)
+        index.update(self.yumbase)
+        self.assertTrue(self.yumbase.pkgSack.returnPackages.called)
+        self.assertEqual([pkg["checksum"] for pkg in index.lookup("foo")],
+                         ["bbb"])
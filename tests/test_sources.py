@@ -1,3 +1,4 @@
+import argparse
 import unittest
 import mock
 from mock import patch
@@ -5,6 +6,8 @@ import tempfile
 import os
 import subprocess
 import shutil
+import threading
+import time
 
 from planex import sources
 from planex import exceptions
@@ -329,6 +332,52 @@ class FileTests(unittest.TestCase):
         self.assertEqual(source.clone_commands(), [])
 
 
+class SharedSourceTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.sources_dir = os.path.join(self.working_dir, "SOURCES")
+        os.mkdir(self.sources_dir)
+        self.config = argparse.Namespace(repos_path=self.working_dir)
+        self.url = "http://host.com/foo-1.0.tar.gz"
+        self.final_path = os.path.join(self.sources_dir, "foo-1.0.tar.gz")
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.working_dir)
+
+    def test_download_renamed_into_place(self):
+        commands = sources.source(self.url, self.config).archive_commands(
+            self.sources_dir)
+        tmp_path = commands[0][commands[0].index("-o") + 1]
+        self.assertNotEqual(tmp_path, self.final_path)
+        self.assertEqual(os.path.dirname(tmp_path), self.sources_dir)
+        self.assertEqual(commands[-1], ["mv", "-f", tmp_path, self.final_path])
+
+    @patch("planex.sources.run")
+    def test_shared_source_fetched_once(self, mock_run):
+        def run(cmd):
+            time.sleep(0.05)
+            if cmd[0] == "mv":
+                os.rename(cmd[2], cmd[3])
+            else:
+                open(cmd[cmd.index("-o") + 1], "w").close()
+        mock_run.side_effect = run
+
+        threads = [threading.Thread(
+            target=sources.source(self.url, self.config).archive,
+            args=(self.sources_dir,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(mock_run.call_count, 2)
+        self.assertTrue(os.path.exists(self.final_path))
+
+
 class OtherTests(unittest.TestCase):
     def setUp(self):
         self.config = clone.parse_args_or_exit(
@@ -0,0 +1,90 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from mock import patch
+
+from planex import srpm
+
+
+def cpio_member(name, contents):
+    """Return a 'newc' format cpio entry for a file"""
+    def pad(data):
+        return data + "\0" * (-len(data) % 4)
+    fields = [0, 0100644, 0, 0, 1, 0, len(contents), 0, 0, 0, 0,
+              len(name) + 1, 0]
+    header = "070701" + "".join("%08x" % field for field in fields)
+    return pad(header + name + "\0") + pad(contents)
+
+
+class CpioTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.archive = (cpio_member("foo-1.0.tar.gz", "tarball") +
+                        cpio_member("foo.spec", "Name: foo\n") +
+                        cpio_member(srpm.CPIO_TRAILER, ""))
+
+    def test_members(self):
+        self.assertEqual(list(srpm.cpio_members([self.archive])),
+                         [("foo-1.0.tar.gz", "tarball"),
+                          ("foo.spec", "Name: foo\n")])
+
+    def test_members_chunked(self):
+        chunks = [self.archive[i:i + 7]
+                  for i in range(0, len(self.archive), 7)]
+        self.assertEqual(list(srpm.cpio_members(chunks)),
+                         [("foo-1.0.tar.gz", "tarball"),
+                          ("foo.spec", "Name: foo\n")])
+
+
+class SrpmIndexTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.working_dir, "index.json")
+        self.srpm = os.path.join(self.working_dir, "foo-1.0-1.src.rpm")
+        with open(self.srpm, "w") as srpm_file:
+            srpm_file.write("srpm")
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.working_dir)
+
+    def test_persisted(self):
+        index = srpm.SrpmIndex(self.index_path)
+        index.update(self.srpm, {"srcrpm": self.srpm})
+        index.save()
+        index = srpm.SrpmIndex(self.index_path)
+        self.assertEqual(index.lookup(self.srpm), {"srcrpm": self.srpm})
+
+    def test_stale_when_changed(self):
+        index = srpm.SrpmIndex(self.index_path)
+        index.update(self.srpm, {"srcrpm": self.srpm})
+        mtime = time.time() + 10
+        os.utime(self.srpm, (mtime, mtime))
+        self.assertEqual(index.lookup(self.srpm), None)
+
+    def test_prune(self):
+        index = srpm.SrpmIndex(self.index_path)
+        index.update(self.srpm, {"srcrpm": self.srpm})
+        index.prune([])
+        self.assertEqual(index.entries, {})
+
+    @patch("planex.srpm.srpm_files")
+    def test_srpms_by_name(self, mock_srpm_files):
+        files = {"foo.spec": "1234"}
+        mock_srpm_files.return_value = {"name": "foo", "files": files}
+        expected = {"foo": [(self.srpm, files)]}
+        self.assertEqual(srpm.srpms_by_name([self.srpm], self.index_path),
+                         expected)
+        self.assertEqual(srpm.srpms_by_name([self.srpm], self.index_path),
+                         expected)
+        self.assertEqual(mock_srpm_files.call_count, 1)
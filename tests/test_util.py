@@ -0,0 +1,133 @@
+# Run these tests with 'nosetests':
+#   install the 'python-nose' package (Fedora/CentOS or Ubuntu)
+#   run 'nosetests' in the root of the repository
+
+import errno
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+from mock import patch
+
+from planex import util
+
+
+class LinkOrCopyTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.working_dir, "foo.rpm")
+        with open(self.src, "w") as src:
+            src.write("package")
+        self.dst_dir = os.path.join(self.working_dir, "RPMS")
+        os.mkdir(self.dst_dir)
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.working_dir)
+
+    def test_hardlink(self):
+        dst = util.link_or_copy(self.src, self.dst_dir)
+        self.assertEqual(dst, os.path.join(self.dst_dir, "foo.rpm"))
+        self.assertEqual(os.stat(dst).st_ino, os.stat(self.src).st_ino)
+
+    def test_replaces_existing(self):
+        dst = os.path.join(self.dst_dir, "foo.rpm")
+        with open(dst, "w") as old:
+            old.write("old")
+        util.link_or_copy(self.src, dst)
+        with open(dst) as new:
+            self.assertEqual(new.read(), "package")
+
+    @patch("os.link")
+    @patch("planex.util.reflink")
+    def test_copy_across_devices(self, mock_reflink, mock_link):
+        mock_link.side_effect = OSError(errno.EXDEV, "cross-device link")
+        mock_reflink.side_effect = IOError(errno.EOPNOTSUPP, "no reflink")
+        dst = util.link_or_copy(self.src, self.dst_dir)
+        self.assertNotEqual(os.stat(dst).st_ino, os.stat(self.src).st_ino)
+        with open(dst) as copied:
+            self.assertEqual(copied.read(), "package")
+
+    def test_make_read_only(self):
+        util.make_read_only(self.working_dir)
+        self.assertFalse(os.stat(self.src).st_mode & 0222)
+
+    @patch("planex.util.reflink")
+    def test_clone_or_copy_replaces_read_only(self, mock_reflink):
+        mock_reflink.side_effect = IOError(errno.EOPNOTSUPP, "no reflink")
+        dst = os.path.join(self.dst_dir, "foo.rpm")
+        util.clone_or_copy(self.src, dst, 0444)
+        util.clone_or_copy(self.src, dst, 0444)
+        self.assertEqual(os.stat(dst).st_mode & 0777, 0444)
+        self.assertNotEqual(os.stat(dst).st_ino, os.stat(self.src).st_ino)
+        self.assertEqual(os.listdir(self.dst_dir), ["foo.rpm"])
+
+
+class WriteIfChangedTests(unittest.TestCase):
+    def setUp(self):
+        # 'setUp' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        self.working_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.working_dir, "foo.spec")
+        with open(self.path, "w") as spec:
+            spec.write("Name: foo\n")
+        os.utime(self.path, (1000, 1000))
+
+    def tearDown(self):
+        # 'tearDown' breaks Pylint's naming rules
+        # pylint: disable=C0103
+        shutil.rmtree(self.working_dir)
+
+    def test_unchanged(self):
+        self.assertFalse(util.write_if_changed(self.path, "Name: foo\n"))
+        self.assertEqual(os.path.getmtime(self.path), 1000)
+
+    def test_changed(self):
+        self.assertTrue(util.write_if_changed(self.path, "Name: bar\n"))
+        with open(self.path) as spec:
+            self.assertEqual(spec.read(), "Name: bar\n")
+
+    def test_atomic_write(self):
+        util.atomic_write(self.path, "Name: bar\n")
+        with open(self.path) as spec:
+            self.assertEqual(spec.read(), "Name: bar\n")
+        self.assertEqual(os.listdir(self.working_dir), ["foo.spec"])
+
+    def test_copy_if_changed(self):
+        dst = os.path.join(self.working_dir, "copy.spec")
+        self.assertTrue(util.copy_if_changed(self.path, dst))
+        self.assertFalse(util.copy_if_changed(self.path, dst))
+
+
+class GroupedOutputTests(unittest.TestCase):
+    def test_jobs_are_not_interleaved(self):
+        stream = StringIO.StringIO()
+        output = util.GroupedOutput(stream)
+        first_started = threading.Event()
+        second_done = threading.Event()
+
+        def first():
+            output.begin()
+            output.write("first 1\n")
+            first_started.set()
+            second_done.wait()
+            output.write("first 2\n")
+            output.end()
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        first_started.wait()
+        output.begin()
+        output.write("second\n")
+        output.end()
+        second_done.set()
+        thread.join()
+        output.write("done\n")
+
+        self.assertEqual(stream.getvalue(),
+                         "second\nfirst 1\nfirst 2\ndone\n")